@@ -0,0 +1,76 @@
+'''
+Background analysis of the opened workspaces: QC flags of their ROIs (see qc.py), then
+suggested slices of their ROIs (see suggest.py), so that opening a workspace never waits for them
+'''
+
+import threading
+
+import perf
+import qc
+import suggest
+
+
+# Analyses run on each submitted workspace, in order: name -> function(Workspace)
+ANALYSES = [
+    ('qc', lambda ws: qc.workspace_qc(ws.rois)),
+    # Edge alignment on the slices already loaded or cached only: decoding the images of every
+    # slice would evict the ones being reviewed from the sequence budget
+    ('suggestions', lambda ws: suggest.suggest(ws, loaded_only=True)),
+]
+
+
+class AnalysisWorker:
+    '''
+    Background thread running the analyses of the opened workspaces
+    Workspaces are analysed one at a time, the most recently submitted one first. Results of a
+    workspace cancelled meanwhile (e.g. closed) are dropped. The callback is called from the
+    worker thread, once per analysis.
+    '''
+
+    def __init__(self, on_done, analyses=ANALYSES):
+        '''
+        :param on_done: callback(workspace path, analysis name, result)
+        :param analyses: list of (name, function(Workspace) -> result)
+        '''
+        self.on_done = on_done
+        self.analyses = analyses
+        self.jobs = []
+        self.current = None
+        self.generation = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='analysis-worker', daemon=True)
+        self.thread.start()
+
+    def submit(self, ws):
+        ''' Analyse a workspace next (replaces a pending analysis of the same file) '''
+        with self.condition:
+            self.jobs = [ws] + [job for job in self.jobs if job.filename != ws.filename]
+            self.condition.notify()
+
+    def cancel(self, ws=None):
+        ''' Drop the analyses of a workspace (default: of all workspaces) '''
+        with self.condition:
+            self.jobs = [] if ws is None else [job for job in self.jobs if job is not ws]
+            if ws is None or self.current is ws:
+                self.generation += 1
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.jobs:
+                    self.condition.wait()
+                ws = self.current = self.jobs.pop(0)
+                generation = self.generation
+            for name, function in self.analyses:
+                if generation != self.generation:
+                    break
+                try:
+                    with perf.hot.timed('analysis.{}'.format(name)):
+                        result = function(ws)
+                except Exception:
+                    # No result (e.g. workspace closed meanwhile, or unexpected ROI data)
+                    continue
+                if generation == self.generation:
+                    self.on_done(ws.filename, name, result)
+            with self.condition:
+                self.current = None
@@ -0,0 +1,109 @@
+'''
+Save backends, used to write user-set ROI corrections into workspaces
+Both expose update_workspace_corrected(corrected_names, corrected_seqindex, in_file, out_file)
+with the same semantics as update_workspace_corrected.m
+'''
+
+import threading
+
+import perf
+import workspace
+
+
+class NativeBackend:
+    '''
+    Pure Python backend (default)
+    Only the 'roi' struct is rewritten, other workspace variables are kept as opaque bytes
+    '''
+    name = 'native'
+
+    def update_workspace_corrected(self, corrected_names, corrected_seqindex, in_file, out_file):
+        workspace.update_workspace_corrected(corrected_names, corrected_seqindex, in_file, out_file)
+
+    def quit(self):
+        pass
+
+
+class MatlabBackend:
+    '''
+    Matlab engine backend, calling update_workspace_corrected.m
+    (Matlab reloads and saves workspaces itself)
+    '''
+    name = 'matlab'
+
+    def __init__(self):
+        import matlab.engine as mtlb
+        self.eng = mtlb.start_matlab()
+
+    def update_workspace_corrected(self, corrected_names, corrected_seqindex, in_file, out_file):
+        self.eng.update_workspace_corrected(corrected_names, corrected_seqindex, in_file, out_file, nargout=0)
+
+    def quit(self):
+        self.eng.quit()
+
+
+BACKENDS = {backend.name: backend for backend in [NativeBackend, MatlabBackend]}
+
+
+def start_backend(name='native'):
+    ''' Create save backend from its name ('native' or 'matlab') '''
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError("Unknown save backend '{}', should be one of {}.".format(name, list(BACKENDS)))
+
+
+class BackendLoader:
+    '''
+    Starts a save backend on a background thread (starting Matlab takes tens of seconds)
+    get() waits for the backend to be ready, and raises the start-up error if any.
+    '''
+
+    def __init__(self, name='native', on_status=None):
+        '''
+        :param name: backend name
+        :param on_status: optional callback(message), called from the loading thread
+        '''
+        self.name = name
+        self.on_status = on_status
+        self.backend = None
+        self.error = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._start, name='backend-loader', daemon=True)
+        self.thread.start()
+
+    def _status(self, message):
+        if self.on_status is not None:
+            self.on_status(message)
+
+    def _start(self):
+        self._status("Starting '{}' save backend...".format(self.name))
+        try:
+            with perf.startup.timed("start '{}' save backend".format(self.name)):
+                self.backend = start_backend(self.name)
+        except Exception as err:
+            self.error = err
+            self._status("Failed to start '{}' save backend: {}".format(self.name, err))
+        else:
+            self._status("'{}' save backend ready".format(self.name))
+        finally:
+            self.ready.set()
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    def get(self, timeout=None):
+        ''' Backend, once started
+        :param timeout: maximum waiting time in seconds (None: wait until ready)
+        :returns: backend, or None if still starting after timeout
+        '''
+        if not self.ready.wait(timeout):
+            return None
+        if self.error is not None:
+            raise RuntimeError("Save backend '{}' could not be started: {}".format(self.name, self.error))
+        return self.backend
+
+    def quit(self):
+        ''' Stop backend if it was started (does not wait for a backend still starting) '''
+        if self.ready.is_set() and self.backend is not None:
+            self.backend.quit()
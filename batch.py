@@ -0,0 +1,210 @@
+'''
+Headless batch processing of a folder of DENSEanalysis workspaces
+Applies ROI corrections from a CSV/JSON mapping (same result as Apply/Save in the app),
+one workspace per worker process. No display, PyQt5 or matplotlib needed.
+
+    python batch.py INPUT_FOLDER OUTPUT_FOLDER --corrections corrections.csv
+    python main.py batch INPUT_FOLDER OUTPUT_FOLDER --corrections corrections.json
+
+CSV mapping: one row per ROI correction, with columns
+    workspace   workspace path relative to INPUT_FOLDER (or file name)
+    roi         ROI index (1-based, order of the ROI panel) or ROI name
+    name        slice category (base, mid, apex, 2ch, 3ch, 4ch), empty to delete the correction
+    seq_index   image indices of the slice (1-based, e.g. "1 2 3"), empty to delete the correction
+JSON mapping: {"<workspace>": [{"roi": ..., "name": ..., "seq_index": [...]}, ...], ...}
+'''
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+import backends
+from workspace import Workspace, roi_corrections, SLICE_CATEGORIES, ROI_TYPES
+
+
+def read_corrections(filename):
+    ''' Read a corrections mapping file (.csv or .json)
+    :param filename: mapping file path
+    :returns: dict workspace -> list of dicts {'roi', 'name', 'seq_index'}
+    '''
+    corrections = {}
+    if Path(filename).suffix.lower() == '.json':
+        with open(filename) as f:
+            data = json.load(f)
+        for ws_name, entries in data.items():
+            corrections[ws_name] = [{'roi': entry['roi'], 'name': entry.get('name') or '',
+                                     'seq_index': [int(i) for i in entry.get('seq_index') or []]} for entry in entries]
+    else:
+        with open(filename, newline='') as f:
+            for row in csv.DictReader(f):
+                corrections.setdefault(row['workspace'], []).append({
+                    'roi': row['roi'],
+                    'name': (row.get('name') or '').strip(),
+                    'seq_index': [int(i) for i in (row.get('seq_index') or '').replace(',', ' ').split()],
+                })
+    return corrections
+
+
+def find_workspaces(folder, pattern='*.dns'):
+    ''' Workspace files of a folder (recursive), sorted by path '''
+    return sorted(path for path in Path(folder).rglob(pattern) if path.is_file())
+
+
+def resolve_roi(rois, roi):
+    ''' Index (0-based) of a ROI given its 1-based index or its name '''
+    if isinstance(roi, int) or str(roi).strip().isdigit():
+        index = int(roi) - 1
+        if not 0 <= index < len(rois):
+            raise ValueError('ROI index {} out of range (1-{}).'.format(roi, len(rois)))
+        return index
+    matches = [i for i, name in enumerate(rois['Name']) if name == roi]
+    if len(matches) != 1:
+        raise ValueError("ROI name '{}' matches {} ROIs.".format(roi, len(matches)))
+    return matches[0]
+
+
+def apply_corrections(ws, corrections, check_frames=False):
+    ''' Validate and apply corrections to the current ones of a workspace
+    :param ws: Workspace
+    :param corrections: list of dicts {'roi', 'name', 'seq_index'}
+    :param check_frames: warn if ROI and slice frame counts differ (reads sequence headers)
+    :returns: (corrected names, corrected image indices, list of warnings)
+    '''
+    names, assoc = roi_corrections(ws.rois)
+    slices = ws.slice_indices()
+    warnings = []
+    for correction in corrections:
+        index = resolve_roi(ws.rois, correction['roi'])
+        roi = ws.rois[index]
+        name, seq_index = correction['name'], correction['seq_index']
+        if roi['Type'] not in ROI_TYPES:
+            raise ValueError("ROI {} has type '{}', only {} ROIs can be corrected.".format(correction['roi'], roi['Type'], ROI_TYPES))
+        if bool(name) != bool(seq_index):
+            raise ValueError('ROI {}: name and seq_index should be both set or both empty.'.format(correction['roi']))
+        if name and name not in SLICE_CATEGORIES:
+            raise ValueError("ROI {}: unknown slice category '{}' (should be one of {}).".format(correction['roi'], name, SLICE_CATEGORIES))
+        if seq_index and seq_index not in slices:
+            raise ValueError('ROI {}: {} does not match any slice of the workspace.'.format(correction['roi'], seq_index))
+        if check_frames and seq_index:
+            nbr_frames = ws.imgs.shape(seq_index[0]-1)[2]
+            if np.shape(roi['Position'])[0] != nbr_frames:
+                warnings.append('ROI {}: {} frames, slice {}: {} frames'.format(
+                    correction['roi'], np.shape(roi['Position'])[0], seq_index, nbr_frames))
+        names[index] = name
+        assoc[index] = seq_index
+    return names, assoc, warnings
+
+
+# Save backend of the current worker process (started once per process)
+_backend = None
+
+
+def _get_backend(name):
+    global _backend
+    if _backend is None:
+        _backend = backends.start_backend(name)
+    return _backend
+
+
+def process_workspace(filename, output_file, corrections, save_backend='native', dry_run=False, check_frames=False):
+    ''' Worker task: load, validate and apply corrections to one workspace
+    Errors are reported in the result, so that one workspace can't stop the batch
+    :returns: dict with 'file', 'status' ('saved', 'validated' or 'error'), 'corrections', 'message'
+    '''
+    result = {'file': str(filename), 'status': 'error', 'corrections': len(corrections), 'message': ''}
+    try:
+        with Workspace(str(filename)) as ws:
+            names, assoc, warnings = apply_corrections(ws, corrections, check_frames)
+        result['message'] = '; '.join(warnings)
+        if dry_run or not corrections:
+            result['status'] = 'validated'
+            return result
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        _get_backend(save_backend).update_workspace_corrected(names, assoc, str(filename), str(output_file))
+        result['status'] = 'saved'
+    except Exception as err:
+        result['message'] = '{}: {}'.format(type(err).__name__, err)
+    return result
+
+
+def run_batch(input_folder, output_folder, corrections=None, pattern='*.dns', jobs=None,
+              save_backend='native', dry_run=False, check_frames=False, progress=None):
+    ''' Process all workspaces of a folder with a process pool
+    :param input_folder: folder searched (recursively) for workspaces
+    :param output_folder: output folder, sub-folder structure is kept (can be input_folder)
+    :param corrections: mapping read by read_corrections(), keys being relative paths or file names
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param progress: optional callback(number done, total, result)
+    :returns: list of results (see process_workspace())
+    '''
+    corrections = corrections or {}
+    files = find_workspaces(input_folder, pattern)
+    tasks = []
+    for path in files:
+        relative = path.relative_to(input_folder)
+        entries = corrections.get(relative.as_posix(), corrections.get(path.name, []))
+        tasks.append((path, Path(output_folder) / relative, entries))
+
+    # Only needed by the command line (the app imports this module on start-up, see journal.py)
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(process_workspace, path, output_file, entries, save_backend, dry_run, check_frames)
+                   for path, output_file, entries in tasks]
+        for future in as_completed(futures):
+            results.append(future.result())
+            if progress is not None:
+                progress(len(results), len(futures), results[-1])
+    return sorted(results, key=lambda result: result['file'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply ROI corrections to a folder of DENSEanalysis workspaces')
+    parser.add_argument('input_folder', help='folder containing the workspaces (searched recursively)')
+    parser.add_argument('output_folder', help='output folder (can be the input folder to overwrite workspaces)')
+    parser.add_argument('--corrections', help='CSV or JSON corrections mapping (see batch.py)')
+    parser.add_argument('--pattern', default='*.dns', help='workspace file pattern (default: *.dns)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: all CPUs)')
+    parser.add_argument('--save-backend', choices=list(backends.BACKENDS), default='native')
+    parser.add_argument('--dry-run', action='store_true', help='validate corrections without writing anything')
+    parser.add_argument('--check-frames', action='store_true', help='warn when ROI and slice frame counts differ')
+    parser.add_argument('--report', help='write per-workspace results to this CSV file')
+    args = parser.parse_args(argv)
+
+    corrections = read_corrections(args.corrections) if args.corrections else {}
+    found = set()
+    for path in find_workspaces(args.input_folder, args.pattern):
+        found.update([path.relative_to(args.input_folder).as_posix(), path.name])
+    for ws_name in sorted(set(corrections) - found):
+        print("Warning: no workspace '{}' in {}".format(ws_name, args.input_folder), file=sys.stderr)
+
+    def progress(done, total, result):
+        message = ' ({})'.format(result['message']) if result['message'] else ''
+        print('[{:>{w}}/{}] {}: {}{}'.format(done, total, result['file'], result['status'], message, w=len(str(total))),
+              file=sys.stderr, flush=True)
+
+    start = time.perf_counter()
+    results = run_batch(args.input_folder, args.output_folder, corrections, args.pattern, args.jobs,
+                        args.save_backend, args.dry_run, args.check_frames, progress)
+
+    if args.report:
+        with open(args.report, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['file', 'status', 'corrections', 'message'])
+            writer.writeheader()
+            writer.writerows(results)
+
+    counts = {status: sum(result['status'] == status for result in results) for status in ['saved', 'validated', 'error']}
+    print('{} workspaces in {:.1f} s: {saved} saved, {validated} validated, {error} errors'.format(
+        len(results), time.perf_counter() - start, **counts), file=sys.stderr)
+    return 1 if counts['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
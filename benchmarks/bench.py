@@ -0,0 +1,401 @@
+'''
+Benchmark suite of workspace opening, contour interpolation, images rendering and saving
+Runs on synthetic workspaces (see synthetic.py), so no patient data is needed. Rendering
+runs the app itself with an offscreen Qt platform, and saving goes through both the native
+backend and a local stand-in for the Matlab engine (see StandinEngine).
+
+    python benchmarks/bench.py                               # default workspace, results in benchmarks/results/
+    python benchmarks/bench.py --size 256 --frames 40        # other workspace settings
+    python benchmarks/bench.py --compare benchmarks/results/baseline.json
+
+Results (JSON) hold, for each benchmark, the min/median/mean duration of a call over the
+repeats, along with the workspace settings and environment. With --compare, medians slower
+than the reference ones by more than --threshold are reported as regressions (exit code 1).
+'''
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+# App modules, from the repository root
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+import synthetic
+
+
+RESULTS_FOLDER = ROOT / 'benchmarks' / 'results'
+RESULTS_VERSION = 1
+# Benchmark groups, in running order
+GROUPS = ['open', 'contours', 'render', 'save']
+
+
+### TIMING ###
+
+def timeit(function, repeat=5, number=1, setup=None):
+    ''' Durations of a function call
+    :param function: function to time, called without arguments
+    :param repeat: number of measures
+    :param number: number of calls per measure (duration is given per call)
+    :param setup: optional function called before each measure (not timed)
+    :returns: dict with 'min', 'median', 'mean' durations (s), 'repeat' and 'number'
+    '''
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        durations.append((time.perf_counter() - start) / number)
+    return {'min': min(durations), 'median': statistics.median(durations), 'mean': statistics.mean(durations),
+            'repeat': repeat, 'number': number}
+
+
+### MATLAB ENGINE STAND-IN ###
+
+class StandinEngine:
+    '''
+    Local stand-in for the Matlab engine, as returned by matlab.engine.start_matlab()
+    update_workspace_corrected() does what update_workspace_corrected.m does: load the whole
+    workspace, then append the 'roi' struct with its corrections to the output file.
+    Arguments are converted the way the engine marshals them (Python lists to cell arrays).
+    '''
+
+    def update_workspace_corrected(self, corrected_names, corrected_seqindex, in_file, out_file, nargout=0):
+        from scipy.io import loadmat
+        import workspace
+        # load(in_file, '-mat'): all variables, cine sequences included
+        loadmat(in_file)
+        names = [str(name) for name in corrected_names]
+        seqindex = [[float(i) for i in indices] for indices in corrected_seqindex]
+        workspace.update_workspace_corrected(names, seqindex, in_file, out_file)
+
+    def quit(self):
+        pass
+
+
+def install_standin_engine():
+    ''' Make 'import matlab.engine' return the stand-in engine (see backends.MatlabBackend) '''
+    matlab = types.ModuleType('matlab')
+    engine = types.ModuleType('matlab.engine')
+    engine.start_matlab = StandinEngine
+    matlab.engine = engine
+    sys.modules['matlab'] = matlab
+    sys.modules['matlab.engine'] = engine
+
+
+### BENCHMARKS ###
+
+def bench_open(filename, repeat):
+    ''' Workspace opening: full loadmat (original app) vs lazy Workspace, then first slice decoding
+    (and reading from the on-disk image cache, see imgcache.py)
+    '''
+    from scipy.io import loadmat
+    from workspace import Workspace
+    from imgcache import ImageCache
+
+    def first_slice(image_cache=None):
+        with Workspace(filename, image_cache=image_cache) as ws:
+            for idx in ws.slice_indices()[0]:
+                ws.imgs[idx-1]
+
+    cache_folder = tempfile.mkdtemp(prefix='bench_cache_')
+    try:
+        image_cache = ImageCache(cache_folder)
+        first_slice(image_cache)
+        return {
+            'open.loadmat': timeit(lambda: loadmat(filename), repeat),
+            'open.workspace': timeit(lambda: Workspace(filename).close(), repeat),
+            'open.first_slice': timeit(first_slice, repeat),
+            'open.first_slice_cached': timeit(lambda: first_slice(image_cache), repeat),
+        }
+    finally:
+        shutil.rmtree(cache_folder, ignore_errors=True)
+
+
+def bench_contours(filename, repeat):
+    ''' ROI contour interpolation of all frames of all ROIs (durations per ROI) '''
+    import utils
+    import masks
+    from scipy.interpolate import splprep, splev
+    from workspace import Workspace
+
+    with Workspace(filename) as ws:
+        rois = [(roi['Type'], roi['Position']) for roi in ws.rois]
+        shape = ws.imgs.shape(0)[:2]
+
+    def per_frame():
+        for orientation, positions in rois:
+            for endo, epi in positions:
+                utils.anchor_to_contour(orientation, endo, epi)
+
+    def batched():
+        for orientation, positions in rois:
+            utils.roi_contours(orientation, positions)
+
+    def splprep_reference():
+        # Original implementation: one splprep/splev per contour and frame
+        for orientation, positions in rois:
+            for frame in positions:
+                for points in frame:
+                    points = np.asarray(points, dtype=np.float64) - 1
+                    if orientation == 'SA':
+                        points = np.concatenate([points, points[:1]])
+                    tck, _ = splprep(points.T, s=0, per=orientation == 'SA')
+                    splev(np.linspace(0, 1, 101), tck)
+
+    def roi_masks():
+        for orientation, positions in rois:
+            masks.roi_masks(utils.roi_contours(orientation, positions), orientation, shape)
+
+    results = {
+        'contours.splprep_reference': timeit(splprep_reference, repeat),
+        'contours.anchor_to_contour': timeit(per_frame, repeat),
+        'contours.roi_contours': timeit(batched, repeat),
+        'contours.roi_masks': timeit(roi_masks, repeat),
+    }
+    for result in results.values():
+        result.update({key: result[key] / max(1, len(rois)) for key in ['min', 'median', 'mean']})
+    return results
+
+
+def close_window(window, app):
+    ''' Close the app window without its quit confirmation dialog '''
+    window.render_prefiller.cancel()
+    window.prefetcher.update([])
+    for tab in window.tabs:
+        tab.journal.close()
+    window.eng.quit()
+    window.hide()
+    window.deleteLater()
+    app.processEvents()
+
+
+def bench_render(filename, repeat):
+    ''' Images panel rendering in the app (offscreen Qt), durations per frame or per event '''
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    import main
+
+    window = main.DenseVisualizer()
+    window.resize(1200, 800)
+    window.show()
+    # Measure the foreground path only
+    window.prefetch_depth = 0
+    window.neighbour_workspaces = lambda: []
+    window.prefill_render_cache = lambda: None
+    # Another workspace, replaced by the measured one on each load (opened ones are only switched to)
+    other = os.path.join(os.path.dirname(filename), 'other' + Path(filename).suffix)
+    shutil.copyfile(filename, other)
+    results = {}
+    try:
+        results['render.load_workspace'] = timeit(lambda: (window.load_workspace(filename, new_tab=False), app.processEvents()), repeat,
+                                                  setup=lambda: window.load_workspace(other, new_tab=False))
+        window.roi_list.setCurrentIndex(window.roi_model.index(0))
+        window.on_item_click(window.roi_model.index(0))
+        nbr_frames = window.frame_slider.maximum()
+
+        def scrub():
+            # Whole cine, starting from the frame after the current one
+            for _ in range(nbr_frames):
+                window.frame_slider.setValue(window.frame_slider.value() % nbr_frames + 1)
+                app.processEvents()
+
+        results['render.update_images'] = timeit(scrub, repeat, setup=window.render_cache.clear)
+        results['render.update_images_cached'] = timeit(scrub, repeat)
+        for result in [results['render.update_images'], results['render.update_images_cached']]:
+            result.update({key: result[key] / nbr_frames for key in ['min', 'median', 'mean']}, number=nbr_frames)
+        window.zoom_act.setChecked(True)
+        app.processEvents()
+        results['render.update_images_zoom'] = timeit(scrub, repeat, setup=window.render_cache.clear)
+        results['render.update_images_zoom'].update({key: results['render.update_images_zoom'][key] / nbr_frames
+                                                     for key in ['min', 'median', 'mean']}, number=nbr_frames)
+        window.zoom_act.setChecked(False)
+
+        def change_slice():
+            index = (window.slice_dropdown.currentIndex() + 1) % window.slice_dropdown.count()
+            window.slice_dropdown.setCurrentIndex(index)
+            window.on_slice_change(window.slice_dropdown.currentText())
+            app.processEvents()
+
+        results['render.slice_change'] = timeit(change_slice, repeat, number=max(1, window.slice_dropdown.count()))
+        window.montage_act.setChecked(True)
+        app.processEvents()
+        results['render.montage'] = timeit(scrub, repeat)
+        results['render.montage'].update({key: results['render.montage'][key] / nbr_frames
+                                          for key in ['min', 'median', 'mean']}, number=nbr_frames)
+        window.montage_act.setChecked(False)
+
+        # Back and forth between two workspace tabs
+        window.load_workspace(other)
+        app.processEvents()
+
+        def switch_tab():
+            window.tab_bar.setCurrentIndex(1 - window.tab_bar.currentIndex())
+            app.processEvents()
+
+        results['render.switch_tab'] = timeit(switch_tab, repeat, number=2)
+    finally:
+        close_window(window, app)
+    return results
+
+
+def bench_save(filename, repeat):
+    ''' Saving corrections through the app (native backend, then the Matlab engine stand-in) '''
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    import main
+
+    install_standin_engine()
+    results = {}
+    for backend in ['native', 'matlab']:
+        window = main.DenseVisualizer(save_backend=backend)
+        output_folder = tempfile.mkdtemp(prefix='bench_save_')
+        try:
+            window.prefetch_depth = 0
+            window.load_workspace(filename)
+            window.eng.get()
+            window.user_set_output = True
+            window.output_folder = output_folder
+            window.roi_model.set_rois(window.rois, ['mid'] * len(window.rois),
+                                      [list(idx) for idx in window.workspace.slice_indices()[:1]] * len(window.rois))
+
+            def save():
+                # Saves run in the background: submission and write
+                window.on_save_click()
+                window.saver.wait()
+                app.processEvents()
+
+            # First save copies the input file and moves 'roi' at its end, next ones only write 'roi' in place
+            results['save.{}.new_file'.format(backend)] = timeit(
+                save, repeat, setup=lambda: shutil.rmtree(output_folder, ignore_errors=True) or os.makedirs(output_folder))
+            results['save.{}.existing_file'.format(backend)] = timeit(save, repeat)
+        finally:
+            close_window(window, app)
+            shutil.rmtree(output_folder, ignore_errors=True)
+    return results
+
+
+BENCHMARKS = {'open': bench_open, 'contours': bench_contours, 'render': bench_render, 'save': bench_save}
+
+
+### RESULTS ###
+
+def environment():
+    ''' Versions and machine the benchmarks ran on '''
+    import scipy
+    import matplotlib
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'matplotlib': matplotlib.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, reference, threshold):
+    ''' Regressions between two results files
+    :param results: new results dict
+    :param reference: reference results dict
+    :param threshold: relative slowdown of the median reported as a regression (e.g. 0.2 for 20%)
+    :returns: list of (benchmark name, reference median, new median, ratio), and list of regressions names
+    '''
+    rows, regressions = [], []
+    if reference.get('config') != results.get('config'):
+        print('Warning: workspace settings differ from the reference ones', file=sys.stderr)
+    for name, result in results['results'].items():
+        if name not in reference['results']:
+            continue
+        old, new = reference['results'][name]['median'], result['median']
+        ratio = new / old if old > 0 else float('inf')
+        rows.append((name, old, new, ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_results(results, rows=None, regressions=(), stream=None):
+    stream = stream or sys.stdout
+    if rows is None:
+        for name, result in results['results'].items():
+            print('{:<36} {:>10.3f} ms  (min {:.3f} ms)'.format(name, 1000 * result['median'], 1000 * result['min']), file=stream)
+        return
+    for name, old, new, ratio in rows:
+        flag = '  REGRESSION' if name in regressions else ''
+        print('{:<36} {:>10.3f} ms -> {:>10.3f} ms  x{:.2f}{}'.format(name, 1000 * old, 1000 * new, ratio, flag), file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark workspace opening, contours, rendering and saving')
+    parser.add_argument('--slices', type=int, default=6, help='number of slices (default: 6)')
+    parser.add_argument('--size', type=int, default=128, help='image size in pixels (default: 128)')
+    parser.add_argument('--frames', type=int, default=30, help='number of frames (default: 30)')
+    parser.add_argument('--rois', type=int, default=4, help='number of ROIs (default: 4)')
+    parser.add_argument('--uncompressed', action='store_true', help='uncompressed workspace variables')
+    parser.add_argument('--repeat', type=int, default=5, help='measures per benchmark (default: 5)')
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=GROUPS, help='benchmark groups to run')
+    parser.add_argument('-o', '--output', help='results file (default: benchmarks/results/<date>_<commit>.json)')
+    parser.add_argument('--compare', help='reference results file, to report regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown reported as a regression (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    config = {'slices': args.slices, 'size': args.size, 'frames': args.frames, 'rois': args.rois,
+              'compressed': not args.uncompressed}
+    results = {'version': RESULTS_VERSION, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'config': config,
+               'environment': environment(), 'results': {}}
+
+    folder = tempfile.mkdtemp(prefix='bench_')
+    try:
+        filename = os.path.join(folder, 'synthetic.dns')
+        synthetic.make_workspace(filename, args.slices, args.size, args.frames, args.rois, not args.uncompressed)
+        for group in GROUPS:
+            if group in args.only:
+                print('Running {} benchmarks...'.format(group), file=sys.stderr, flush=True)
+                results['results'].update(BENCHMARKS[group](filename, args.repeat))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    output = args.output or RESULTS_FOLDER / '{}_{}.json'.format(time.strftime('%Y%m%d-%H%M%S'),
+                                                                 results['environment']['commit'] or 'nocommit')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('Results written to {}'.format(output), file=sys.stderr)
+
+    if args.compare is None:
+        print_results(results)
+        return 0
+    with open(args.compare) as f:
+        reference = json.load(f)
+    rows, regressions = compare(results, reference, args.threshold)
+    print_results(results, rows, regressions)
+    if regressions:
+        print('{} regression(s) above {:.0%}'.format(len(regressions), args.threshold), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+'''
+Generator of synthetic DENSEanalysis-shaped workspaces (no patient data)
+Same variables and layout as .dns workspaces, as read by the app:
+    seq   struct array, ProtocolName of each sequence
+    img   cell array of cine sequences (H, W, T), magnitude then x, y (and z) phases per slice
+    dns   struct array, MagIndex/PhaIndex (1-based, NaN z-phase for 2D-encoded slices)
+    roi   struct array, Name/Type/SeqIndex/Position (SA or LA anchors of each frame)
+Images show a beating ring (myocardium) over a noisy background, ROI anchors follow it.
+
+    python benchmarks/synthetic.py OUTPUT.dns --slices 6 --size 128 --frames 30 --rois 4
+'''
+
+import os
+import sys
+import argparse
+
+import numpy as np
+from scipy.io import savemat
+
+
+# Slices alternate between these protocol names (short-axis first)
+PROTOCOLS = ['DENSE SA base', 'DENSE SA mid', 'DENSE SA apex', 'DENSE LA 2ch', 'DENSE LA 3ch', 'DENSE LA 4ch']
+# Number of anchor points of each ROI contour (per frame)
+NBR_ANCHORS = 8
+
+
+def ring_radii(size, frames):
+    ''' Endo and epi radii (pixels) of the beating ring at each frame '''
+    phase = np.sin(np.linspace(0, np.pi, frames))
+    endo = size * (0.12 - 0.03 * phase)
+    epi = size * (0.20 - 0.02 * phase)
+    return endo, epi
+
+
+def make_sequences(rng, size, frames, nbr_phases):
+    ''' Magnitude and phase cine sequences of one slice
+    :returns: list of (size, size, frames) float64 arrays, magnitude first
+    '''
+    y, x = np.mgrid[:size, :size] - (size - 1) / 2
+    radius = np.hypot(x, y)[:, :, None]
+    endo, epi = ring_radii(size, frames)
+    ring = (radius >= endo) & (radius <= epi)
+    magnitude = 400 + 600 * ring + rng.normal(0, 60, (size, size, frames))
+    sequences = [np.clip(magnitude, 0, None)]
+    for k in range(nbr_phases):
+        # Wrapped phase, smooth displacement field plus noise
+        angle = np.arctan2(y, x)[:, :, None] + k * np.pi / 3
+        phase = 2.5 * np.sin(angle) * np.linspace(0, 1, frames) + rng.normal(0, 0.2, (size, size, frames))
+        sequences.append(np.angle(np.exp(1j * phase)))
+    return sequences
+
+
+def make_anchors(rng, size, frames, orientation):
+    ''' Endo/epi anchor points of each frame (1-based Matlab coordinates)
+    :returns: (frames, 2) object array of (NBR_ANCHORS, 2) arrays
+    '''
+    center = (size - 1) / 2 + 1
+    endo, epi = ring_radii(size, frames)
+    if orientation == 'SA':
+        angles = np.linspace(0, 2 * np.pi, NBR_ANCHORS, endpoint=False)
+    else:
+        # Open horseshoe, from one side of the base to the other
+        angles = np.linspace(0.15 * np.pi, 0.85 * np.pi, NBR_ANCHORS)
+    positions = np.empty((frames, 2), dtype=object)
+    for frame in range(frames):
+        for c, radius in enumerate([endo[frame], epi[frame]]):
+            jitter = rng.normal(0, 0.3, (NBR_ANCHORS, 2))
+            # Long-axis endo runs back from the end of the epi (closed contour epi + endo, see utils.contour_lines())
+            contour_angles = angles[::-1] if orientation == 'LA' and c == 0 else angles
+            positions[frame, c] = np.stack([center + radius * np.cos(contour_angles), center + radius * np.sin(contour_angles)], axis=1) + jitter
+    return positions
+
+
+def make_workspace(filename, nbr_slices=6, size=128, frames=30, nbr_rois=4, compress=True, corrected=False, seed=0):
+    ''' Write a synthetic workspace
+    :param filename: output file (.dns or .mat, Matlab v5 format)
+    :param nbr_slices: number of slices (3 or 4 sequences each: every other slice has no z-phase)
+    :param size: image size (square images)
+    :param frames: number of frames of each cine sequence
+    :param nbr_rois: number of ROIs, on the first slices (SA for short-axis protocols, LA otherwise)
+    :param compress: zlib-compressed variables (Matlab default)
+    :param corrected: also add CorrectedNames/CorrectedSeqIndex fields, as saved by the app
+    :param seed: random seed
+    '''
+    rng = np.random.default_rng(seed)
+    names, sequences, mag_index, pha_index, types = [], [], [], [], []
+    for s in range(nbr_slices):
+        protocol = PROTOCOLS[s % len(PROTOCOLS)]
+        nbr_phases = 3 if s % 2 == 0 else 2
+        first = len(sequences) + 1
+        sequences += make_sequences(rng, size, frames, nbr_phases)
+        names += [protocol] * (nbr_phases + 1)
+        mag_index.append([first, np.nan, np.nan])
+        pha_index.append([first + k if k <= nbr_phases else np.nan for k in range(1, 4)])
+        types.append('SA' if ' SA ' in protocol else 'LA')
+
+    seq = np.empty((1, len(sequences)), dtype=[('ProtocolName', object)])
+    img = np.empty((1, len(sequences)), dtype=object)
+    for k, sequence in enumerate(sequences):
+        seq[0, k]['ProtocolName'] = names[k]
+        img[0, k] = sequence
+    dns = np.empty((1, nbr_slices), dtype=[('MagIndex', object), ('PhaIndex', object)])
+    for s in range(nbr_slices):
+        dns[0, s]['MagIndex'] = np.array([mag_index[s]], dtype=float)
+        dns[0, s]['PhaIndex'] = np.array([pha_index[s]], dtype=float)
+
+    fields = [('Name', object), ('Type', object), ('SeqIndex', object), ('Position', object)]
+    if corrected:
+        fields += [('CorrectedNames', object), ('CorrectedSeqIndex', object)]
+    roi = np.empty((1, nbr_rois), dtype=fields)
+    for r in range(nbr_rois):
+        s = r % nbr_slices
+        indices = [mag_index[s][0]] + [i for i in pha_index[s] if not np.isnan(i)]
+        roi[0, r]['Name'] = 'ROI {}'.format(r + 1)
+        roi[0, r]['Type'] = types[s]
+        roi[0, r]['SeqIndex'] = np.array([indices[:3]], dtype=float)
+        roi[0, r]['Position'] = make_anchors(rng, size, frames, types[s])
+        if corrected:
+            roi[0, r]['CorrectedNames'] = PROTOCOLS[s % len(PROTOCOLS)].split()[-1]
+            roi[0, r]['CorrectedSeqIndex'] = np.array([indices], dtype=np.int64)
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    savemat(filename, {'seq': seq, 'img': img, 'dns': dns, 'roi': roi}, do_compression=compress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic DENSEanalysis workspace')
+    parser.add_argument('output', help='output workspace file (.dns)')
+    parser.add_argument('--slices', type=int, default=6, help='number of slices (default: 6)')
+    parser.add_argument('--size', type=int, default=128, help='image size in pixels (default: 128)')
+    parser.add_argument('--frames', type=int, default=30, help='number of frames (default: 30)')
+    parser.add_argument('--rois', type=int, default=4, help='number of ROIs (default: 4)')
+    parser.add_argument('--uncompressed', action='store_true', help='do not compress variables')
+    parser.add_argument('--corrected', action='store_true', help='add corrections, as saved by the app')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    make_workspace(args.output, args.slices, args.size, args.frames, args.rois, not args.uncompressed,
+                   args.corrected, args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
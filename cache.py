@@ -0,0 +1,186 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache bounded by memory size
+    Each entry is stored with its size in bytes, least recently used entries
+    are evicted when the total goes above the budget.
+    '''
+
+    def __init__(self, max_bytes):
+        '''
+        :param max_bytes: memory budget in bytes
+        '''
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, _ = self.entries[key]
+            except KeyError:
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, nbytes):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def discard(self, predicate):
+        ''' Remove the entries whose key satisfies predicate(key) '''
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.nbytes -= self.entries.pop(key)[1]
+
+    def _evict(self):
+        # Most recent entry is always kept, even if above budget on its own
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+
+class SequenceBudget:
+    '''
+    Memory budget shared by the decoded 'img' sequences of several workspaces
+    Owners (see workspace.SequenceList) register each sequence they decode with its size in bytes,
+    and touch it on every access. Least recently used sequences of any owner are evicted (dropped
+    by their owner, which reloads them on demand) when the total goes above the budget.
+    '''
+
+    def __init__(self, max_bytes):
+        '''
+        :param max_bytes: memory budget in bytes
+        '''
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict() # (id(owner), k) -> (owner, nbytes)
+        # Number of evicted sequences so far
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def add(self, owner, k, nbytes):
+        ''' Register sequence k of an owner, as the most recently used one '''
+        with self.lock:
+            key = (id(owner), k)
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (owner, nbytes)
+            self.nbytes += nbytes
+            victims = self._over_budget()
+        self._evict(victims)
+
+    def touch(self, owner, k):
+        with self.lock:
+            key = (id(owner), k)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+
+    def discard(self, owner):
+        ''' Forget all sequences of an owner (e.g. workspace closed), without evicting them '''
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == id(owner)]:
+                self.nbytes -= self.entries.pop(key)[1]
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            victims = self._over_budget()
+        self._evict(victims)
+
+    def full(self):
+        return self.nbytes >= self.max_bytes
+
+    def _over_budget(self):
+        # Most recent entry is always kept, even if above budget on its own
+        victims = []
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            (_, k), (owner, nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= nbytes
+            victims.append((owner, k))
+        self.evictions += len(victims)
+        return victims
+
+    def _evict(self, victims):
+        # Outside of the lock: owners can be waiting for it while holding their own
+        for owner, k in victims:
+            owner.evict(k)
+
+
+class CachePrefiller:
+    '''
+    Background thread filling a LRUCache ahead of use
+    A job is a list of keys and a builder function key -> (value, nbytes).
+    Submitting a new job cancels the current one. A job stops once it has filled
+    the whole cache budget, so that it never evicts its own entries.
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.job = None
+        self.generation = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='cache-prefiller', daemon=True)
+        self.thread.start()
+
+    def submit(self, keys, builder):
+        ''' Replace current job
+        :param keys: keys to fill, in order of priority
+        :param builder: function key -> (value, nbytes)
+        '''
+        with self.condition:
+            self.generation += 1
+            self.job = (self.generation, list(keys), builder)
+            self.condition.notify()
+
+    def cancel(self):
+        self.submit([], None)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.job is None:
+                    self.condition.wait()
+                generation, keys, builder = self.job
+                self.job = None
+
+            filled = 0
+            for key in keys:
+                if generation != self.generation:
+                    break
+                if key in self.cache:
+                    continue
+                try:
+                    value, nbytes = builder(key)
+                except Exception:
+                    # Entry will be built (and error handled) when actually needed
+                    continue
+                filled += nbytes
+                if filled > self.cache.max_bytes:
+                    break
+                self.cache.put(key, value, nbytes)
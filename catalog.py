@@ -0,0 +1,334 @@
+'''
+On-disk catalog (SQLite) of a dataset of DENSEanalysis workspaces
+Records slices, frame counts, image shapes, ROIs and correction status of each workspace,
+so that a dataset can be queried (e.g. workspaces still to QC) without reopening any file.
+Rescans are incremental: only new or modified (mtime/size) workspaces are read again,
+one workspace per worker process.
+
+    python catalog.py scan DATASET_FOLDER [--db catalog.sqlite]
+    python catalog.py query DATASET_FOLDER --status todo --roi-type LA
+    python main.py catalog ...
+'''
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from workspace import Workspace, roi_corrections, slice_label
+from batch import find_workspaces
+
+
+# Default catalog file name, stored at the root of the dataset folder
+CATALOG_NAME = '.dense_catalog.sqlite'
+
+# Correction status of a workspace
+STATUS_TODO = 'todo'        # no corrections saved yet
+STATUS_PARTIAL = 'partial'  # corrections saved, but some SA/LA ROIs left without one
+STATUS_DONE = 'done'        # every SA/LA ROI has a correction
+STATUS_ERROR = 'error'      # workspace could not be read
+CATALOG_STATUSES = [STATUS_TODO, STATUS_PARTIAL, STATUS_DONE, STATUS_ERROR]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS workspaces (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    scanned_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    nbr_sequences INTEGER,
+    nbr_slices INTEGER,
+    nbr_rois INTEGER,
+    nbr_sa INTEGER,
+    nbr_la INTEGER,
+    nbr_corrected INTEGER
+);
+CREATE TABLE IF NOT EXISTS slices (
+    workspace_id INTEGER NOT NULL REFERENCES workspaces(id) ON DELETE CASCADE,
+    slice_index INTEGER NOT NULL,
+    label TEXT,
+    mag_index INTEGER,
+    pha_index TEXT,
+    nbr_frames INTEGER,
+    height INTEGER,
+    width INTEGER,
+    PRIMARY KEY (workspace_id, slice_index)
+);
+CREATE TABLE IF NOT EXISTS rois (
+    workspace_id INTEGER NOT NULL REFERENCES workspaces(id) ON DELETE CASCADE,
+    roi_index INTEGER NOT NULL,
+    name TEXT,
+    type TEXT,
+    seq_index TEXT,
+    nbr_frames INTEGER,
+    corrected_name TEXT,
+    corrected_seq_index TEXT,
+    PRIMARY KEY (workspace_id, roi_index)
+);
+CREATE INDEX IF NOT EXISTS workspaces_status ON workspaces(status);
+CREATE INDEX IF NOT EXISTS rois_type ON rois(type);
+CREATE INDEX IF NOT EXISTS rois_corrected_name ON rois(corrected_name);
+'''
+
+
+def _text(value):
+    ''' Matlab string field as str ('' for empty values) '''
+    return value if isinstance(value, str) else ''
+
+
+def _indices(value):
+    ''' Matlab index field as a list of int (NaNs dropped) '''
+    value = np.atleast_1d(np.asarray(value, dtype=float))
+    return value[~np.isnan(value)].astype(int).tolist()
+
+
+def scan_workspace(filename):
+    ''' Worker task: read catalog entries of one workspace
+    Only headers and sequence shapes are read, not the images themselves.
+    :param filename: workspace path
+    :returns: dict with 'path', 'mtime_ns', 'size', 'status', 'error', 'sequences', 'slices' and 'rois'
+    '''
+    stat = os.stat(filename)
+    entry = {'path': str(filename), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+             'status': STATUS_ERROR, 'error': None, 'sequences': None, 'slices': [], 'rois': []}
+    try:
+        with Workspace(str(filename)) as ws:
+            entry['sequences'] = len(ws.imgs)
+            for i, img_indices in enumerate(ws.slice_indices()):
+                shape = ws.imgs.shape(img_indices[0]-1)
+                entry['slices'].append({
+                    'slice_index': i,
+                    'label': slice_label(ws.metadata, img_indices),
+                    'mag_index': img_indices[0],
+                    'pha_index': json.dumps(img_indices[1:]),
+                    'nbr_frames': shape[2] if len(shape) > 2 else 1,
+                    'height': shape[0],
+                    'width': shape[1],
+                })
+            names, assoc = roi_corrections(ws.rois)
+            for i, roi in enumerate(ws.rois):
+                entry['rois'].append({
+                    'roi_index': i,
+                    'name': _text(roi['Name']),
+                    'type': _text(roi['Type']),
+                    'seq_index': json.dumps(_indices(roi['SeqIndex'])),
+                    'nbr_frames': np.shape(roi['Position'])[0] if np.ndim(roi['Position']) else 0,
+                    'corrected_name': names[i],
+                    'corrected_seq_index': json.dumps(assoc[i]),
+                })
+            corrected = [names[i] != '' for i, roi in enumerate(ws.rois) if _text(roi['Type']) in ('SA', 'LA')]
+            if 'CorrectedNames' not in ws.rois.dtype.names:
+                entry['status'] = STATUS_TODO
+            else:
+                entry['status'] = STATUS_DONE if all(corrected) else STATUS_PARTIAL
+    except Exception as err:
+        entry['error'] = '{}: {}'.format(type(err).__name__, err)
+    return entry
+
+
+class Catalog:
+    '''
+    SQLite catalog of a dataset of workspaces
+    Paths are stored relative to the dataset folder, so that the dataset (with its
+    catalog file) can be moved.
+    '''
+
+    def __init__(self, folder, db_path=None):
+        '''
+        :param folder: dataset folder
+        :param db_path: catalog file (default: CATALOG_NAME in the dataset folder)
+        '''
+        self.folder = Path(folder)
+        self.db_path = str(db_path or self.folder / CATALOG_NAME)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    ### SCANNING ###
+
+    def scan(self, pattern='*.dns', jobs=None, force=False, progress=None):
+        ''' Update the catalog with the workspaces of the dataset folder
+        :param pattern: workspace file pattern
+        :param jobs: number of worker processes (default: number of CPUs)
+        :param force: read all workspaces again, even if unchanged
+        :param progress: optional callback(number done, total, entry)
+        :returns: dict with 'added', 'updated', 'removed', 'unchanged' and 'errors' counts
+        '''
+        known = {row['path']: (row['mtime_ns'], row['size']) for row in
+                 self.db.execute('SELECT path, mtime_ns, size FROM workspaces')}
+        files = {path.relative_to(self.folder).as_posix(): path for path in find_workspaces(self.folder, pattern)}
+
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'errors': 0}
+        todo = []
+        for relative, path in files.items():
+            stat = path.stat()
+            if not force and known.get(relative) == (stat.st_mtime_ns, stat.st_size):
+                counts['unchanged'] += 1
+            else:
+                todo.append(relative)
+
+        removed = [path for path in known if path not in files]
+        with self.db:
+            self.db.executemany('DELETE FROM workspaces WHERE path = ?', [(path,) for path in removed])
+        counts['removed'] = len(removed)
+
+        if todo:
+            # Only needed to scan (the app imports this module on start-up)
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = {pool.submit(scan_workspace, files[relative]): relative for relative in todo}
+                for done, future in enumerate(as_completed(futures), 1):
+                    relative = futures[future]
+                    entry = future.result()
+                    counts['updated' if relative in known else 'added'] += 1
+                    counts['errors'] += entry['status'] == STATUS_ERROR
+                    self._store(relative, entry)
+                    if progress is not None:
+                        progress(done, len(todo), entry)
+        return counts
+
+    def _store(self, relative, entry):
+        ''' Replace catalog entries of a workspace (one transaction) '''
+        rois = entry['rois']
+        with self.db:
+            self.db.execute('DELETE FROM workspaces WHERE path = ?', (relative,))
+            cursor = self.db.execute(
+                'INSERT INTO workspaces (path, mtime_ns, size, scanned_at, status, error, nbr_sequences, '
+                'nbr_slices, nbr_rois, nbr_sa, nbr_la, nbr_corrected) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (relative, entry['mtime_ns'], entry['size'], time.time(), entry['status'], entry['error'],
+                 entry['sequences'], len(entry['slices']), len(rois),
+                 sum(roi['type'] == 'SA' for roi in rois), sum(roi['type'] == 'LA' for roi in rois),
+                 sum(roi['corrected_name'] != '' for roi in rois)))
+            workspace_id = cursor.lastrowid
+            self.db.executemany(
+                'INSERT INTO slices VALUES (:workspace_id, :slice_index, :label, :mag_index, :pha_index, '
+                ':nbr_frames, :height, :width)',
+                [dict(row, workspace_id=workspace_id) for row in entry['slices']])
+            self.db.executemany(
+                'INSERT INTO rois VALUES (:workspace_id, :roi_index, :name, :type, :seq_index, :nbr_frames, '
+                ':corrected_name, :corrected_seq_index)',
+                [dict(row, workspace_id=workspace_id) for row in rois])
+
+    def refresh(self, filename):
+        ''' Read one workspace again (e.g. after saving it from the app), if part of the dataset '''
+        path = Path(filename)
+        try:
+            relative = path.resolve().relative_to(self.folder.resolve()).as_posix()
+        except ValueError:
+            return
+        if path.is_file():
+            self._store(relative, scan_workspace(path))
+
+    ### QUERIES ###
+
+    def query(self, status=None, roi_type=None, corrected_name=None, text=None):
+        ''' Workspaces matching all given filters
+        :param status: correction status (STATUS_TODO, STATUS_PARTIAL, STATUS_DONE or STATUS_ERROR)
+        :param roi_type: only workspaces with at least one ROI of this type (e.g. 'LA')
+        :param corrected_name: only workspaces with at least one ROI corrected to this slice category
+        :param text: only workspaces whose path contains this text
+        :returns: list of sqlite3.Row ('workspaces' table columns), sorted by path
+        '''
+        conditions, params = [], []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if roi_type:
+            conditions.append('id IN (SELECT workspace_id FROM rois WHERE type = ?)')
+            params.append(roi_type)
+        if corrected_name:
+            conditions.append('id IN (SELECT workspace_id FROM rois WHERE corrected_name = ?)')
+            params.append(corrected_name)
+        if text:
+            conditions.append("path LIKE ? ESCAPE '\\'")
+            params.append('%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        sql = 'SELECT * FROM workspaces'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return self.db.execute(sql + ' ORDER BY path', params).fetchall()
+
+    def slices(self, path):
+        return self.db.execute('SELECT slices.* FROM slices JOIN workspaces ON id = workspace_id WHERE path = ? '
+                               'ORDER BY slice_index', (path,)).fetchall()
+
+    def rois(self, path):
+        return self.db.execute('SELECT rois.* FROM rois JOIN workspaces ON id = workspace_id WHERE path = ? '
+                               'ORDER BY roi_index', (path,)).fetchall()
+
+    def summary(self):
+        ''' Dataset totals
+        :returns: dict with workspace counts per status, and ROI counts per type and correction
+        '''
+        summary = {'workspaces': 0}
+        for row in self.db.execute('SELECT status, COUNT(*) FROM workspaces GROUP BY status'):
+            summary[row[0]] = row[1]
+            summary['workspaces'] += row[1]
+        summary['rois'] = dict(self.db.execute('SELECT type, COUNT(*) FROM rois GROUP BY type').fetchall())
+        summary['corrected'] = dict(self.db.execute("SELECT corrected_name, COUNT(*) FROM rois WHERE corrected_name != '' "
+                                                    'GROUP BY corrected_name').fetchall())
+        return summary
+
+    def full_path(self, path):
+        ''' Absolute path of a catalog entry '''
+        return str(self.folder / path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Catalog of a dataset of DENSEanalysis workspaces')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    scan_parser = subparsers.add_parser('scan', help='create or update the catalog of a dataset folder')
+    query_parser = subparsers.add_parser('query', help='list cataloged workspaces')
+    for sub in [scan_parser, query_parser]:
+        sub.add_argument('folder', help='dataset folder')
+        sub.add_argument('--db', help='catalog file (default: {} in the dataset folder)'.format(CATALOG_NAME))
+    scan_parser.add_argument('--pattern', default='*.dns', help='workspace file pattern (default: *.dns)')
+    scan_parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: all CPUs)')
+    scan_parser.add_argument('--force', action='store_true', help='read all workspaces again, even if unchanged')
+    query_parser.add_argument('--status', choices=CATALOG_STATUSES)
+    query_parser.add_argument('--roi-type', help='only workspaces with ROIs of this type (e.g. SA, LA)')
+    query_parser.add_argument('--corrected-name', help='only workspaces with ROIs corrected to this slice category')
+    query_parser.add_argument('--text', help='only workspaces whose path contains this text')
+    query_parser.add_argument('--summary', action='store_true', help='print dataset totals instead')
+    args = parser.parse_args(argv)
+
+    with Catalog(args.folder, args.db) as catalog:
+        if args.command == 'scan':
+            def progress(done, total, entry):
+                message = ' ({})'.format(entry['error']) if entry['error'] else ''
+                print('[{:>{w}}/{}] {}: {}{}'.format(done, total, entry['path'], entry['status'], message, w=len(str(total))),
+                      file=sys.stderr, flush=True)
+
+            start = time.perf_counter()
+            counts = catalog.scan(args.pattern, args.jobs, args.force, progress)
+            print('Catalog {} updated in {:.1f} s: {added} added, {updated} updated, {removed} removed, '
+                  '{unchanged} unchanged, {errors} errors'.format(catalog.db_path, time.perf_counter() - start, **counts),
+                  file=sys.stderr)
+        elif args.summary:
+            print(json.dumps(catalog.summary(), indent=2))
+        else:
+            for row in catalog.query(args.status, args.roi_type, args.corrected_name, args.text):
+                print('{}\t{}\t{} slices\t{} ROIs ({} SA, {} LA)\t{} corrected'.format(
+                    row['path'], row['status'], row['nbr_slices'], row['nbr_rois'], row['nbr_sa'], row['nbr_la'],
+                    row['nbr_corrected']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
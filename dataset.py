@@ -0,0 +1,225 @@
+'''
+Streaming access to the corrected ROIs of a dataset, for training data loaders
+Reads the workspaces of a dataset folder directly (no export needed, nor PyQt5 or Matlab), and yields
+for each ROI with a correction (CorrectedNames/CorrectedSeqIndex set) the images of its corrected
+slice, its interpolated contours or myocardium masks, and its slice category (see export.roi_sample()),
+as a whole cine or frame by frame. Only the sequences of corrected slices are read.
+
+    from dataset import RoiDataset
+    dataset = RoiDataset(DATASET_FOLDER, unit='frame', target='mask', shuffle=True, seed=0)
+    for epoch in range(nbr_epochs):
+        dataset.set_epoch(epoch)
+        for images, masks, label in dataset:
+            ...
+
+Workspaces are split between shards (e.g. one per training process with shard=(index, count), and
+one per worker of a torch DataLoader, detected automatically), and read ahead in a background thread
+(at most read_ahead workspaces). With shuffle, the order of workspaces and of their samples, and the
+mixing of samples of several workspaces (shuffle buffer), only depend on the seed and the epoch.
+'''
+
+import sys
+import queue
+import threading
+import warnings
+
+import numpy as np
+
+from workspace import Workspace, SLICE_CATEGORIES
+from export import roi_sample, corrected_rois
+from batch import find_workspaces
+
+
+UNITS = ['cine', 'frame']
+TARGETS = ['contours', 'mask']
+# Default number of workspaces read ahead
+READ_AHEAD = 2
+# Default memory budget of the shuffle buffer
+SHUFFLE_BUFFER_MB = 256
+
+
+def worker_shard(shard=None):
+    ''' Shard read by the current process
+    :param shard: (index, count) of the process, default (0, 1)
+    :returns: (index, count), split again between the workers of a torch DataLoader if called from one
+    '''
+    index, count = shard if shard is not None else (0, 1)
+    # torch is never imported here: if used, it is loaded already
+    torch = sys.modules.get('torch')
+    try:
+        info = torch.utils.data.get_worker_info() if torch is not None else None
+    except AttributeError:
+        info = None
+    if info is not None:
+        index, count = index * info.num_workers + info.id, count * info.num_workers
+    return index, count
+
+
+class RoiDataset:
+    '''
+    Iterable over the samples of the corrected ROIs of a dataset folder
+    Samples are (images, target, label), or (images, target, label, info) with with_info:
+        images  (T, 4, H, W) cine, or (4, H, W) frame: magnitude, then x, y and z phases (missing z phase as zeros)
+        target  contours (T, 2, 2, 101) or (2, 2, 101): endo then epi (x, y)
+                or masks (T, H, W) or (H, W): myocardium masks (uint8, or float32 with mask_supersample > 1)
+        label   slice category, as an index of workspace.SLICE_CATEGORIES
+        info    dict with the workspace path, ROI and correction (see export.roi_sample()), and frame
+    Frames are copies, so that a frame kept by the loader doesn't keep its whole cine in memory.
+    Workspaces that can't be read are skipped (with a warning).
+    '''
+
+    def __init__(self, folder, pattern='*.dns', unit='cine', target='contours', shuffle=False, seed=0,
+                 shard=None, read_ahead=READ_AHEAD, shuffle_buffer=SHUFFLE_BUFFER_MB * 2**20,
+                 dtype=np.float32, mask_supersample=1, image_cache=None, with_info=False):
+        '''
+        :param folder: dataset folder (searched recursively)
+        :param pattern: workspace file pattern
+        :param unit: 'cine' (one sample per ROI) or 'frame' (one sample per ROI frame)
+        :param target: 'contours' or 'mask'
+        :param shuffle: shuffle workspaces and samples (see set_epoch())
+        :param seed: shuffling seed
+        :param shard: (index, count) of the shard of workspaces read (see worker_shard())
+        :param read_ahead: number of workspaces read ahead in a background thread (0: read when needed)
+        :param shuffle_buffer: memory budget (bytes) of the samples mixed across workspaces, with shuffle
+        :param dtype: images data type
+        :param mask_supersample: samples per pixel along each axis of masks (> 1: partial-volume masks)
+        :param image_cache: optional imgcache.ImageCache the sequences are read from
+        :param with_info: also yield the info dict of each sample
+        '''
+        if unit not in UNITS:
+            raise ValueError('Unknown sample unit {} (expected one of {}).'.format(unit, ', '.join(UNITS)))
+        if target not in TARGETS:
+            raise ValueError('Unknown target {} (expected one of {}).'.format(target, ', '.join(TARGETS)))
+        self.files = [str(path) for path in find_workspaces(folder, pattern)]
+        self.unit = unit
+        self.target = target
+        self.shuffle = shuffle
+        self.seed = seed
+        self.shard = shard
+        self.read_ahead = read_ahead
+        self.shuffle_buffer = shuffle_buffer
+        self.dtype = np.dtype(dtype)
+        self.mask_supersample = mask_supersample
+        self.image_cache = image_cache
+        self.with_info = with_info
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        ''' Shuffling of the next iterations (same for all shards, different for each epoch) '''
+        self.epoch = epoch
+
+    def shard_files(self):
+        ''' Workspaces of the shard of the current process, in reading order '''
+        files = self.files
+        if self.shuffle:
+            # Same order in all shards, so that they split the dataset
+            files = [files[i] for i in np.random.default_rng([self.seed, self.epoch]).permutation(len(files))]
+        index, count = worker_shard(self.shard)
+        return files[index::count]
+
+    def workspace_samples(self, filename, rng=None):
+        ''' Samples of one workspace
+        :param filename: workspace path
+        :param rng: numpy Generator, to shuffle them
+        :returns: list of samples (see RoiDataset)
+        '''
+        samples = []
+        with Workspace(filename, image_cache=self.image_cache) as ws:
+            for i, name, seq_index in corrected_rois(ws):
+                if name not in SLICE_CATEGORIES:
+                    continue
+                info, images, contours, masks = roi_sample(ws, i, name, seq_index, self.dtype, self.mask_supersample,
+                                                           with_masks=self.target == 'mask')
+                info['workspace'] = filename
+                label = SLICE_CATEGORIES.index(name)
+                target = masks if self.target == 'mask' else contours
+                if self.unit == 'cine':
+                    samples.append((images, target, label, info))
+                else:
+                    samples += [(images[t].copy(), target[t].copy(), label, dict(info, frame=t)) for t in range(len(images))]
+        if rng is not None:
+            samples = [samples[i] for i in rng.permutation(len(samples))]
+        return samples
+
+    def _workspaces(self, files):
+        ''' Samples of each workspace, read when needed '''
+        positions = {filename: i for i, filename in enumerate(self.files)}
+        for filename in files:
+            # Seeded per workspace: doesn't depend on what other threads drew meanwhile
+            rng = np.random.default_rng([self.seed, self.epoch, positions[filename]]) if self.shuffle else None
+            try:
+                yield self.workspace_samples(filename, rng)
+            except Exception as err:
+                warnings.warn('Skipping {}: {}: {}'.format(filename, type(err).__name__, err))
+
+    def _read_ahead(self, files):
+        ''' Samples of each workspace, read by a background thread (at most read_ahead workspaces ahead) '''
+        ready = queue.Queue(maxsize=self.read_ahead)
+        stop = threading.Event()
+        done = object()
+
+        def read():
+            for samples in self._workspaces(files):
+                while not stop.is_set():
+                    try:
+                        ready.put(samples, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            ready.put(done)
+
+        thread = threading.Thread(target=read, name='dataset-read-ahead', daemon=True)
+        thread.start()
+        try:
+            while True:
+                samples = ready.get()
+                if samples is done:
+                    return
+                yield samples
+        finally:
+            # Iteration stopped early: unblock the thread
+            stop.set()
+            while thread.is_alive():
+                try:
+                    ready.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def __iter__(self):
+        files = self.shard_files()
+        # Shuffle buffer is seeded per shard, so that shards don't mix alike
+        index, count = worker_shard(self.shard)
+        rng = np.random.default_rng([self.seed, self.epoch, index, count]) if self.shuffle else None
+        workspaces = self._read_ahead(files) if self.read_ahead > 0 else self._workspaces(files)
+
+        buffer, nbytes = [], 0
+        try:
+            for samples in workspaces:
+                if rng is None:
+                    for sample in samples:
+                        yield self._output(sample)
+                    continue
+                buffer += samples
+                nbytes += sum(_nbytes(sample) for sample in samples)
+                # Random samples of the buffer, until back within its budget
+                while buffer and nbytes > self.shuffle_buffer:
+                    i = rng.integers(len(buffer))
+                    buffer[i], buffer[-1] = buffer[-1], buffer[i]
+                    sample = buffer.pop()
+                    nbytes -= _nbytes(sample)
+                    yield self._output(sample)
+            if rng is not None:
+                for i in rng.permutation(len(buffer)):
+                    yield self._output(buffer[i])
+        finally:
+            # Stops the read-ahead thread if iteration stopped early
+            workspaces.close()
+
+    def _output(self, sample):
+        return sample if self.with_info else sample[:3]
+
+
+def _nbytes(sample):
+    return sample[0].nbytes + sample[1].nbytes
@@ -0,0 +1,265 @@
+'''
+Export of QC-passed ROIs and their cine sequences as a training set
+Selects the ROIs whose corrections (CorrectedNames/CorrectedSeqIndex) are set, and writes,
+for every frame, the images of the corrected slice (magnitude, then x, y, z phases) and
+the interpolated endo/epi contours and myocardium masks. One workspace per worker process.
+
+    python export.py DATASET_FOLDER OUTPUT_FOLDER
+    python main.py export DATASET_FOLDER OUTPUT_FOLDER
+
+Output folder layout (NPY shards, to be opened with np.load(..., mmap_mode='r')):
+    shards/<workspace>_<H>x<W>_images.npy     (nbr frames, 4, H, W) images of all exported frames
+                                              of the workspace with that image size (missing
+                                              z phase filled with zeros)
+    shards/<workspace>_<H>x<W>_contours.npy   (nbr frames, 2, 2, 101) endo then epi contours (x, y)
+    shards/<workspace>_<H>x<W>_masks.npy      (nbr frames, H, W) myocardium masks (uint8, or float32
+                                              pixel coverage with --mask-supersample)
+    parts/<workspace>.json                    samples of one workspace (written last, see below)
+    manifest.json                             all samples: one entry per ROI, with its shards and
+                                              the offset of its first frame in them
+
+The export is resumable: a workspace is skipped if its part file exists, and neither the
+workspace (mtime/size) nor the export settings changed since.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import utils
+import masks
+from workspace import Workspace, roi_corrections, ROI_TYPES
+from batch import find_workspaces
+
+
+# Image channels of a sample: magnitude, then phases along x, y and z
+CHANNELS = ['mag', 'pha_x', 'pha_y', 'pha_z']
+# Arrays exported per sample, one shard each
+SHARD_ARRAYS = ['images', 'contours', 'masks']
+MANIFEST_VERSION = 1
+
+
+def workspace_key(relative):
+    ''' File name stem of the shards of a workspace, from its path relative to the dataset folder '''
+    return Path(relative).with_suffix('').as_posix().replace('/', '__')
+
+
+def _save(filename, array):
+    ''' Write a NPY file atomically (an interrupted export leaves no partial file) '''
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, filename)
+
+
+def roi_sample(ws, roi_index, name, seq_index, dtype=np.float32, mask_supersample=1, with_masks=True):
+    ''' Training sample of one corrected ROI
+    :param ws: Workspace
+    :param roi_index: ROI index (0-based)
+    :param name: corrected name of the ROI
+    :param seq_index: corrected image indices (1-based) of the ROI
+    :param dtype: images data type
+    :param mask_supersample: samples per pixel along each axis of masks (> 1: partial-volume masks)
+    :param with_masks: compute masks (None otherwise)
+    :returns: (sample info dict, images (T, 4, H, W), contours (T, 2, 2, 101), masks (T, H, W))
+    '''
+    roi = ws.rois[roi_index]
+    sequences = [ws.imgs[idx-1] for idx in seq_index]
+    # Number of frames for ROI and slice might differ, only frames with both are exported
+    nbr_frames = min([np.shape(roi['Position'])[0]] + [img.shape[2] for img in sequences])
+    height, width = sequences[0].shape[:2]
+
+    images = np.zeros((nbr_frames, len(CHANNELS), height, width), dtype=dtype)
+    for c, img in enumerate(sequences[:len(CHANNELS)]):
+        images[:, c] = np.moveaxis(img[:, :, :nbr_frames], 2, 0)
+    contours = utils.roi_contours(roi['Type'], roi['Position'][:nbr_frames]).astype(np.float32)
+    roi_masks = None
+    if with_masks:
+        roi_masks = masks.roi_masks(contours, roi['Type'], (height, width), mask_supersample)
+        if mask_supersample == 1:
+            roi_masks = roi_masks.astype(np.uint8)
+
+    info = {
+        'roi_index': roi_index,
+        'name': roi['Name'] if isinstance(roi['Name'], str) else '',
+        'type': roi['Type'],
+        'corrected_name': name,
+        'corrected_seq_index': seq_index,
+        'channels': [CHANNELS[c] for c in range(min(len(sequences), len(CHANNELS)))],
+        'nbr_frames': nbr_frames,
+        'roi_frames': int(np.shape(roi['Position'])[0]),
+        'slice_frames': int(sequences[0].shape[2]),
+    }
+    return info, images, contours, roi_masks
+
+
+def corrected_rois(ws):
+    ''' ROIs of a workspace with a correction
+    :returns: list of (ROI index (0-based), corrected name, corrected image indices (1-based))
+    '''
+    names, assoc = roi_corrections(ws.rois)
+    return [(i, names[i], assoc[i]) for i, roi in enumerate(ws.rois)
+            if names[i] and assoc[i] and roi['Type'] in ROI_TYPES]
+
+
+def roi_samples(ws, dtype=np.float32, mask_supersample=1):
+    ''' Training samples of a workspace: one per ROI with a correction (see roi_sample())
+    :param ws: Workspace
+    :param dtype: images data type
+    :param mask_supersample: samples per pixel along each axis of masks (> 1: partial-volume masks)
+    :returns: list of (sample info dict, images (T, 4, H, W), contours (T, 2, 2, 101), masks (T, H, W))
+    '''
+    return [roi_sample(ws, i, name, seq_index, dtype, mask_supersample) for i, name, seq_index in corrected_rois(ws)]
+
+
+def export_workspace(filename, relative, output_folder, dtype='float32', mask_supersample=1):
+    ''' Worker task: export the samples of one workspace
+    Shards are written first, then the part file listing the samples (marks the workspace as done).
+    :param filename: workspace path
+    :param relative: workspace path relative to the dataset folder
+    :param output_folder: export folder
+    :param dtype: images data type
+    :param mask_supersample: see roi_samples()
+    :returns: part dict with 'workspace', 'mtime_ns', 'size', 'samples' (or 'error')
+    '''
+    stat = os.stat(filename)
+    part = {'workspace': relative, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'samples': [],
+            'settings': export_settings(dtype, mask_supersample)}
+    key = workspace_key(relative)
+    # Workspace is not marked as done while its shards are being rewritten
+    try:
+        os.remove(os.path.join(output_folder, 'parts', key + '.json'))
+    except FileNotFoundError:
+        pass
+    try:
+        with Workspace(str(filename)) as ws:
+            samples = roi_samples(ws, np.dtype(dtype), mask_supersample)
+    except Exception as err:
+        part['error'] = '{}: {}'.format(type(err).__name__, err)
+        return part
+
+    # One pair of shards per image size
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample[1].shape[2:], []).append(sample)
+    for (height, width), group in groups.items():
+        stem = '{}_{}x{}'.format(key, height, width)
+        offset = 0
+        for info, images, _, _ in group:
+            part['samples'].append(dict(info, workspace=relative, offset=offset,
+                                        **{array: 'shards/{}_{}.npy'.format(stem, array) for array in SHARD_ARRAYS}))
+            offset += len(images)
+        for i, array in enumerate(SHARD_ARRAYS, 1):
+            _save(os.path.join(output_folder, 'shards', '{}_{}.npy'.format(stem, array)), np.concatenate([s[i] for s in group]))
+
+    with open(os.path.join(output_folder, 'parts', key + '.json.tmp'), 'w') as f:
+        json.dump(part, f)
+    os.replace(os.path.join(output_folder, 'parts', key + '.json.tmp'), os.path.join(output_folder, 'parts', key + '.json'))
+    return part
+
+
+def export_settings(dtype, mask_supersample):
+    ''' Settings an exported workspace depends on (exported again if they change) '''
+    return {'version': MANIFEST_VERSION, 'dtype': dtype, 'mask_supersample': mask_supersample}
+
+
+def read_part(output_folder, relative):
+    ''' Part file of an already exported workspace, or None '''
+    try:
+        with open(os.path.join(output_folder, 'parts', workspace_key(relative) + '.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def run_export(input_folder, output_folder, pattern='*.dns', jobs=None, dtype='float32', mask_supersample=1,
+               force=False, progress=None):
+    ''' Export all workspaces of a dataset folder with a process pool, then write the manifest
+    :param input_folder: dataset folder (searched recursively)
+    :param output_folder: export folder
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param dtype: images data type
+    :param mask_supersample: see roi_samples()
+    :param force: export all workspaces again, even if already exported and unchanged
+    :param progress: optional callback(number done, total, part)
+    :returns: manifest dict
+    '''
+    for sub in ['shards', 'parts']:
+        os.makedirs(os.path.join(output_folder, sub), exist_ok=True)
+
+    parts, tasks = {}, []
+    for path in find_workspaces(input_folder, pattern):
+        relative = path.relative_to(input_folder).as_posix()
+        part = None if force else read_part(output_folder, relative)
+        stat = path.stat()
+        if part is not None and (part['mtime_ns'], part['size']) == (stat.st_mtime_ns, stat.st_size) \
+                and part.get('settings') == export_settings(dtype, mask_supersample):
+            parts[relative] = part
+        else:
+            tasks.append((path, relative))
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(export_workspace, path, relative, output_folder, dtype, mask_supersample) for path, relative in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                part = future.result()
+                parts[part['workspace']] = part
+                if progress is not None:
+                    progress(done, len(futures), part)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'channels': CHANNELS,
+        'dtype': dtype,
+        'mask_supersample': mask_supersample,
+        'samples': [sample for relative in sorted(parts) for sample in parts[relative]['samples']],
+        'errors': {relative: parts[relative]['error'] for relative in sorted(parts) if 'error' in parts[relative]},
+    }
+    with open(os.path.join(output_folder, 'manifest.json.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(os.path.join(output_folder, 'manifest.json.tmp'), os.path.join(output_folder, 'manifest.json'))
+    return manifest
+
+
+def load_sample(output_folder, sample):
+    ''' Memory-mapped arrays of an exported sample (a manifest entry), no data copied
+    :returns: (images (T, 4, H, W), contours (T, 2, 2, 101), masks (T, H, W))
+    '''
+    frames = slice(sample['offset'], sample['offset'] + sample['nbr_frames'])
+    return tuple(np.load(os.path.join(output_folder, sample[array]), mmap_mode='r')[frames] for array in SHARD_ARRAYS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export QC-passed ROIs and their sequences as NPY shards')
+    parser.add_argument('input_folder', help='dataset folder (searched recursively)')
+    parser.add_argument('output_folder', help='export folder')
+    parser.add_argument('--pattern', default='*.dns', help='workspace file pattern (default: *.dns)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: all CPUs)')
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float64'], help='images data type')
+    parser.add_argument('--mask-supersample', type=int, default=1,
+                        help='samples per pixel along each axis, > 1 for partial-volume (float32) masks')
+    parser.add_argument('--force', action='store_true', help='export all workspaces again, even if already exported')
+    args = parser.parse_args(argv)
+
+    def progress(done, total, part):
+        message = part['error'] if 'error' in part else '{} samples'.format(len(part['samples']))
+        print('[{:>{w}}/{}] {}: {}'.format(done, total, part['workspace'], message, w=len(str(total))),
+              file=sys.stderr, flush=True)
+
+    start = time.perf_counter()
+    manifest = run_export(args.input_folder, args.output_folder, args.pattern, args.jobs, args.dtype,
+                          args.mask_supersample, args.force, progress)
+    print('{} samples ({} frames) exported in {:.1f} s, {} errors'.format(
+        len(manifest['samples']), sum(sample['nbr_frames'] for sample in manifest['samples']),
+        time.perf_counter() - start, len(manifest['errors'])), file=sys.stderr)
+    return 1 if manifest['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
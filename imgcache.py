@@ -0,0 +1,259 @@
+'''
+On-disk cache of the decoded 'img' sequences of workspaces, for instant reopening
+Each workspace gets a folder of the cache directory, holding its sequences as .npy files
+(in the smallest data type holding their values exactly, e.g. int16 for integer valued doubles)
+and a metadata file identifying the source workspace (path, size, mtime, and a fingerprint of its
+first and last bytes). Cached sequences are memory-mapped read-only: no decoding nor copy, and the
+OS page cache is shared between processes. The folder of a workspace is emptied when the workspace
+changes. Sequences are cached when first read (see workspace.SequenceList), or for a whole dataset:
+
+    python imgcache.py warm DATASET_FOLDER --cache-dir CACHE_DIR [--jobs 4]
+    python imgcache.py prune --cache-dir CACHE_DIR      # remove entries of changed or deleted workspaces
+    python main.py cache ...
+
+The app uses the cache directory given with --image-cache (or the DENSE_IMAGE_CACHE environment variable).
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from workspace import Workspace
+
+
+# Environment variable of the default cache directory
+CACHE_DIR_ENV = 'DENSE_IMAGE_CACHE'
+CACHE_VERSION = 1
+META_NAME = 'meta.json'
+# Bytes read at each end of a workspace for its fingerprint
+FINGERPRINT_BYTES = 2**16
+# Integer types tried for integer valued sequences, smallest first
+INTEGER_DTYPES = [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32]
+
+
+def source_key(filename):
+    ''' Identification of a workspace file: path, size, mtime and fingerprint of its first and last bytes '''
+    stat = os.stat(filename)
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if stat.st_size > FINGERPRINT_BYTES:
+            f.seek(max(stat.st_size - FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+            digest.update(f.read())
+    return {'version': CACHE_VERSION, 'source': os.path.abspath(filename), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'fingerprint': digest.hexdigest()}
+
+
+def compact_array(img):
+    ''' Array in the smallest data type holding its values exactly (itself if none) '''
+    if img.size == 0 or img.dtype.kind not in 'fiu':
+        return img
+    if img.dtype.kind == 'f':
+        if not np.isfinite(img).all() or not (img == np.round(img)).all():
+            if img.dtype.itemsize > 4 and np.array_equal(img.astype(np.float32), img, equal_nan=True):
+                return img.astype(np.float32)
+            return img
+    low, high = img.min(), img.max()
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return img if np.dtype(dtype).itemsize >= img.dtype.itemsize else img.astype(dtype)
+    return img
+
+
+def _save(filename, array):
+    ''' Write a NPY file atomically (readers never see a partial file) '''
+    tmp = '{}.{}-{}.tmp'.format(filename, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, filename)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class CacheEntry:
+    '''
+    Cached sequences of one workspace (see ImageCache.entry())
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, k):
+        return os.path.join(self.folder, 'img_{:04d}.npy'.format(k))
+
+    def exists(self, k):
+        return os.path.exists(self.path(k))
+
+    def load(self, k):
+        ''' Cached sequence k, memory-mapped read-only, or None if not cached '''
+        try:
+            return np.load(self.path(k), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    def store(self, k, img):
+        ''' Cache sequence k
+        :returns: the cached sequence (memory-mapped), or img if it can't be cached
+        '''
+        if img.size == 0 or img.dtype.kind not in 'fiu':
+            return img
+        try:
+            _save(self.path(k), compact_array(img))
+        except OSError:
+            return img
+        cached = self.load(k)
+        return img if cached is None else cached
+
+
+class ImageCache:
+    '''
+    Cache directory of decoded sequences, one folder per workspace
+    '''
+
+    def __init__(self, folder):
+        self.folder = str(folder)
+
+    def entry_folder(self, filename):
+        ''' Cache folder of a workspace, from its absolute path '''
+        source = os.path.abspath(filename)
+        return os.path.join(self.folder, '{}_{}'.format(hashlib.sha1(source.encode()).hexdigest()[:16], Path(source).stem))
+
+    def entry(self, filename):
+        ''' Cached sequences of a workspace, emptied first if the workspace changed since they were cached
+        :returns: CacheEntry, or None if the cache can't be used (e.g. read-only cache directory)
+        '''
+        folder = self.entry_folder(filename)
+        meta_file = os.path.join(folder, META_NAME)
+        try:
+            key = source_key(filename)
+            try:
+                with open(meta_file) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = None
+            if meta != key:
+                os.makedirs(folder, exist_ok=True)
+                for path in Path(folder).glob('img_*.npy'):
+                    path.unlink()
+                tmp = '{}.{}.tmp'.format(meta_file, os.getpid())
+                with open(tmp, 'w') as f:
+                    json.dump(key, f)
+                os.replace(tmp, meta_file)
+        except OSError:
+            return None
+        return CacheEntry(folder)
+
+    def prune(self):
+        ''' Remove the folders of workspaces that changed or don't exist anymore
+        :returns: number of folders removed
+        '''
+        removed = 0
+        for folder in Path(self.folder).iterdir() if os.path.isdir(self.folder) else []:
+            try:
+                with open(folder / META_NAME) as f:
+                    meta = json.load(f)
+                stale = meta != source_key(meta['source'])
+            except (OSError, ValueError, KeyError, TypeError):
+                stale = True
+            if stale and folder.is_dir():
+                shutil.rmtree(folder, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def nbytes(self):
+        return sum(path.stat().st_size for path in Path(self.folder).glob('*/img_*.npy'))
+
+
+### DATASET WARMING ###
+
+def warm_workspace(filename, cache_folder):
+    ''' Worker task: cache all sequences of a workspace
+    :param filename: workspace path
+    :param cache_folder: cache directory
+    :returns: dict with 'file', 'error', 'sequences' (number of sequences) and 'cached' (newly cached ones)
+    '''
+    result = {'file': str(filename), 'error': None, 'sequences': 0, 'cached': 0}
+    try:
+        with Workspace(str(filename), image_cache=ImageCache(cache_folder)) as ws:
+            if ws.imgs.cache is None:
+                raise OSError('cannot write into {}'.format(cache_folder))
+            result['sequences'] = len(ws.imgs)
+            for k in range(len(ws.imgs)):
+                if not ws.imgs.cache.exists(k):
+                    ws.imgs[k]
+                    ws.imgs.evict(k)
+                    result['cached'] += 1
+    except Exception as err:
+        result['error'] = '{}: {}'.format(type(err).__name__, err)
+    return result
+
+
+def run_warm(folder, cache_folder, pattern='*.dns', jobs=None, progress=None):
+    ''' Cache the sequences of all workspaces of a folder with a process pool
+    :param folder: folder searched (recursively) for workspaces
+    :param cache_folder: cache directory
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param progress: optional callback(number done, total, result)
+    :returns: list of results (see warm_workspace()), sorted by path
+    '''
+    # Only needed by the command line (the app imports this module on start-up)
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from batch import find_workspaces
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(warm_workspace, path, cache_folder) for path in find_workspaces(folder, pattern)]
+        for future in as_completed(futures):
+            results.append(future.result())
+            if progress is not None:
+                progress(len(results), len(futures), results[-1])
+    return sorted(results, key=lambda result: result['file'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='On-disk cache of decoded workspace images')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    warm_parser = subparsers.add_parser('warm', help='cache the images of all workspaces of a dataset folder')
+    prune_parser = subparsers.add_parser('prune', help='remove cached images of changed or deleted workspaces')
+    for sub in [warm_parser, prune_parser]:
+        sub.add_argument('--cache-dir', default=os.environ.get(CACHE_DIR_ENV), required=CACHE_DIR_ENV not in os.environ,
+                         help='cache directory (default: {} environment variable)'.format(CACHE_DIR_ENV))
+    warm_parser.add_argument('folder', help='dataset folder (searched recursively)')
+    warm_parser.add_argument('--pattern', default='*.dns', help='workspace file pattern (default: *.dns)')
+    warm_parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: all CPUs)')
+    args = parser.parse_args(argv)
+
+    cache = ImageCache(args.cache_dir)
+    start = time.perf_counter()
+    if args.command == 'prune':
+        removed = cache.prune()
+        print('{} cache entries removed in {:.1f} s, {:.1f} MB cached'.format(
+            removed, time.perf_counter() - start, cache.nbytes() / 2**20), file=sys.stderr)
+        return 0
+
+    def progress(done, total, result):
+        message = result['error'] or '{} sequences, {} newly cached'.format(result['sequences'], result['cached'])
+        print('[{:>{w}}/{}] {}: {}'.format(done, total, result['file'], message, w=len(str(total))),
+              file=sys.stderr, flush=True)
+
+    results = run_warm(args.folder, args.cache_dir, args.pattern, args.jobs, progress)
+    print('{} workspaces cached in {:.1f} s: {} sequences newly cached, {} errors, {:.1f} MB cached'.format(
+        len(results), time.perf_counter() - start, sum(result['cached'] for result in results),
+        sum(bool(result['error']) for result in results), cache.nbytes() / 2**20), file=sys.stderr)
+    return 1 if any(result['error'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+'''
+Append-only journal of ROI corrections, one sidecar file per workspace (<workspace>.journal)
+Every Apply/Delete/Delete all of the app is appended to the journal as one JSON line and
+flushed to disk right away, so that corrections survive a crash without rewriting the
+workspace. Reopening a workspace replays its journal over the corrections saved in it.
+Compaction folds journals into their workspaces, with one save backend for all of them
+(started once, e.g. a single Matlab session), then removes them.
+
+    python journal.py compact DATASET_FOLDER [--output-folder OUTPUT_FOLDER] [--save-backend matlab]
+    python main.py journal compact ...
+
+Journal records (one JSON object per line):
+    {"op": "apply", "roi": <0-based ROI index>, "name": <slice category>, "seq_index": [<1-based image indices>]}
+    {"op": "delete", "roi": <0-based ROI index>}
+    {"op": "delete_all"}
+A line cut by a crash while being written is ignored on replay.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import backends
+from workspace import Workspace, ROI_TYPES
+from batch import apply_corrections, find_workspaces
+
+
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_OPS = ['apply', 'delete', 'delete_all']
+
+
+def journal_path(filename):
+    ''' Journal file of a workspace '''
+    return str(filename) + JOURNAL_SUFFIX
+
+
+def _sync(fd):
+    ''' Flush file data to disk (metadata such as mtime is not needed for recovery) '''
+    if hasattr(os, 'fdatasync'):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+class Journal:
+    '''
+    Correction journal of a workspace, opened for appending on first record
+    Appending a record is one write() and one fdatasync() of a short line, whatever the workspace size.
+    '''
+
+    def __init__(self, filename):
+        '''
+        :param filename: workspace path
+        '''
+        self.workspace = str(filename)
+        self.filename = journal_path(filename)
+        self.fd = None
+
+    def append(self, op, **fields):
+        ''' Append a record and flush it to disk '''
+        if op not in JOURNAL_OPS:
+            raise ValueError("Unknown journal operation '{}', should be one of {}.".format(op, JOURNAL_OPS))
+        if self.fd is None:
+            self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        line = json.dumps(dict(op=op, time=round(time.time(), 3), **fields), separators=(',', ':')) + '\n'
+        os.write(self.fd, line.encode())
+        _sync(self.fd)
+
+    def apply(self, roi, name, seq_index):
+        ''' Record a correction of a ROI (0-based index) with a slice category and its image indices (1-based) '''
+        self.append('apply', roi=int(roi), name=name, seq_index=[int(i) for i in seq_index])
+
+    def delete(self, roi):
+        self.append('delete', roi=int(roi))
+
+    def delete_all(self):
+        self.append('delete_all')
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def records(self):
+        return read_journal(self.filename)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def remove(self, records=None):
+        ''' Delete the journal (once folded into the workspace)
+        :param records: only delete it if its records are still these ones (i.e. the ones saved)
+        :returns: True if deleted
+        '''
+        if records is not None and self.records() != records:
+            return False
+        self.close()
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+        return True
+
+
+def read_journal(filename):
+    ''' Records of a journal file ([] if there is none)
+    Lines that can't be parsed (e.g. cut by a crash) are skipped.
+    '''
+    try:
+        with open(filename, 'rb') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    records = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get('op') in JOURNAL_OPS:
+            records.append(record)
+    return records
+
+
+def journal_corrections(records, rois):
+    ''' Journal records as a corrections list, in the batch.py format
+    :param records: journal records, in order
+    :param rois: 'roi' struct array of the workspace
+    :returns: list of dicts {'roi' (1-based index), 'name', 'seq_index'}, to be applied in order
+    '''
+    corrections = []
+    for record in records:
+        if record['op'] == 'apply':
+            corrections.append({'roi': record['roi'] + 1, 'name': record['name'], 'seq_index': record['seq_index']})
+        elif record['op'] == 'delete':
+            corrections.append({'roi': record['roi'] + 1, 'name': '', 'seq_index': []})
+        else:
+            corrections += [{'roi': i + 1, 'name': '', 'seq_index': []} for i in range(len(rois)) if rois[i]['Type'] in ROI_TYPES]
+    return corrections
+
+
+def replay(ws, records):
+    ''' Corrections of a workspace after its journal
+    :param ws: Workspace
+    :param records: journal records of the workspace
+    :returns: (corrected names, corrected image indices), see workspace.roi_corrections()
+    :raises ValueError: if a record does not match the workspace (see batch.apply_corrections())
+    '''
+    names, assoc, _ = apply_corrections(ws, journal_corrections(records, ws.rois))
+    return names, assoc
+
+
+def compact(tasks, backend, progress=None):
+    ''' Fold journals into their workspaces, then remove them
+    :param tasks: list of (workspace path, output path) (can be the same path), workspaces without journal being skipped
+    :param backend: save backend, used for all workspaces (see backends.py)
+    :param progress: optional callback(number done, total, result)
+    :returns: list of dicts with 'file', 'output', 'status' ('saved' or 'error'), 'records', 'message'
+    '''
+    tasks = [(str(filename), str(output_file)) for filename, output_file in tasks if os.path.exists(journal_path(filename))]
+    results = []
+    for filename, output_file in tasks:
+        result = {'file': filename, 'output': output_file, 'status': 'error', 'records': 0, 'message': ''}
+        try:
+            records = read_journal(journal_path(filename))
+            result['records'] = len(records)
+            with Workspace(filename) as ws:
+                names, assoc = replay(ws, records)
+            backend.update_workspace_corrected(names, assoc, filename, output_file)
+            # Records appended meanwhile (e.g. by another app instance) are kept
+            if read_journal(journal_path(filename)) == records:
+                os.remove(journal_path(filename))
+            result['status'] = 'saved'
+        except Exception as err:
+            result['message'] = '{}: {}'.format(type(err).__name__, err)
+        results.append(result)
+        if progress is not None:
+            progress(len(results), len(tasks), result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fold correction journals into their workspaces')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compact_parser = subparsers.add_parser('compact', help='save journaled corrections into workspaces, then remove journals')
+    compact_parser.add_argument('folder', help='dataset folder (searched recursively)')
+    compact_parser.add_argument('--output-folder', help='folder of the saved workspaces (default: rewritten in place)')
+    compact_parser.add_argument('--pattern', default='*.dns', help='workspace file pattern (default: *.dns)')
+    compact_parser.add_argument('--save-backend', choices=list(backends.BACKENDS), default='native')
+    args = parser.parse_args(argv)
+
+    def progress(done, total, result):
+        message = result['message'] or '{} records'.format(result['records'])
+        print('[{:>{w}}/{}] {}: {} ({})'.format(done, total, result['file'], result['status'], message, w=len(str(total))),
+              file=sys.stderr, flush=True)
+
+    # Sub-folder structure is kept in the output folder (as in batch.py)
+    tasks = []
+    for path in find_workspaces(args.folder, args.pattern):
+        output_file = path if args.output_folder is None else Path(args.output_folder) / path.relative_to(args.folder)
+        if os.path.exists(journal_path(path)):
+            os.makedirs(output_file.parent, exist_ok=True)
+            tasks.append((path, output_file))
+    start = time.perf_counter()
+    backend = backends.start_backend(args.save_backend)
+    try:
+        results = compact(tasks, backend, progress)
+    finally:
+        backend.quit()
+    errors = sum(result['status'] == 'error' for result in results)
+    print('{} journals compacted in {:.1f} s, {} errors'.format(len(results) - errors, time.perf_counter() - start, errors),
+          file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
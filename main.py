@@ -1,95 +1,286 @@
-import utils
+import perf
 
 import os
 import re
 import sys
+import time
+import argparse
+import importlib
+import contextlib
 from pathlib import Path
-import numpy as np
-from scipy.io import loadmat
 
-import matlab.engine as mtlb
-
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qt5agg import FigureCanvas
-
-from PyQt5.QtGui import *
-from PyQt5.QtCore import *
-from PyQt5.QtWidgets import * 
-
-
-
-class HTMLDelegate(QStyledItemDelegate):
-    '''Custom Item Delegate
-    Used for ROI list to automatically change
-    the color of slice indices in the list items text
+# Heavy modules (matplotlib, scipy, Matlab engine) are only imported when first needed
+with perf.startup.timed('import numpy'):
+    import numpy as np
+
+with perf.startup.timed('import PyQt5'):
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+    from PyQt5.QtWidgets import * 
+
+with perf.startup.timed('import app modules'):
+    import utils
+    import backends
+    from workspace import Workspace, slice_label, roi_corrections, SLICE_CATEGORIES, ROI_TYPES
+    from render import FrameRenderer, FrameBuilder
+    from montage import Montage
+    from cache import LRUCache, CachePrefiller, SequenceBudget
+    from imgcache import ImageCache, CACHE_DIR_ENV
+    from prefetch import WorkspacePrefetcher
+    from catalog import Catalog, CATALOG_NAME, CATALOG_STATUSES
+    from journal import Journal, replay, compact, journal_path, JOURNAL_OPS
+    from saver import SaveJob, SaveWorker
+    from roilist import RoiListModel, RoiDelegate
+    from analysis import AnalysisWorker
+
+
+
+def figure_canvas():
+    ''' Create matplotlib canvas for the images panel
+    matplotlib is imported here, as it is only needed once a workspace is opened
     '''
-    def paint(self, painter, option, index):
-        '''Function overwrite
-        Main style function for list items
-        '''
-        ### Standard ###
-        options = QStyleOptionViewItem(option)
-        self.initStyleOption(options,index)
-        #################
+    with perf.startup.timed('import matplotlib'):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_qt5agg import FigureCanvas
+    return FigureCanvas(Figure(figsize=(5, 15)))
 
-        # Converting item text to html with custom color management
-        doc = self.text_to_html(options.text)
 
-        ### Standard ####
-        options.text = ""
-        style = QApplication.style() if options.widget is None else options.widget.style()
-        style.drawControl(QStyle.CE_ItemViewItem, options, painter)
 
-        ctx = QAbstractTextDocumentLayout.PaintContext()
-        if option.state & QStyle.State_Selected:
-            ctx.palette.setColor(QPalette.Text, option.palette.color(QPalette.Active, QPalette.HighlightedText))
+class CatalogDialog(QDialog):
+    '''
+    Dataset catalog browser (see catalog.py)
+    Lists the cataloged workspaces of a dataset folder with filters on correction status,
+    ROI types and corrected slice categories. Opening a workspace accepts the dialog.
+    '''
 
-        # If item is disabled, set text color to gray
-        if index.model().flags(index) == Qt.NoItemFlags:
-            ctx.palette.setColor(QPalette.Text, QColor(Qt.gray))
+    COLUMNS = ['path', 'status', 'nbr_slices', 'nbr_rois', 'nbr_sa', 'nbr_la', 'nbr_corrected']
+    HEADERS = ['Workspace', 'Status', 'Slices', 'ROIs', 'SA', 'LA', 'Corrected']
 
-        textRect = style.subElementRect(QStyle.SE_ItemViewItemText, options)
-        painter.save()
-        painter.translate(textRect.topLeft())
-        painter.setClipRect(textRect.translated(-textRect.topLeft()))
-        doc.documentLayout().draw(painter, ctx)
-        painter.restore()
-        #################
+    def __init__(self, parent, catalog):
+        '''
+        :param parent: parent widget
+        :param catalog: catalog.Catalog of the dataset
+        '''
+        super().__init__(parent)
+        self.catalog = catalog
+        self.selected_file = None
+        self.setWindowTitle('Dataset catalog - {}'.format(catalog.folder))
+        self.resize(900, 600)
+        layout = QVBoxLayout(self)
+
+        ### FILTERS ###
+        filter_layout = QHBoxLayout()
+        layout.addLayout(filter_layout)
+        self.status_filter = QComboBox()
+        self.status_filter.addItems([''] + CATALOG_STATUSES)
+        self.roi_type_filter = QComboBox()
+        self.roi_type_filter.addItems([''] + ROI_TYPES)
+        self.corrected_filter = QComboBox()
+        self.corrected_filter.addItems([''] + SLICE_CATEGORIES)
+        self.text_filter = QLineEdit()
+        self.text_filter.setPlaceholderText('Path contains...')
+        for label, widget in [('Status', self.status_filter), ('ROI type', self.roi_type_filter),
+                              ('Corrected as', self.corrected_filter)]:
+            filter_layout.addWidget(QLabel(label))
+            filter_layout.addWidget(widget)
+            widget.currentIndexChanged.connect(self.refresh)
+        filter_layout.addWidget(self.text_filter)
+        self.text_filter.textChanged.connect(self.refresh)
+
+        ### WORKSPACE TABLE ###
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.cellDoubleClicked.connect(lambda row, column: self.open_selected())
+        layout.addWidget(self.table)
+
+        ### BUTTONS ###
+        button_layout = QHBoxLayout()
+        layout.addLayout(button_layout)
+        self.summary_label = QLabel()
+        button_layout.addWidget(self.summary_label, stretch=1)
+        scan_button = QPushButton('Rescan folder')
+        scan_button.clicked.connect(self.scan)
+        button_layout.addWidget(scan_button)
+        open_button = QPushButton('Open')
+        open_button.setDefault(True)
+        open_button.clicked.connect(self.open_selected)
+        button_layout.addWidget(open_button)
+
+        self.refresh()
+
+    def refresh(self):
+        ''' Fill table with workspaces matching current filters '''
+        rows = self.catalog.query(self.status_filter.currentText(), self.roi_type_filter.currentText(),
+                                  self.corrected_filter.currentText(), self.text_filter.text())
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, column in enumerate(self.COLUMNS):
+                item = QTableWidgetItem('' if row[column] is None else str(row[column]))
+                if column == 'status' and row['error']:
+                    item.setToolTip(row['error'])
+                self.table.setItem(i, j, item)
+        summary = self.catalog.summary()
+        self.summary_label.setText('{} of {} workspaces shown ({} to QC, {} done)'.format(
+            len(rows), summary['workspaces'], summary.get('todo', 0), summary.get('done', 0)))
+
+    def scan(self):
+        ''' Update catalog with new or modified workspaces of the folder '''
+        progress_dialog = QProgressDialog('Scanning workspaces...', None, 0, 0, self)
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+
+        def progress(done, total, entry):
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(done)
+            QApplication.processEvents()
 
+        try:
+            counts = self.catalog.scan(progress=progress)
+        finally:
+            progress_dialog.close()
+        self.refresh()
+        self.summary_label.setText(self.summary_label.text() + ' - {added} added, {updated} updated, '
+                                   '{removed} removed, {errors} errors'.format(**counts))
+
+    def open_selected(self):
+        row = self.table.currentRow()
+        if row < 0:
+            return
+        self.selected_file = self.catalog.full_path(self.table.item(row, 0).text())
+        self.accept()
 
-    def sizeHint(self, option, index):
-        '''Function overwrite
-        Used by paint() to estimate item dimensions for display
-        '''
-        ### Standard ###
-        options = QStyleOptionViewItem(option)
-        self.initStyleOption(options,index)
-        ################
 
-        # Converting text to html like in paint()
-        doc = self.text_to_html(options.text)
 
-        # Estimating size
-        doc.setTextWidth(options.rect.width())
-        return QSize(int(doc.idealWidth()), int(doc.size().height()))
+class PerfPanel(QDialog):
+    '''
+    Performance panel: rolling timings of the app hot paths (see perf.HotPathProfiler)
+    Refreshed every second while shown, can be exported to JSON or CSV.
+    '''
 
+    COLUMNS = ['event', 'count', 'last_ms'] + ['p{}_ms'.format(q) for q in perf.PERCENTILES] + ['max_ms', 'memory_median_mb', 'memory_max_mb']
+    HEADERS = ['Event', 'Count', 'Last (ms)'] + ['p{} (ms)'.format(q) for q in perf.PERCENTILES] + ['Max (ms)', 'Memory median (MB)', 'Memory max (MB)']
+    REFRESH_MS = 1000
 
-    def text_to_html(self, text, color='#32CD32'):
+    def __init__(self, parent, profiler):
         '''
-        Given a text of format 'XXXX [Y Y Y] [Z, Z, Z]', transforms it in a HTML format
-        and changes the color of '[Z, Z, Z]'
-        :param text: original string
-        :param color: rgb string '#RRGGBB' for custom color
-        :returns: QTextDocument containing HTML text
+        :param parent: parent widget
+        :param profiler: perf.HotPathProfiler
         '''
-        doc = QTextDocument()
-        text = text.split('\t')
-        if len(text) > 2:
-            text = ' '.join(text[:2]) + ' <span style="color:#32CD32;">' + text[2] + '</span>'
+        super().__init__(parent)
+        self.profiler = profiler
+        self.setWindowTitle('Performance')
+        self.resize(900, 450)
+        layout = QVBoxLayout(self)
+
+        session = perf.session
+        if session is None:
+            profiling = 'off (set {}=cprofile or tracemalloc)'.format(perf.PROFILE_ENV)
         else:
-            text = ' '.join(text)
-        doc.setHtml('<pre>' + text + '<\pre>')
-        return doc
+            profiling = '{} (reports written on exit)'.format(', '.join(session.modes))
+        memory = 'traced memory' if session is not None and 'tracemalloc' in session.modes else 'resident memory'
+        info = QLabel('Last {} occurrences of each event. Memory: change of {} during the event. '
+                      'Session profiling: {}'.format(profiler.window, memory, profiling))
+        info.setWordWrap(True)
+        layout.addWidget(info)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        layout.addLayout(button_layout)
+        button_layout.addStretch(1)
+        for text, slot in [('Reset', self.reset), ('Export...', self.export), ('Close', self.close)]:
+            button = QPushButton(text)
+            button.clicked.connect(slot)
+            button_layout.addWidget(button)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.refresh()
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start(self.REFRESH_MS)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        rows = self.profiler.summary()
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, column in enumerate(self.COLUMNS):
+                value = row[column]
+                if value is None or isinstance(value, (str, int)):
+                    item = QTableWidgetItem('' if value is None else str(value))
+                else:
+                    item = QTableWidgetItem('{:.2f}'.format(value))
+                if j > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(i, j, item)
+
+    def reset(self):
+        self.profiler.reset()
+        self.refresh()
+
+    def export(self):
+        filename, _ = QFileDialog.getSaveFileName(self, 'Export timings', 'dense_timings.json', 'JSON (*.json);; CSV (*.csv)')
+        if filename == '':
+            return
+        try:
+            self.profiler.export(filename)
+        except OSError as err:
+            QMessageBox.critical(self, 'Error', 'Cannot export timings to {}:\n{}'.format(filename, err))
+
+
+# Default memory budget of the frame render cache
+RENDER_CACHE_MB = 512
+# Default memory budget of the decoded image sequences of all opened (and prefetched) workspaces
+SEQUENCE_BUDGET_MB = 2048
+# Default cine playback speed (frames per second)
+PLAYBACK_FPS = 20
+# Default number of next workspaces loaded in advance, and memory cap of their sequences
+PREFETCH_DEPTH = 1
+PREFETCH_MB = 1024
+# Command line tools run by main.py <command>: command -> module (see the main() of each module)
+COMMANDS = {
+    'batch': 'batch',           # headless batch mode
+    'export': 'export',         # training set export
+    'journal': 'journal',       # correction journals compaction
+    'suggest': 'suggest',       # ROI-to-slice suggestions of a dataset
+    'qc': 'qc',                 # contour QC report of a dataset
+    'cache': 'imgcache',        # on-disk image cache
+    'catalog': 'catalog',       # dataset catalog
+}
+
+
+class WorkspaceTab:
+    '''
+    Workspace opened in a tab of the main window, with its corrections (ROI panel model and journal)
+    and the view state restored when switching back to it
+    '''
+
+    def __init__(self, filename, workspace, journal, roi_model, roi_delegate):
+        self.filename = filename
+        self.workspace = workspace
+        self.journal = journal
+        self.roi_model = roi_model
+        self.roi_delegate = roi_delegate
+        # Render cache builder, with the display cubes and ROI contours it computed (see frame_builder())
+        self.frame_builder = FrameBuilder(workspace)
+        # Selected slice (drop-down menu index), frame (1-based) and ROI (row or None)
+        self.slice_index = 0
+        self.frame = 1
+        self.roi_row = None
 
 
 
@@ -98,19 +289,65 @@ class DenseVisualizer(QMainWindow):
     Main application window
     '''
 
-    def __init__(self):
+    # Save backend status messages, emitted from the backend loading and save threads
+    backend_status = pyqtSignal(str)
+    # Finished background saves (saver.SaveJob), emitted from the save thread
+    save_done = pyqtSignal(object)
+    # Analyses of the opened workspace (workspace path, analysis name, result), emitted from the analysis thread
+    analysis_done = pyqtSignal(str, str, object)
+
+    def __init__(self, save_backend='native', image_cache=None):
+        '''
+        :param save_backend: backend used to save workspaces (see backends.py)
+        :param image_cache: optional directory of the on-disk cache of decoded images (see imgcache.py)
+        '''
         super().__init__()
         # Initialize menu options only
         # Wait for file opening before loading other UI elements (see open_file())
         self.init_menu()
 
         self.user_set_output = False
+        # Overwriting input files confirmed (asked once, see confirm_overwrite())
+        self.overwrite_confirmed = False
         self.input_folder = './'
-
-        # Starting matlab engine (need Matlab for results export)
-        # Needed as impossible to use scipy.io.savemat in append mode with .dns files from recent Matlab versions
-        # and saving full file fails in Python due to 'seq' field of .dns file containing reference to Matlab functions
-        self.eng = mtlb.start_matlab()
+        # Dataset catalog, once opened (see open_catalog())
+        self.catalog = None
+        # Correction journal of the current workspace, and workspaces edited during the session (see journal.py)
+        self.journal = None
+        self.edited_files = set()
+        # Opened workspaces, in tab order, and the current one (see activate_tab())
+        self.tabs = []
+        self.tab = None
+        # Decoded sequences of all opened workspaces, least recently used ones evicted (and read again when needed)
+        self.sequence_budget = SequenceBudget(SEQUENCE_BUDGET_MB * 2**20)
+        # Decoded images kept on disk, reopened workspaces reading them instead of their file
+        self.image_cache = ImageCache(image_cache) if image_cache else None
+
+        # Cache of ready-to-display frames, filled in the background on slice/ROI selection
+        self.render_cache = LRUCache(RENDER_CACHE_MB * 2**20)
+        self.render_prefiller = CachePrefiller(self.render_cache)
+
+        # Background loading of the next workspaces of the folder
+        self.prefetch_depth = PREFETCH_DEPTH
+        self.prefetcher = WorkspacePrefetcher(PREFETCH_MB * 2**20, self.sequence_budget, self.image_cache)
+
+        # Cine playback timer (see on_play_toggle())
+        self.playback_timer = QTimer(self)
+        self.playback_timer.setTimerType(Qt.PreciseTimer)
+        self.playback_timer.timeout.connect(self.on_playback_tick)
+
+        # Starting save backend in the background, so that the window is responsive right away
+        # scipy.io.savemat can't be used (no append mode, and saving full file fails due to 'seq' field
+        # of .dns file containing reference to Matlab functions), so either the native writer
+        # (only rewrites the 'roi' entry) or the Matlab engine is used (see backends.py)
+        self.backend_status.connect(self.statusBar().showMessage)
+        self.eng = backends.BackendLoader(save_backend, on_status=self.backend_status.emit)
+        # Workspaces are saved in the background, so that the next slice or workspace can be opened right away
+        self.saver = SaveWorker(self.eng, on_status=self.backend_status.emit, on_done=self.save_done.emit)
+        self.save_done.connect(self.on_save_done)
+        # QC flags and suggested slice of each ROI, computed in the background on workspace opening (see analysis.py)
+        self.analyzer = AnalysisWorker(on_done=self.analysis_done.emit)
+        self.analysis_done.connect(self.on_analysis_done)
 
 
     def init_menu(self):
@@ -134,22 +371,109 @@ class DenseVisualizer(QMainWindow):
         open_act.setStatusTip('Select a workspace to open')
         open_act.triggered.connect(self.open_file)
 
+        next_act = QAction('&Next workspace', self)
+        next_act.setShortcut('Ctrl+PgDown')
+        next_act.setStatusTip('Open next workspace of the folder')
+        next_act.triggered.connect(lambda: self.open_neighbour(1))
+
+        previous_act = QAction('&Previous workspace', self)
+        previous_act.setShortcut('Ctrl+PgUp')
+        previous_act.setStatusTip('Open previous workspace of the folder')
+        previous_act.triggered.connect(lambda: self.open_neighbour(-1))
+
+        catalog_act = QAction('Open from &catalog', self)
+        catalog_act.setShortcut('Ctrl+Shift+o')
+        catalog_act.setStatusTip('Browse and filter the workspaces of a dataset folder')
+        catalog_act.triggered.connect(self.open_catalog)
+
+        close_tab_act = QAction('C&lose workspace', self)
+        close_tab_act.setShortcut('Ctrl+F4')
+        close_tab_act.setStatusTip('Close the workspace tab')
+        close_tab_act.triggered.connect(lambda: self.close_tab(self.tab_bar.currentIndex()) if self.tabs else None)
+
+        next_tab_act = QAction('Next &tab', self)
+        next_tab_act.setShortcut('Ctrl+Tab')
+        next_tab_act.triggered.connect(lambda: self.step_tab(1))
+
+        previous_tab_act = QAction('Previous t&ab', self)
+        previous_tab_act.setShortcut('Ctrl+Shift+Tab')
+        previous_tab_act.triggered.connect(lambda: self.step_tab(-1))
+
         self.save_act = QAction('&Save workspace', self)
         self.save_act.setShortcut('Ctrl+s')
         self.save_act.setStatusTip('Save current workspace')
         self.save_act.setEnabled(False)
+        self.save_act.triggered.connect(self.on_save_click)
+
+        self.montage_act = QAction('&Montage overview', self)
+        self.montage_act.setShortcut('Ctrl+m')
+        self.montage_act.setStatusTip('Show all slices of the workspace at once (click a slice to open it)')
+        self.montage_act.setCheckable(True)
+        self.montage_act.setEnabled(False)
+        self.montage_act.toggled.connect(self.on_montage_toggle)
+
+        self.zoom_act = QAction('&Zoom on ROI', self)
+        self.zoom_act.setShortcut('Ctrl+r')
+        self.zoom_act.setStatusTip('Show only the region of the selected ROI, for the whole cine')
+        self.zoom_act.setCheckable(True)
+        self.zoom_act.setEnabled(False)
+        self.zoom_act.toggled.connect(self.on_zoom_toggle)
+
+        self.accept_act = QAction('&Accept suggestion', self)
+        self.accept_act.setShortcut('Return')
+        # Only when the ROI panel has focus (Enter is also used by the frame input and dialogs)
+        self.accept_act.setShortcutContext(Qt.WidgetWithChildrenShortcut)
+        self.accept_act.setStatusTip('Apply the suggested slice to the selected ROI, then select the next suggestion')
+        self.accept_act.setEnabled(False)
+        self.accept_act.triggered.connect(self.on_accept_click)
 
         file_menu = menu_bar.addMenu('&File')
         file_menu.addAction(open_act)
+        file_menu.addAction(catalog_act)
+        file_menu.addAction(next_act)
+        file_menu.addAction(previous_act)
         file_menu.addAction(self.save_act)
+        file_menu.addAction(close_tab_act)
         file_menu.addAction(quit_act)
 
         set_out_folder_act = QAction('&Set output folder', self)
         set_out_folder_act.setShortcut('Ctrl+w')
         set_out_folder_act.triggered.connect(self.set_output_folder)
 
+        set_prefetch_act = QAction('Set workspace &prefetching', self)
+        set_prefetch_act.setStatusTip('Set number and memory cap of workspaces loaded in advance')
+        set_prefetch_act.triggered.connect(self.set_prefetching)
+
+        perf_panel_act = QAction('Performance &panel', self)
+        perf_panel_act.setShortcut('Ctrl+Shift+p')
+        perf_panel_act.setStatusTip('Show timings of workspace opening, rendering and saving')
+        perf_panel_act.triggered.connect(self.show_perf_panel)
+
+        set_cache_size_act = QAction('Set render &cache size', self)
+        set_cache_size_act.setStatusTip('Set memory budget of the frame render cache')
+        set_cache_size_act.triggered.connect(self.set_render_cache_size)
+
+        set_budget_act = QAction('Set &image memory budget', self)
+        set_budget_act.setStatusTip('Set memory budget of the images of all opened workspaces')
+        set_budget_act.triggered.connect(self.set_sequence_budget)
+
+        edit_menu = menu_bar.addMenu('&Edit')
+        edit_menu.addAction(self.accept_act)
+
+        view_menu = menu_bar.addMenu('&View')
+        view_menu.addAction(self.montage_act)
+        view_menu.addAction(self.zoom_act)
+        view_menu.addSeparator()
+        view_menu.addAction(next_tab_act)
+        view_menu.addAction(previous_tab_act)
+
         utils_menu = menu_bar.addMenu('&Utilities')
         utils_menu.addAction(set_out_folder_act)
+        utils_menu.addAction(set_cache_size_act)
+        utils_menu.addAction(set_budget_act)
+        utils_menu.addAction(set_prefetch_act)
+        utils_menu.addSeparator()
+        utils_menu.addAction(perf_panel_act)
 
         ### WINDOW GEOMETRY ###
         self.setWindowState(Qt.WindowMaximized)
@@ -172,7 +496,18 @@ class DenseVisualizer(QMainWindow):
         main_widget.setLayout(main_layout)
 
         self.save_act.setEnabled(True)
-        self.save_act.triggered.connect(self.on_save_click)
+        self.accept_act.setEnabled(True)
+
+
+        ### WORKSPACE TABS ###
+
+        self.tab_bar = QTabBar()
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setDocumentMode(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.currentChanged.connect(self.on_tab_change)
+        self.tab_bar.tabCloseRequested.connect(self.close_tab)
+        main_layout.addWidget(self.tab_bar)
 
 
         ### SLICE SELECTION ###
@@ -188,9 +523,25 @@ class DenseVisualizer(QMainWindow):
         images_view = QVBoxLayout(images_widget)
 
         # Plots
-        self.canvas = FigureCanvas(Figure(figsize=(5, 15)))
+        self.canvas = figure_canvas()
         self.axis = self.canvas.figure.subplots(1,4)
-        images_view.addWidget(self.canvas)
+        self.renderer = FrameRenderer(self.canvas, self.axis)
+        # Montage overview of all slices (see on_montage_toggle()), shown instead of the plots
+        self.montage_canvas = figure_canvas()
+        self.montage_axis = self.montage_canvas.figure.add_axes([0, 0, 1, 1])
+        self.montage_axis.axis('off')
+        self.montage_canvas.mpl_connect('button_press_event', self.on_montage_click)
+        self.montage_canvas.mpl_connect('motion_notify_event', self.on_montage_hover)
+        self.montage = None
+        self.montage_workspace = None
+        # Display cubes of the montage slices, kept while it is shown (see render.FrameBuilder)
+        self.montage_cubes = []
+        self.images_stack = QStackedWidget()
+        self.images_stack.addWidget(self.canvas)
+        self.images_stack.addWidget(self.montage_canvas)
+        images_view.addWidget(self.images_stack)
+        self.montage_act.setEnabled(True)
+        self.zoom_act.setEnabled(True)
 
         # Frame selection view
         frame_edit_widget = QWidget()
@@ -211,6 +562,17 @@ class DenseVisualizer(QMainWindow):
         # Maximum frames textbox
         self.frame_label = QLabel()
         frame_edit_view.addWidget(self.frame_label)
+        # Cine playback
+        self.play_button = QPushButton('Play', sizePolicy=QSizePolicy(QSizePolicy.Maximum, QSizePolicy.Maximum))
+        self.play_button.setCheckable(True)
+        self.play_button.toggled.connect(self.on_play_toggle)
+        frame_edit_view.addWidget(self.play_button)
+        self.fps_input = QSpinBox()
+        self.fps_input.setRange(1, 60)
+        self.fps_input.setSuffix(' fps')
+        self.fps_input.setValue(PLAYBACK_FPS)
+        self.fps_input.valueChanged.connect(self.on_fps_change)
+        frame_edit_view.addWidget(self.fps_input)
 
 
         ### ROI PANEL ###
@@ -218,11 +580,14 @@ class DenseVisualizer(QMainWindow):
         roi_widget = QWidget()
         roi_view = QVBoxLayout(roi_widget)
     
-        # List of available ROIs
-        self.roi_list = QListWidget()
-        self.roi_list.itemPressed.connect(self.on_item_click)
-        self.roi_list.itemDoubleClicked.connect(self.on_item_double_click)
-        self.roi_list.setItemDelegate(HTMLDelegate())
+        # List of available ROIs (see roilist.py), model and delegate of the current tab
+        self.roi_list = QListView()
+        # Single line rows: row heights are not measured one by one
+        self.roi_list.setUniformItemSizes(True)
+        self.roi_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.roi_list.pressed.connect(self.on_item_click)
+        self.roi_list.doubleClicked.connect(self.on_item_double_click)
+        self.roi_list.addAction(self.accept_act)
         roi_view.addWidget(self.roi_list)
 
         # Apply button 
@@ -232,7 +597,7 @@ class DenseVisualizer(QMainWindow):
         roi_view.addWidget(apply_groupbox)
 
         self.apply_radio_group = QButtonGroup()
-        radio_buttons = [QRadioButton(cat) for cat in ['base', 'mid', 'apex', '2ch', '3ch', '4ch']]
+        radio_buttons = [QRadioButton(cat) for cat in SLICE_CATEGORIES]
         for i, button in enumerate(radio_buttons):
             apply_box_layout.addWidget(button, i//3, i%3)
             self.apply_radio_group.addButton(button)
@@ -257,6 +622,11 @@ class DenseVisualizer(QMainWindow):
         clear_button = QPushButton('Clear display', sizePolicy=QSizePolicy(QSizePolicy.Maximum, QSizePolicy.Maximum))
         clear_button.clicked.connect(self.on_clear_click)
         button_layout.addWidget(clear_button, 0, 0, 1, 2, alignment=Qt.AlignCenter)
+        # Button to accept the suggested slice of current item (see on_accept_click())
+        accept_button = QPushButton('Accept suggestion', sizePolicy=QSizePolicy(QSizePolicy.Maximum, QSizePolicy.Maximum))
+        accept_button.setToolTip('Apply the suggested slice (Enter in the ROI panel)')
+        accept_button.clicked.connect(self.on_accept_click)
+        button_layout.addWidget(accept_button, 1, 0, 1, 2, alignment=Qt.AlignCenter)
 
 
         ### Horizontal flexible splitter between images and roi panel ###
@@ -286,119 +656,338 @@ class DenseVisualizer(QMainWindow):
             pass
         # If selection succesfull, get filename, otherwise do nothing
         if dialog.exec_():
-            self.filename = dialog.selectedFiles()[0]
+            self.load_workspace(dialog.selectedFiles()[0])
+
+
+    def open_catalog(self):
+        ''' 'Open from catalog' menu action
+        Select a dataset folder, scan it if it has no catalog yet, then browse its workspaces
+        '''
+        if self.catalog is None:
+            folder = QFileDialog.getExistingDirectory(self, 'Select dataset folder', str(self.input_folder))
+            if folder == '':
+                return
+            new = not os.path.exists(os.path.join(folder, CATALOG_NAME))
+            try:
+                self.catalog = Catalog(folder)
+            except Exception as err:
+                QMessageBox.critical(self, 'Error', 'Cannot open catalog of {}:\n{}'.format(folder, err))
+                return
         else:
+            new = False
+
+        dialog = CatalogDialog(self, self.catalog)
+        if new:
+            QTimer.singleShot(0, dialog.scan)
+        if dialog.exec_() and dialog.selected_file is not None:
+            self.load_workspace(dialog.selected_file)
+
+
+    def load_workspace(self, filename, new_tab=True):
+        '''
+        Load data from .dns workspace and initialize UI
+        :param filename: workspace path
+        :param new_tab: open in a new tab (otherwise replaces the current workspace),
+            a workspace already opened is only switched to
+        '''
+        with perf.hot.timed('load_workspace', memory=True):
+            self._load_workspace(filename, new_tab)
+
+
+    def _load_workspace(self, filename, new_tab):
+        filename = str(Path(filename))
+        for index, tab in enumerate(self.tabs):
+            if tab.filename == filename:
+                self.tab_bar.setCurrentIndex(index)
+                return
+        # Load data from DENSEanalysis workspace, prefetched if possible
+        # (only headers are needed here, cine sequences are read on slice selection)
+        try:
+            with perf.hot.timed('load_workspace.open'):
+                workspace = self.prefetcher.take(filename) or Workspace(filename, self.sequence_budget, self.image_cache)
+        except Exception as err:
+            QMessageBox.critical(self, 'Error', 'Cannot open {}:\n{}'.format(filename, err))
             return
 
+        # Initialize main UI (kept when opening another workspace)
+        if not hasattr(self, 'canvas'):
+            self.init_UI()
+
+        # Frames rendered from a previous version of the file
+        self.render_cache.discard(lambda key: key[0] == filename)
+        roi_model = RoiListModel(self)
+        tab = WorkspaceTab(filename, workspace, Journal(filename), roi_model, RoiDelegate(roi_model, self.roi_list))
+        self.tab_bar.blockSignals(True)
+        if new_tab or not self.tabs:
+            self.tabs.append(tab)
+            self.tab_bar.addTab(Path(filename).name)
+            index = len(self.tabs) - 1
+        else:
+            # Previous workspace is kept by the prefetcher if it's a neighbour of the new one
+            index = self.tab_bar.currentIndex()
+            self.close_workspace(self.tabs[index])
+            self.tabs[index] = tab
+            self.tab = None
+            self.tab_bar.setTabText(index, Path(filename).name)
+        self.tab_bar.setTabToolTip(index, filename)
+        self.tab_bar.setCurrentIndex(index)
+        self.tab_bar.blockSignals(False)
+        self.set_current_tab(tab)
+
+        # Move frame slider to beginning
+        self.frame_slider.setValue(1)
+
+        with perf.hot.timed('load_workspace.init_roi_list'):
+            self.init_roi_list(new="CorrectedNames" not in self.rois.dtype.names)
+        self.analyzer.submit(self.workspace)
+
+        # Initialize images display
+        self.on_slice_change(self.slice_dropdown.currentText())
+
+
+    def set_current_tab(self, tab):
+        '''
+        Show a workspace tab: its data, ROI panel and slices (view state of the previous tab is kept in it)
+        :param tab: WorkspaceTab
+        '''
+        if self.tab is not None and self.tab in self.tabs:
+            self.tab.slice_index = self.slice_dropdown.currentIndex()
+            self.tab.frame = self.frame_slider.value()
+            self.tab.roi_row = self.selected_roi()
+        self.play_button.setChecked(False)
+        self.render_prefiller.cancel()
+
+        self.tab = tab
+        self.filename = tab.filename
+        self.workspace = tab.workspace
+        self.journal = tab.journal
+        self.metadata = self.workspace.metadata
+        self.rois = self.workspace.rois
+        self.imgs = self.workspace.imgs
+        self.dns = self.workspace.dns
+
         self.input_folder = Path(self.filename).parent # Retain parent folder to save time when prompting file selection again
         # Default output folder set to parent of selected workspace file
         if not self.user_set_output:
             self.output_folder = self.input_folder
-        
-        # Initialize main UI
-        self.init_UI()
-
-        # Load data from DENSEanalysis workspace
-        self.data = loadmat(self.filename, squeeze_me=True)
-        self.metadata = self.data['seq']['ProtocolName']
-        self.rois = self.data['roi']
-        self.imgs = self.data['img']
-        self.dns = self.data['dns']
-    
-        # If only 1 ROI entry in the data, need to force array structure
-        # (Otherwise 0-d array loaded)
-        if self.rois.size == 1:
-            self.rois = self.rois.reshape(1,)
-        # Same if only 1 slice entry:
-        if self.dns.size == 1:
-            self.dns = self.dns.reshape(1,)
-        
+        self.prefetcher.update(self.neighbour_workspaces())
+
+        # ROI panel of the workspace (selection model is replaced along with the model)
+        selection_model = self.roi_list.selectionModel()
+        self.roi_model = tab.roi_model
+        self.roi_list.setModel(self.roi_model)
+        self.roi_list.setItemDelegate(tab.roi_delegate)
+        if selection_model is not None:
+            selection_model.deleteLater()
+
         # Populate drop-down menu with slice names
-        self.slice_dropdown.clear()
-        for i in range(len(self.dns)):
-            img_indices = [self.dns[i]['MagIndex'][0]] + self.dns[i]['PhaIndex'][~np.isnan(self.dns[i]['PhaIndex'])].tolist()
-            img_indices = np.array(img_indices).astype(int).tolist()
-            text = self.metadata[img_indices[0]-1] + ' -'
-            for idx in img_indices:
-                text += ' [{}]'.format(idx)
-            self.slice_dropdown.addItem(text)
-
-        # self.slice_dropdown.clear()
-        # self.slice_dropdown.addItems([text + ' - [{}] [{}] [{}]'.format(3*i+1, 3*i+2, 3*i+3) for i, text in enumerate(self.metadata[::3])])
+        with perf.hot.timed('load_workspace.slice_dropdown'):
+            self.slice_dropdown.clear()
+            for img_indices in self.workspace.slice_indices():
+                self.slice_dropdown.addItem(slice_label(self.metadata, img_indices))
 
-        # Move frame slider to beginning
-        self.frame_slider.setValue(1)
 
-        self.init_roi_list(new="CorrectedNames" not in self.rois.dtype.names)
+    def on_tab_change(self, index):
+        ''' Workspace tab selected event
+        Show the workspace of the tab on the slice, frame and ROI it was left on. Frames rendered
+        before are still in the render cache, and images in memory unless evicted since.
+        '''
+        if not 0 <= index < len(self.tabs):
+            return
+        with perf.hot.timed('switch_tab'):
+            tab = self.tabs[index]
+            self.set_current_tab(tab)
+            self.slice_dropdown.setCurrentIndex(tab.slice_index)
+            # Slider range is set by on_slice_change(), frame is restored without drawing it first
+            self.frame_slider.blockSignals(True)
+            self.frame_slider.setMaximum(max(self.frame_slider.maximum(), tab.frame))
+            self.frame_slider.setValue(tab.frame)
+            self.frame_slider.blockSignals(False)
+            self.frame_input.setValue(tab.frame)
+            if tab.roi_row is not None:
+                self.roi_list.setCurrentIndex(self.roi_model.index(tab.roi_row))
+            self.on_slice_change(self.slice_dropdown.currentText())
+
+
+    def step_tab(self, step):
+        ''' 'Next/Previous tab' menu actions '''
+        if len(self.tabs) > 1:
+            self.tab_bar.setCurrentIndex((self.tab_bar.currentIndex() + step) % len(self.tabs))
+
+
+    def close_tab(self, index):
+        ''' Tab close button and 'Close workspace' menu action
+        The last workspace can't be closed (open another one instead). Unsaved corrections
+        are kept in the workspace journal (see closeEvent()).
+        '''
+        if len(self.tabs) < 2:
+            self.statusBar().showMessage('Cannot close the only opened workspace')
+            return
+        tab = self.tabs.pop(index)
+        self.tab_bar.blockSignals(True)
+        self.tab_bar.removeTab(index)
+        self.tab_bar.blockSignals(False)
+        if tab is self.tab:
+            self.tab = None
+            self.on_tab_change(self.tab_bar.currentIndex())
+        else:
+            self.prefetcher.update(self.neighbour_workspaces())
+        self.close_workspace(tab)
 
-        # Initialize images display
-        self.on_slice_change(self.slice_dropdown.currentText())
+
+    def close_workspace(self, tab):
+        '''
+        Release a workspace whose tab is closed (or replaced)
+        :param tab: WorkspaceTab, not in self.tabs anymore
+        '''
+        self.analyzer.cancel(tab.workspace)
+        self.render_cache.discard(lambda key: key[0] == tab.filename)
+        tab.journal.close()
+        tab.roi_delegate.deleteLater()
+        tab.roi_model.deleteLater()
+        # Kept by the prefetcher if it's a neighbour of the current workspace
+        self.prefetcher.give(tab.workspace)
+
+
+    def find_tab(self, filename):
+        ''' Tab of an opened workspace, or None '''
+        for tab in self.tabs:
+            if tab.filename == filename:
+                return tab
+        return None
+
+    
+    def folder_workspaces(self):
+        ''' Workspace files of the current input folder, sorted by name '''
+        suffix = Path(self.filename).suffix
+        return sorted(str(path) for path in Path(self.input_folder).glob('*' + suffix) if path.is_file())
+
+
+    def neighbour_workspaces(self):
+        ''' Workspaces to prefetch: next ones in the folder (prefetch depth), then the previous one,
+        except those already opened in tabs
+        '''
+        files = self.folder_workspaces()
+        try:
+            current = files.index(str(Path(self.filename)))
+        except ValueError:
+            return []
+        opened = [tab.filename for tab in self.tabs]
+        return [filename for filename in files[current+1:current+1+self.prefetch_depth] + files[max(current-1, 0):current]
+                if filename not in opened]
+
+
+    def open_neighbour(self, step):
+        ''' 'Next/Previous workspace' menu actions
+        :param step: +1 for next workspace of the folder, -1 for previous one
+        '''
+        if not hasattr(self, 'filename'):
+            return
+        files = self.folder_workspaces()
+        try:
+            current = files.index(str(Path(self.filename)))
+        except ValueError:
+            return
+        if 0 <= current + step < len(files):
+            self.load_workspace(files[current + step], new_tab=False)
+        else:
+            self.statusBar().showMessage('No {} workspace in {}'.format('next' if step > 0 else 'previous', self.input_folder))
 
     
     def init_roi_list(self, new):
+        ''' Fill ROI panel with the ROIs of the workspace and their corrections
+        :param new: workspace has no saved corrections yet
+        '''
         if new:
-            roi_names = ['{}\t{}'.format(name, idx) for name, idx in zip(self.rois["Name"],self.rois["SeqIndex"])]
-            self.new_assoc = [[] for _ in range(len(roi_names))]
-            self.new_names = ['' for _ in range(len(roi_names))]
+            names, assoc = ['' for _ in range(len(self.rois))], [[] for _ in range(len(self.rois))]
         else:
-            self.new_assoc = [i.tolist() if len(i)>0 else [] for i in self.rois["CorrectedSeqIndex"]]
-            self.new_names = [i if len(i)>0 else '' for i in self.rois["CorrectedNames"]]
-            roi_names = ['{}\t{}'.format(name, idx) for name, idx in zip(self.rois["Name"],self.rois["SeqIndex"])]
-
-        self.roi_list.clear()
-        self.roi_list.addItems(roi_names)
-        # Disable non-standard short or long axis ROIs
-        for i in range(len(self.rois)):
-            if not (self.rois[i]['Type'] in ["SA", "LA"]):
-                self.roi_list.item(i).setFlags(Qt.NoItemFlags)
-                self.roi_list.item(i).setForeground(Qt.gray)
-
-        if not new:
-            # Change text value
-            for i, roi_item in enumerate(roi_names):
-
-                roi_item = self.roi_list.item(i).text()
-                roi_item_slice_removed = '\t'.join(roi_item.split('\t')[:2]) # Remove previous corrected slice indices if need be
-                roi_item_with_slice = roi_item_slice_removed + '\t' + str(list(np.array(self.new_assoc[i])))
-                roi_item_with_slice_cat = self.new_names[i] + ' - ' + roi_item_with_slice.split(' - ')[-1]
-                self.roi_list.item(i).setText(roi_item_with_slice_cat)
-        
+            names, assoc = roi_corrections(self.rois)
+
+        # Corrections not saved yet (e.g. before a crash) are replayed from the journal
+        records = self.journal.records()
+        if records:
+            try:
+                names, assoc = replay(self.workspace, records)
+                self.edited_files.add(self.filename)
+                self.statusBar().showMessage('Restored {} unsaved correction(s) from {}'.format(len(records), self.journal.filename))
+            except ValueError as err:
+                QMessageBox.warning(self, 'Warning', 'Cannot restore unsaved corrections from {}:\n{}'.format(self.journal.filename, err))
+
+        self.roi_model.set_rois(self.rois, names, assoc)
+
+
+    @property
+    def new_names(self):
+        ''' User-set corrected name of each ROI ('' if not set) '''
+        return self.roi_model.names
 
-    def update_images(self):
+
+    @property
+    def new_assoc(self):
+        ''' User-set corrected image indices (1-based) of each ROI ([] if not set) '''
+        return self.roi_model.assoc
+
+
+    def selected_roi(self):
+        ''' Index of the selected ROI, or None '''
+        indexes = self.roi_list.selectionModel().selectedIndexes()
+        return indexes[0].row() if indexes else None
+
+
+    def frame_key(self, frame):
+        ''' Render cache key of a frame of the current slice, with the current ROI (zoomed on or not) '''
+        roi_index = self.selected_roi()
+        zoom = roi_index is not None and self.zoom_act.isChecked()
+        return (self.filename, tuple(self.current_images_idx), frame, roi_index, zoom)
+
+
+    def frame_builder(self):
+        ''' Render cache builder for frame_key() keys, bound to the current workspace data
+        (can be used from another thread while another tab is being shown)
+        One per tab, kept while the tab is open: switching back to a tab reuses the display cubes
+        still referenced by its cached frames, and the ROI contours it computed.
+        '''
+        return self.tab.frame_builder
+
+
+    def update_images(self, full=False):
         '''
         Update images panel with given slice, frame and ROI (if selected)
+        :param full: redraw the whole figure (slice or ROI change),
+            otherwise only images and contours are updated
         '''
-
         # Handle exception when displaying the data
-        # (might happen when number of frames for ROI and slice differ)
         # (might happen when loading new workspace)
         try:
-            # Update MRI images
-            utils.clear_figures(self.axis)
-            for i in range(4):
-                try:
-                    img = self.imgs[self.current_images_idx[i]][:,:,self.frame_slider.value()-1]
-                    utils.imshow(self.axis[i], img)
-
-                    if self.roi_list.selectedItems():
-                        roi_data = self.rois[self.roi_list.currentRow()]
-                        if i == 0:
-                            contours = utils.anchor_to_contour(roi_data['Type'], *roi_data['Position'][self.frame_slider.value()-1])
-                        try:
-                            utils.roishow(self.axis[i], *contours, roi_data['Type'])
-                        except UnboundLocalError: # Might happen if contours isn't created in time
-                            pass
-                # If z-axis img doesn't exists, display black img
-                except IndexError:
-                    img = np.zeros(img.shape)
-                    utils.imshow(self.axis[i], img)
-
-            self.canvas.draw()
-
-        except (IndexError, AttributeError):
+            if self.montage_act.isChecked():
+                with perf.hot.timed('update_images.montage'):
+                    self.update_montage()
+                return
+            with perf.hot.timed('update_images'):
+                key = self.frame_key(self.frame_slider.value()-1)
+                data = self.render_cache.get(key)
+                if data is None:
+                    with perf.hot.timed('update_images.build_frame'):
+                        data, nbytes = self.frame_builder()(key)
+                    self.render_cache.put(key, data, nbytes)
+                with perf.hot.timed('update_images.draw_full' if full else 'update_images.draw'):
+                    self.renderer.draw_frame(data, full=full)
+
+        except (IndexError, AttributeError, StopIteration, ValueError):
             pass
 
 
+    def prefill_render_cache(self):
+        '''
+        Pre-render the whole cine of the current slice/ROI in the background,
+        starting from the current frame
+        '''
+        nbr_frames = self.frame_slider.maximum()
+        current = self.frame_slider.value()-1
+        keys = [self.frame_key((current + i) % nbr_frames) for i in range(nbr_frames)]
+        self.render_prefiller.submit(keys, self.frame_builder())
+
+
     def on_frame_slider_change(self):
         ''' Frame slider moved event
         Update image display with given frame
@@ -417,38 +1006,221 @@ class DenseVisualizer(QMainWindow):
         self.update_images()
 
 
+    def on_play_toggle(self, playing):
+        ''' Play/pause button event
+        Loop over the cardiac cycle at the selected frame rate
+        '''
+        if playing:
+            self.play_button.setText('Pause')
+            self.restart_playback_clock()
+            self.playback_timer.start(int(1000 / self.fps_input.value()))
+        else:
+            self.play_button.setText('Play')
+            self.playback_timer.stop()
+            self.statusBar().clearMessage()
+
+
+    def on_fps_change(self, fps):
+        ''' Playback frame rate input event '''
+        if self.playback_timer.isActive():
+            self.restart_playback_clock()
+            self.playback_timer.setInterval(int(1000 / fps))
+
+
+    def restart_playback_clock(self):
+        ''' Playback frames are timed from the current frame and time '''
+        self.playback_start = (time.perf_counter(), self.frame_slider.value()-1)
+        self.playback_stats = (time.perf_counter(), 0)
+
+
+    def on_playback_tick(self):
+        ''' Playback timer event
+        Displayed frame is given by the time elapsed since playback start, so that frames
+        are skipped (rather than redraws queued) when rendering can't keep up with the frame rate
+        '''
+        now = time.perf_counter()
+        fps = self.fps_input.value()
+        start_time, start_frame = self.playback_start
+        frame = (start_frame + int((now - start_time) * fps)) % self.frame_slider.maximum()
+
+        stats_time, drawn = self.playback_stats
+        if frame != self.frame_slider.value()-1:
+            # Same data path as manual frame selection
+            self.frame_slider.setValue(frame+1)
+            drawn += 1
+        self.playback_stats = (stats_time, drawn)
+
+        # Report achieved frame rate every second
+        if now - stats_time >= 1:
+            self.statusBar().showMessage('Playback: {:.1f} / {} fps'.format(drawn / (now - stats_time), fps))
+            self.playback_stats = (now, 0)
+
+
+    def on_montage_toggle(self, checked):
+        ''' 'Montage overview' menu action
+        Switch images panel between the current slice and the montage of all slices
+        '''
+        if not hasattr(self, 'images_stack'):
+            return
+        self.images_stack.setCurrentIndex(1 if checked else 0)
+        if not checked:
+            # Display cubes of all slices are only kept while the montage is shown
+            self.montage = None
+            self.montage_cubes = []
+        self.update_images(full=True)
+
+
+    def on_zoom_toggle(self, checked):
+        ''' 'Zoom on ROI' menu action
+        Show the region of the images around the selected ROI contours (whole images if no ROI is selected)
+        '''
+        if not hasattr(self, 'images_stack'):
+            return
+        self.update_images(full=True)
+        self.prefill_render_cache()
+
+
+    def update_montage(self):
+        '''
+        Update montage overview: current frame of every slice (downsampled magnitude),
+        with the contours of the selected ROI on its associated slice(s)
+        '''
+        builder = self.frame_builder()
+        slices = self.workspace.slice_indices()
+        frame = self.frame_slider.value()-1
+
+        if self.montage is None or self.montage_workspace is not self.workspace:
+            # All magnitude sequences are needed (decoded once, kept by the workspace)
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                self.montage_cubes = [builder.display_cube(img_indices[0]-1, downsampled=True) for img_indices in slices]
+            finally:
+                QApplication.restoreOverrideCursor()
+            self.montage = Montage([self.imgs.shape(img_indices[0]-1)[:2] for img_indices in slices])
+            self.montage_workspace = self.workspace
+            self.montage_axis.cla()
+            self.montage_axis.axis('off')
+            self.montage_image = self.montage_axis.imshow(np.zeros(self.montage.shape, dtype=np.uint8), cmap='gray',
+                                                          vmin=0, vmax=255, interpolation='nearest')
+            self.montage_lines = self.montage_axis.plot([], [], c='red', linewidth=1)[0]
+
+        # Slices with fewer frames stay on their last frame
+        frames = []
+        for cube in self.montage_cubes:
+            frames.append(cube.frame(min(frame, len(cube)-1), level=1))
+        self.montage_image.set_data(self.montage.render(frames))
+
+        # Selected ROI contours, on slices matching its (corrected, if set) image indices
+        x, y = [], []
+        roi_index = self.selected_roi()
+        if roi_index is not None:
+            roi = self.rois[roi_index]
+            assoc = self.new_assoc[roi_index] or [int(i) for i in np.atleast_1d(roi['SeqIndex']) if not np.isnan(i)]
+            contours = builder.contours(roi_index)
+            if frame < len(contours):
+                for index, img_indices in enumerate(slices):
+                    if img_indices[0] not in assoc:
+                        continue
+                    for line_x, line_y in utils.contour_lines(*contours[frame], roi['Type']):
+                        line_x, line_y = self.montage.to_montage(index, line_x, line_y)
+                        # Lines separated by NaNs, to draw all of them with one artist
+                        x += [line_x, [np.nan]]
+                        y += [line_y, [np.nan]]
+        self.montage_lines.set_data(np.concatenate(x) if x else [], np.concatenate(y) if y else [])
+        self.montage_canvas.draw_idle()
+
+
+    def on_montage_click(self, event):
+        ''' Montage click event: open clicked slice in the images panel '''
+        index = None if self.montage is None or event.inaxes is None else self.montage.tile_at(event.xdata, event.ydata)
+        if index is None:
+            return
+        self.slice_dropdown.setCurrentIndex(index)
+        self.montage_act.setChecked(False)
+        self.on_slice_change(self.slice_dropdown.currentText())
+
+
+    def on_montage_hover(self, event):
+        ''' Montage mouse move event: show slice under the cursor in the status bar '''
+        index = None if self.montage is None or event.inaxes is None else self.montage.tile_at(event.xdata, event.ydata)
+        if index is not None:
+            self.statusBar().showMessage(self.slice_dropdown.itemText(index))
+
+
     def on_slice_change(self,text):
         ''' Slice selection event
         Update image display with given slice (stay on same frame)
         '''
-        # Update slice indices
-        self.current_images_idx = ([int(i)-1 for i in re.findall("\[(.*?)\]", text)])
-    
-        # Update maximum number of frame as it can change from one slice to another
-        nbr_frames = self.imgs[self.current_images_idx[0]].shape[2]
-        self.frame_slider.setMaximum(nbr_frames)
-        self.frame_label.setText('/ {}'.format(nbr_frames))
-        
-        self.update_images()
+        with perf.hot.timed('on_slice_change', memory=True):
+            # Update slice indices
+            self.current_images_idx = ([int(i)-1 for i in re.findall("\[(.*?)\]", text)])
 
+            # Update maximum number of frame as it can change from one slice to another
+            # (read from sequence header, images are loaded by update_images())
+            nbr_frames = self.imgs.shape(self.current_images_idx[0])[2]
+            self.frame_slider.setMaximum(nbr_frames)
+            self.frame_label.setText('/ {}'.format(nbr_frames))
 
-    def on_item_click(self, item):
+            self.update_images(full=True)
+            self.prefill_render_cache()
+
+
+    def on_item_click(self, index=None):
         ''' ROI panel item selected event
-        Update image display with given ROI
+        Update image display with given ROI (the current slice and category are kept,
+        its suggested slice, if any, is only shown in the ROI panel and the status bar)
         '''
-        self.update_images()
+        suggestion = self.roi_model.suggestion(self.selected_roi())
+        if suggestion is not None:
+            self.statusBar().showMessage('Suggested slice: {} {} (score {:.2f}), Enter to accept'.format(
+                suggestion['name'], suggestion['seq_index'], suggestion['score']))
+        self.update_images(full=True)
+        self.prefill_render_cache()
 
 
-    def on_item_double_click(self, item):
+    def show_slice(self, index, slice_cat):
+        '''
+        Display a slice and select its slice category
+        :param index: slice index (in the slice dropdown)
+        :param slice_cat: slice category, '' to keep the selected one
+        '''
+        for button in self.apply_radio_group.buttons():
+            if button.text() == slice_cat:
+                button.setChecked(True)
+        self.slice_dropdown.setCurrentIndex(index)
+        self.on_slice_change(self.slice_dropdown.currentText())
+
+
+    def on_analysis_done(self, filename, name, result):
+        ''' Workspace analysis done event (see analysis.AnalysisWorker)
+        Show QC flags or suggested slices of the ROIs in the ROI panel of the workspace tab
+        '''
+        tab = self.find_tab(filename)
+        if tab is None:
+            return
+        # Only reported for the current workspace
+        show_message = self.statusBar().showMessage if tab is self.tab else (lambda message: None)
+        if name == 'qc':
+            tab.roi_model.set_qc(result)
+            nbr_flagged = sum(bool(tab.roi_model.qc_flags(row)) for row in range(len(result)))
+            if nbr_flagged:
+                show_message('{} ROI(s) flagged by contour QC (see ROI tooltips)'.format(nbr_flagged))
+        elif name == 'suggestions':
+            tab.roi_model.set_suggestions(result)
+            nbr_suggestions = sum(tab.roi_model.suggestion(row) is not None for row in range(len(result)))
+            if nbr_suggestions:
+                show_message('{} ROI(s) with a suggested slice (Enter to accept)'.format(nbr_suggestions))
+
+
+    def on_item_double_click(self, index):
         '''
         NOT USED
         Possibility to let the user change the ROI name by double-clicking on list item
         '''
-        basename = item.text().split('\t')[0]
+        basename = self.roi_model.records[index.row()].name
         text, ok = QInputDialog.getText(self, 'Edit', 'Edit ROI name:', QLineEdit.Normal, basename)
         if text and ok:
-            updated_text = '\t'.join([text] + item.text().split('\t')[1:])
-            item.setText(updated_text)
+            self.roi_model.set_name(index.row(), text)
 
     
     def on_clear_click(self):
@@ -456,16 +1228,18 @@ class DenseVisualizer(QMainWindow):
         Clear ROI selection and remove it from image display 
         '''
         self.roi_list.clearSelection()
-        self.update_images()
+        self.update_images(full=True)
+        self.prefill_render_cache()
 
 
     def on_apply_click(self):
         ''' Apply button event
-        Associates current slice with current ROI, 
-        by adding slice indices to list item text with a different color
+        Associates current slice with current ROI 
+        (slice indices are shown in the list item with a different color)
         '''
         # Only take action if there is a selected ROI
-        if self.roi_list.selectedItems():
+        row = self.selected_roi()
+        if row is not None:
 
             # Check if slice category is selected, otherwise display warning and do nothing
             try:
@@ -474,49 +1248,89 @@ class DenseVisualizer(QMainWindow):
                 QMessageBox.warning(self, 'Warning', 'Cannot apply corrections. Please select a slice category and retry.')
                 return
             
-            # Change text value
-            roi_item = self.roi_list.currentItem().text()
-            roi_item_slice_removed = '\t'.join(roi_item.split('\t')[:2]) # Remove previous corrected slice indices if need be
-            roi_item_with_slice = roi_item_slice_removed + '\t' + str(list(np.array(self.current_images_idx)+1))
-            roi_item_with_slice_cat = slice_cat + ' - ' + roi_item_with_slice.split(' - ')[-1]
-            self.roi_list.currentItem().setText(roi_item_with_slice_cat)
+            # Update corrected ROI name and association lists (and list item)
+            self.roi_model.set_correction(row, slice_cat, (np.array(self.current_images_idx)+1).tolist())
 
-            # Update association list
-            self.new_assoc[self.roi_list.currentRow()] = (np.array(self.current_images_idx)+1).tolist()
-
-            # Update corrected ROI name list
-            self.new_names[self.roi_list.currentRow()] = slice_cat
+            self.record_edit('apply', row, slice_cat, self.new_assoc[row])
 
     
+    def on_accept_click(self):
+        ''' Accept suggestion button event
+        Associates the suggested slice with current ROI (as Apply would), displays it,
+        then selects the next ROI with a suggestion
+        '''
+        row = self.selected_roi()
+        suggestion = self.roi_model.suggestion(row)
+        if suggestion is None:
+            self.statusBar().showMessage('No suggested slice for the selected ROI')
+            return
+
+        # Slice category can't always be guessed from protocol names
+        slice_cat = suggestion['name']
+        if not slice_cat:
+            try:
+                slice_cat = self.apply_radio_group.checkedButton().text()
+            except AttributeError:
+                QMessageBox.warning(self, 'Warning', 'Cannot apply corrections. Please select a slice category and retry.')
+                return
+
+        self.roi_model.set_correction(row, slice_cat, suggestion['seq_index'])
+        self.record_edit('apply', row, slice_cat, self.new_assoc[row])
+        # Accepted slice displayed, as after Apply
+        self.show_slice(suggestion['slice'], slice_cat)
+
+        # Next ROI to review (after the current one, wrapping around)
+        nbr_rois = self.roi_model.rowCount()
+        for step in range(1, nbr_rois):
+            next_row = (row + step) % nbr_rois
+            if self.roi_model.suggestion(next_row) is not None:
+                self.roi_list.setCurrentIndex(self.roi_model.index(next_row))
+                self.on_item_click(self.roi_model.index(next_row))
+                return
+        self.statusBar().showMessage('All suggestions reviewed')
+
+
     def on_delete_click(self):
         ''' Delete button event
         Remove user-set association between current ROI and slice
         '''
         # Check if a ROI item is selected
-        if self.roi_list.selectedItems():
-            self.delete_user_association(self.roi_list.currentRow())
+        row = self.selected_roi()
+        if row is not None:
+            self.delete_user_association(row)
+            self.record_edit('delete', row)
     
 
     def on_delete_all_click(self):
         ''' Delete all button event
         Remove user-set association for all ROIs
         '''
-        for i in range(self.roi_list.count()):
-            self.delete_user_association(i)
+        self.roi_model.clear_corrections()
+        self.record_edit('delete_all')
 
 
     def delete_user_association(self, index):
         '''
         Delete user-set assocation of a given list item
-        by changing UI text and removing the entry in self.new_assoc
-        :param index: index of corresponding item in self.roi_list
+        :param index: row of corresponding item in self.roi_model
+        '''
+        self.roi_model.set_correction(index, '', [])
+
+
+    def record_edit(self, op, *args):
         '''
-        roi_item = self.roi_list.item(index).text()
-        roi_item_slice_removed = '\t'.join(roi_item.split('\t')[:2])
-        roi_item_slice_removed = roi_item_slice_removed.split(' - ')[-1]
-        self.roi_list.item(index).setText(roi_item_slice_removed)
-        self.new_assoc[index] = []
-        self.new_names[index] = ''
+        Append a correction to the journal of the workspace (kept on disk until saved)
+        :param op: journal operation ('apply', 'delete' or 'delete_all'), see journal.Journal
+        :param args: arguments of the operation (e.g. ROI index, slice category and image indices of 'apply')
+        '''
+        if op not in JOURNAL_OPS:
+            raise ValueError("Unknown journal operation '{}', should be one of {}.".format(op, JOURNAL_OPS))
+        try:
+            getattr(self.journal, op)(*args)
+        except OSError as err:
+            self.statusBar().showMessage('Cannot write correction journal {}: {}'.format(self.journal.filename, err))
+            return
+        self.edited_files.add(self.filename)
 
 
     def on_save_click(self):
@@ -524,21 +1338,55 @@ class DenseVisualizer(QMainWindow):
         Export data into similar format than input,
         adding an extra column to the 'roi' entry to save 
         user-set associations between ROIs and slices.
+        The workspace is written in the background (see saver.py), with the corrections as they are now.
         '''
-        if not self.user_set_output:
-            self.user_set_output = True
-            alert_msg = 'You did not specify any output folder. By default, the input file will be overwritten. \
+        if not self.confirm_overwrite():
+            return
+
+        output_file = self.output_file(self.filename)
+        # Corrections are copied now, the save backend being called from the save thread
+        # (which waits for the backend if it is still starting)
+        job = SaveJob(self.filename, output_file, self.new_names, self.new_assoc, self.workspace, self.journal.records())
+        if self.saver.submit(job):
+            self.statusBar().showMessage('Saving {} (replacing the save already queued)...'.format(job.name))
+
+
+    def confirm_overwrite(self):
+        ''' Warn once that input files are overwritten, unless an output folder was selected
+        :returns: True to proceed with the saving
+        '''
+        if self.user_set_output or self.overwrite_confirmed:
+            return True
+        self.overwrite_confirmed = True
+        alert_msg = 'You did not specify any output folder. By default, the input file will be overwritten. \
 If this is not the intended behaviour, please select the output folder in the Utilities menu. \
 Do you wish to proceed with the saving? (This message will appear only once.)'
-            alert_reply = QMessageBox.warning(self, 'Warning', alert_msg, QMessageBox.StandardButton.Yes |
-                    QMessageBox.StandardButton.No)
+        alert_reply = QMessageBox.warning(self, 'Warning', alert_msg, QMessageBox.StandardButton.Yes |
+                QMessageBox.StandardButton.No)
+        return alert_reply != QMessageBox.StandardButton.No
+
+
+    def output_file(self, filename):
+        ''' Output path of a workspace: in the selected output folder, or its own folder by default '''
+        folder = self.output_folder if self.user_set_output else Path(filename).parent
+        return os.path.join(folder, Path(filename).name)
 
-            if alert_reply == QMessageBox.StandardButton.No:
-                return
 
-        # Output path from given output folder and input filename
-        output_file = os.path.join(self.output_folder, Path(self.filename).name)
-        self.eng.update_workspace_corrected(self.new_names, self.new_assoc, self.filename, output_file, nargout=0)
+    def on_save_done(self, job):
+        '''
+        Background save finished (see saver.py)
+        :param job: saver.SaveJob, with error set if it failed
+        '''
+        if job.error is not None:
+            QMessageBox.critical(self, 'Error', 'Cannot save {}:\n{}'.format(job.output_file, job.error))
+            return
+        # Journaled corrections are in the saved workspace now (unless edited since the save was requested)
+        tab = self.find_tab(job.filename)
+        journal = tab.journal if tab is not None else Journal(job.filename)
+        journal.remove(job.journal_records)
+        # Keep catalog up to date with the new correction status
+        if self.catalog is not None:
+            self.catalog.refresh(job.output_file)
 
 
     def center(self):
@@ -552,17 +1400,139 @@ Do you wish to proceed with the saving? (This message will appear only once.)'
         '''Function overwrite
         Alert window to ask for confirmation when quitting the app.
         '''
-        # Alert window, default on YES
-        reply = QMessageBox.question(self, 'Message',
-                    "Are you sure you want to quit?", QMessageBox.StandardButton.Yes |
-                    QMessageBox.StandardButton.No, QMessageBox.StandardButton.Yes)
-
-        # Accept or ignore quit event depending on alert confirmation
-        if reply == QMessageBox.StandardButton.Yes:
-            self.eng.quit()
-            event.accept()
+        # Saves still running in the background
+        if self.saver.pending():
+            reply = QMessageBox.question(self, 'Message',
+                        '{} workspace save(s) still in progress. Wait for them to finish and quit?'.format(self.saver.pending()),
+                        QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.Cancel, QMessageBox.StandardButton.Yes)
+            if reply != QMessageBox.StandardButton.Yes:
+                event.ignore()
+                return
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            while not self.saver.wait(timeout=0.05):
+                QApplication.processEvents()
+            QApplication.restoreOverrideCursor()
+            # Let finished saves update journals and catalog
+            QApplication.processEvents()
+
+        # Workspaces with corrections not saved yet: offer to save them all at once
+        pending = sorted(filename for filename in self.edited_files if os.path.exists(journal_path(filename)))
+        if pending:
+            reply = QMessageBox.question(self, 'Message',
+                        '{} workspace(s) have unsaved corrections. Save them into {} before quitting?\n'
+                        '(Otherwise they are kept in journal files, and restored when reopening the workspaces.)'.format(
+                            len(pending), self.output_folder if self.user_set_output else 'their own folders'),
+                        QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard |
+                        QMessageBox.StandardButton.Cancel, QMessageBox.StandardButton.Save)
+            if reply == QMessageBox.StandardButton.Cancel:
+                event.ignore()
+                return
+            if reply == QMessageBox.StandardButton.Save and not self.compact_journals(pending):
+                event.ignore()
+                return
         else:
-            event.ignore()
+            # Alert window, default on YES
+            reply = QMessageBox.question(self, 'Message',
+                        "Are you sure you want to quit?", QMessageBox.StandardButton.Yes |
+                        QMessageBox.StandardButton.No, QMessageBox.StandardButton.Yes)
+            # Ignore quit event depending on alert confirmation
+            if reply != QMessageBox.StandardButton.Yes:
+                event.ignore()
+                return
+
+        for tab in self.tabs:
+            tab.journal.close()
+        self.eng.quit()
+        event.accept()
+
+
+    def compact_journals(self, filenames):
+        '''
+        Save journaled corrections of several workspaces (see output_file()), with the
+        save backend started once for all of them (see journal.compact())
+        :param filenames: workspace paths
+        :returns: True if all of them were saved
+        '''
+        if not self.confirm_overwrite():
+            return False
+        try:
+            backend = self.eng.get()
+        except RuntimeError as err:
+            QMessageBox.critical(self, 'Error', str(err))
+            return False
+        tasks = [(filename, self.output_file(filename)) for filename in filenames]
+        progress_dialog = QProgressDialog('Saving corrections...', None, 0, len(tasks), self)
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+
+        def progress(done, total, result):
+            progress_dialog.setValue(done)
+            QApplication.processEvents()
+
+        # Opened workspace files are released while being written (see on_save_click())
+        with contextlib.ExitStack() as stack:
+            for tab in self.tabs:
+                tab.journal.close()
+                stack.enter_context(tab.workspace.released())
+            results = compact(tasks, backend, progress)
+        progress_dialog.close()
+        if self.catalog is not None:
+            for result in results:
+                if result['status'] == 'saved':
+                    self.catalog.refresh(result['output'])
+        errors = ['{}: {}'.format(result['file'], result['message']) for result in results if result['status'] == 'error']
+        if errors:
+            QMessageBox.critical(self, 'Error', 'Cannot save corrections of:\n{}'.format('\n'.join(errors)))
+        return not errors
+
+
+    def show_perf_panel(self):
+        ''' 'Performance panel' menu action (non-modal, kept open while using the app) '''
+        if getattr(self, 'perf_panel', None) is None:
+            self.perf_panel = PerfPanel(self, perf.hot)
+        self.perf_panel.show()
+        self.perf_panel.raise_()
+
+
+    def set_render_cache_size(self):
+        ''' 'Set render cache size' menu action
+        Memory budget (MB) of the frame render cache, least recently used frames are evicted first
+        '''
+        size, ok = QInputDialog.getInt(self, 'Render cache', 'Render cache size (MB):',
+                                       self.render_cache.max_bytes // 2**20, 16, 65536)
+        if ok:
+            self.render_cache.set_max_bytes(size * 2**20)
+
+
+    def set_sequence_budget(self):
+        ''' 'Set image memory budget' menu action
+        Memory budget (MB) of the decoded images of all opened workspaces, least recently used
+        sequences are evicted first (and read again from their file when needed)
+        '''
+        size, ok = QInputDialog.getInt(self, 'Image memory budget', 'Memory budget of opened workspace images (MB):',
+                                       self.sequence_budget.max_bytes // 2**20, 64, 262144)
+        if ok:
+            self.sequence_budget.set_max_bytes(size * 2**20)
+            # Prefetching resumes if it had stopped on a full budget
+            self.prefetcher.set_max_bytes(self.prefetcher.max_bytes)
+
+
+    def set_prefetching(self):
+        ''' 'Set workspace prefetching' menu action
+        Number of next workspaces loaded in advance, and memory cap (MB) of their decoded sequences
+        '''
+        depth, ok = QInputDialog.getInt(self, 'Workspace prefetching', 'Number of next workspaces to prefetch (0 to disable):',
+                                        self.prefetch_depth, 0, 16)
+        if not ok:
+            return
+        size, ok = QInputDialog.getInt(self, 'Workspace prefetching', 'Memory cap of prefetched images (MB):',
+                                       self.prefetcher.max_bytes // 2**20, 0, 65536)
+        if not ok:
+            return
+        self.prefetch_depth = depth
+        self.prefetcher.set_max_bytes(size * 2**20)
+        if hasattr(self, 'filename'):
+            self.prefetcher.update(self.neighbour_workspaces())
 
 
     def set_output_folder(self):
@@ -575,8 +1545,34 @@ Do you wish to proceed with the saving? (This message will appear only once.)'
 
 def main():
 
-    app = QApplication(sys.argv)
-    ex = DenseVisualizer()
+    # Command line tools: main.py <command> [arguments] runs <module>.main(arguments)
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        module = importlib.import_module(COMMANDS[sys.argv[1]])
+        sys.exit(module.main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description='DENSE CMR segmentation quality-control app')
+    parser.add_argument('--save-backend', choices=list(backends.BACKENDS), default='native',
+                        help="backend used to save workspaces ('matlab' needs the Matlab engine for Python)")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print import and initialization timings')
+    parser.add_argument('--image-cache', default=os.environ.get(CACHE_DIR_ENV),
+                        help='directory of the on-disk cache of decoded images (default: {} environment variable, '
+                             'no cache if not set)'.format(CACHE_DIR_ENV))
+    # Remaining arguments are passed to Qt
+    args, qt_args = parser.parse_known_args()
+    perf.startup.enabled = args.profile_startup
+    # Session-wide cProfile/tracemalloc capture, if requested (DENSE_PROFILE environment variable)
+    try:
+        perf.start_session_profiler()
+    except ValueError as err:
+        print('Warning: {}'.format(err), file=sys.stderr)
+
+    with perf.startup.timed('QApplication'):
+        app = QApplication(sys.argv[:1] + qt_args)
+    with perf.startup.timed('DenseVisualizer.__init__'):
+        ex = DenseVisualizer(save_backend=args.save_backend, image_cache=args.image_cache)
+    # Report once the event loop is running, i.e. when the window is displayed and responsive
+    QTimer.singleShot(0, lambda: (perf.startup.mark('window ready'), perf.startup.report()))
     sys.exit(app.exec())
 
 
@@ -0,0 +1,106 @@
+'''
+Rasterization of ROI contours into myocardium masks
+Same geometry as utils.roishow(): the ring between epi and endo contours for short-axis
+ROIs, the closed epi + endo contour for long-axis ROIs. All frames of a ROI are rasterized
+in one vectorized call, using scanline even-odd parity (a pixel is inside if a horizontal
+ray from its center crosses the polygon edges an odd number of times).
+'''
+
+import numpy as np
+
+
+def polygon_edges(contours, orientation):
+    ''' Polygon edges of ROI contours, for all frames
+    :param contours: endo and epi contours of each frame (T, 2, 2, n), as from utils.anchor_to_contour()
+                     i.e. [frame][endo/epi][x/y][point] (0-based pixel coordinates)
+    :param orientation: "SA" or "LA"
+    :returns: edge start and end points, as arrays x0, y0, x1, y1 of shape (T, nbr edges)
+    '''
+    contours = np.asarray(contours, dtype=np.float64)
+    endo, epi = contours[:, 0], contours[:, 1]
+    # Closed polygons (first point repeated at the end), as in utils.contour_lines()
+    if orientation == 'SA':
+        # Two polygons, the ring between them being inside by parity
+        polygons = [np.concatenate([epi, epi[:, :, :1]], axis=2), np.concatenate([endo, endo[:, :, :1]], axis=2)]
+    elif orientation == 'LA':
+        polygons = [np.concatenate([epi, endo, epi[:, :, :1]], axis=2)]
+    else:
+        raise ValueError('ROI orientation axis should be either SA or LA.')
+    starts = np.concatenate([polygon[:, :, :-1] for polygon in polygons], axis=2)
+    ends = np.concatenate([polygon[:, :, 1:] for polygon in polygons], axis=2)
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+# Maximum number of samples (frames x rows x columns) filled at once, bounds memory use
+CHUNK_SAMPLES = 2**24
+
+
+def rasterize(edges, shape, supersample=1):
+    ''' Even-odd fill of polygons given by their edges, for a batch of frames
+    :param edges: x0, y0, x1, y1 arrays of shape (T, nbr edges), in output pixel coordinates
+    :param shape: output mask shape (H, W)
+    :param supersample: number of samples per pixel along each axis (1: one sample at the pixel center)
+    :returns: (T, H, W) bool masks if supersample is 1, otherwise float32 pixel coverage in [0, 1]
+    '''
+    x0, y0, x1, y1 = (np.asarray(a, dtype=np.float64) for a in edges)
+    # Frames without contours (NaN, see utils.roi_contours()) have no edges: empty masks
+    missing = ~(np.isfinite(x0) & np.isfinite(y0) & np.isfinite(x1) & np.isfinite(y1))
+    if missing.any():
+        x0, y0, x1, y1 = (np.where(missing, 0, a) for a in (x0, y0, x1, y1))
+    nbr_frames = x0.shape[0]
+    height, width = shape[0] * supersample, shape[1] * supersample
+    masks = np.empty((nbr_frames,) + tuple(shape), dtype=bool if supersample == 1 else np.float32)
+    chunk = max(1, CHUNK_SAMPLES // (height * (width + 1)))
+    for start in range(0, nbr_frames, chunk):
+        frames = slice(start, start + chunk)
+        inside = _fill(x0[frames], y0[frames], x1[frames], y1[frames], height, width, supersample)
+        if supersample == 1:
+            masks[frames] = inside
+        else:
+            coverage = inside.reshape(len(inside), shape[0], supersample, shape[1], supersample).sum(axis=(2, 4), dtype=np.uint16)
+            masks[frames] = coverage * np.float32(1 / supersample**2)
+    return masks
+
+
+def _fill(x0, y0, x1, y1, height, width, supersample):
+    ''' Even-odd fill on the sample grid (see rasterize()) '''
+    nbr_frames, nbr_edges = x0.shape
+    # Sample grid: sub-pixel centers, in output pixel coordinates
+    offset = (0.5 / supersample) - 0.5
+
+    # Scanlines crossed by each edge: samples y with min(y0, y1) <= y < max(y0, y1)
+    # (horizontal edges cross none), only those crossings are computed
+    first_row = np.clip(np.ceil((np.minimum(y0, y1) - offset) * supersample), 0, height).astype(np.int64).ravel()
+    last_row = np.clip(np.ceil((np.maximum(y0, y1) - offset) * supersample), 0, height).astype(np.int64).ravel()
+    nbr_rows = last_row - first_row
+    edge = np.repeat(np.arange(nbr_frames * nbr_edges), nbr_rows)
+    row = first_row[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(nbr_rows) - nbr_rows, nbr_rows)
+
+    x0, y0, x1, y1 = x0.ravel()[edge], y0.ravel()[edge], x1.ravel()[edge], y1.ravel()[edge]
+    x_cross = x0 + (row / supersample + offset - y0) * (x1 - x0) / (y1 - y0)
+
+    # Each crossing toggles all samples on its right: count crossings left of each sample
+    # with a histogram per scanline, then a cumulative sum along the scanline
+    first_column = np.clip(np.ceil((x_cross - offset) * supersample), 0, width).astype(np.int64)
+    bins = ((edge // nbr_edges) * height + row) * (width + 1) + first_column
+    counts = np.bincount(bins, minlength=nbr_frames * height * (width + 1)).reshape(nbr_frames, height, width + 1)
+    return (np.cumsum(counts[:, :, :width], axis=2, dtype=np.uint8) & 1).view(bool)
+
+
+def roi_masks(contours, orientation, shape, supersample=1, out_shape=None):
+    ''' Myocardium masks of all frames of a ROI
+    :param contours: endo and epi contours of each frame (T, 2, 2, n), see polygon_edges()
+    :param orientation: "SA" or "LA"
+    :param shape: image shape (H, W) the contours are defined on
+    :param supersample: samples per pixel along each axis, > 1 for partial-volume masks
+    :param out_shape: output mask shape (default: image shape), contours being scaled accordingly
+    :returns: (T, H, W) bool masks, or float32 pixel coverage if supersample > 1
+    '''
+    x0, y0, x1, y1 = polygon_edges(contours, orientation)
+    if out_shape is not None and tuple(out_shape) != tuple(shape):
+        # Pixel centers at integer coordinates: scale pixel edges, not centers
+        scale_y, scale_x = out_shape[0] / shape[0], out_shape[1] / shape[1]
+        x0, x1 = (x0 + 0.5) * scale_x - 0.5, (x1 + 0.5) * scale_x - 0.5
+        y0, y1 = (y0 + 0.5) * scale_y - 0.5, (y1 + 0.5) * scale_y - 0.5
+        shape = out_shape
+    return rasterize((x0, y0, x1, y1), shape, supersample)
@@ -0,0 +1,557 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+import threading
+
+import numpy as np
+
+
+# MAT v5 data types and array classes used by the parser
+# (see MATLAB "MAT-File Format" reference)
+MI_INT8 = 1
+MI_UINT16 = 4
+MI_INT32 = 5
+MI_UINT32 = 6
+MI_DOUBLE = 9
+MI_INT64 = 12
+MI_MATRIX = 14
+MI_COMPRESSED = 15
+
+MX_CELL_CLASS = 1
+MX_STRUCT_CLASS = 2
+MX_CHAR_CLASS = 4
+MX_DOUBLE_CLASS = 6
+MX_INT64_CLASS = 14
+
+HEADER_SIZE = 128
+
+
+def mat_version(filename):
+    ''' Detect MAT-file version from the 128 bytes header
+    :param filename: path to a .mat/.dns file
+    :returns: '7.3' for HDF5 based files, '5' otherwise
+    '''
+    with open(filename, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError('{} is not a valid MAT-file.'.format(filename))
+    version = struct.unpack('<H', header[124:126])[0]
+    if version == 0x0200 or header.startswith(b'MATLAB 7.3'):
+        return '7.3'
+    return '5'
+
+
+def _padded(nbytes):
+    ''' Size of a data element payload once padded to 8 bytes '''
+    return nbytes + (-nbytes) % 8
+
+
+class FileCursor:
+    '''
+    Sequential reader over a byte range of an uncompressed file
+    Positions are absolute file offsets
+    '''
+
+    def __init__(self, fobj, start):
+        self.f = fobj
+        self.pos = start
+
+    def read(self, n):
+        self.f.seek(self.pos)
+        data = self.f.read(n)
+        if len(data) != n:
+            raise EOFError('Unexpected end of MAT-file.')
+        self.pos += n
+        return data
+
+    def skip(self, n):
+        self.pos += n
+
+    def tell(self):
+        return self.pos
+
+    def checkpoint(self):
+        return self.pos
+
+    def restore(self, state):
+        self.pos = state
+
+
+class InflateCursor:
+    '''
+    Sequential reader over a zlib compressed (miCOMPRESSED) byte range of a file
+    Positions are offsets in the decompressed stream. Decompression is done by
+    bounded chunks, and the decompressor state can be checkpointed, so that a
+    later read can resume from a given position without inflating from the start.
+    '''
+    IN_CHUNK = 1 << 16
+    OUT_CHUNK = 1 << 16
+
+    def __init__(self, fobj, start, length):
+        self.f = fobj
+        self.end = start + length
+        self.restore((zlib.decompressobj(), start, b'', b'', 0))
+
+    def _fill(self):
+        ''' Inflate the next chunk of data into the internal buffer '''
+        if not self.tail:
+            if self.in_pos >= self.end:
+                raise EOFError('Unexpected end of compressed MAT-file variable.')
+            self.f.seek(self.in_pos)
+            self.tail = self.f.read(min(self.IN_CHUNK, self.end - self.in_pos))
+            self.in_pos += len(self.tail)
+        out = self.inflater.decompress(self.tail, self.OUT_CHUNK)
+        self.tail = self.inflater.unconsumed_tail
+        self.buf = self.buf[self.buf_pos:] + out
+        self.buf_pos = 0
+
+    def read(self, n):
+        chunks = []
+        remaining = n
+        while remaining > 0:
+            if self.buf_pos >= len(self.buf):
+                self.buf, self.buf_pos = b'', 0
+                self._fill()
+            chunk = self.buf[self.buf_pos:self.buf_pos + remaining]
+            chunks.append(chunk)
+            self.buf_pos += len(chunk)
+            remaining -= len(chunk)
+        self.pos += n
+        return b''.join(chunks)
+
+    def skip(self, n):
+        while n > 0:
+            if self.buf_pos >= len(self.buf):
+                self.buf, self.buf_pos = b'', 0
+                self._fill()
+            step = min(n, len(self.buf) - self.buf_pos)
+            self.buf_pos += step
+            self.pos += step
+            n -= step
+
+    def tell(self):
+        return self.pos
+
+    def checkpoint(self):
+        ''' Snapshot of the decompression state at the current position '''
+        return (self.inflater.copy(), self.in_pos, self.tail, self.buf[self.buf_pos:], self.pos)
+
+    def restore(self, state):
+        inflater, self.in_pos, self.tail, self.buf, self.pos = state
+        # Copy again so that the same checkpoint can be restored several times
+        self.inflater = inflater.copy()
+        self.buf_pos = 0
+
+
+def read_tag(cursor):
+    ''' Read a data element tag, handling the small data element format
+    :param cursor: FileCursor or InflateCursor
+    :returns: (data type, number of bytes, small data) with small data being
+        the payload if packed in the tag itself, None otherwise
+    '''
+    tag = cursor.read(8)
+    mdtype, nbytes = struct.unpack('<II', tag)
+    if mdtype >> 16:
+        return mdtype & 0xFFFF, mdtype >> 16, tag[4:4 + (mdtype >> 16)]
+    return mdtype, nbytes, None
+
+
+def read_element(cursor):
+    ''' Read a full (non-matrix) data element
+    :returns: (data type, payload bytes)
+    '''
+    mdtype, nbytes, small = read_tag(cursor)
+    if small is not None:
+        return mdtype, small
+    data = cursor.read(_padded(nbytes))
+    return mdtype, data[:nbytes]
+
+
+def read_matrix_header(cursor, nbytes):
+    ''' Read array flags, dimensions and name of a miMATRIX element,
+    the cursor being positioned right after the miMATRIX tag
+    :param nbytes: size of the miMATRIX payload
+    :returns: dict with 'class', 'dims', 'name' and 'header_size' (bytes consumed)
+    '''
+    if nbytes == 0:
+        # Empty matrix (e.g. [] stored in a cell)
+        return {'class': 0, 'dims': (0, 0), 'name': '', 'header_size': 0}
+    start = cursor.tell()
+    _, flags = read_element(cursor)
+    _, dims = read_element(cursor)
+    _, name = read_element(cursor)
+    return {
+        'class': struct.unpack('<I', flags[:4])[0] & 0xFF,
+        'dims': struct.unpack('<{}i'.format(len(dims) // 4), dims),
+        'name': name.decode('latin1'),
+        'header_size': cursor.tell() - start,
+    }
+
+
+def decode_matrix(file_header, element, **kwargs):
+    ''' Decode a raw miMATRIX element with scipy
+    :param file_header: 128 bytes header of the source file
+    :param element: raw miMATRIX element (tag included)
+    :param kwargs: options passed to scipy.io.loadmat
+    :returns: decoded variable
+    '''
+    from scipy.io import loadmat
+    cursor = FileCursor(io.BytesIO(element), 0)
+    _, nbytes, _ = read_tag(cursor)
+    if nbytes == 0:
+        return np.array([])
+    # Cell elements have no name, and scipy reads unnamed variables as raw function
+    # workspaces: give it a 1 character name (packed in a tag of the same size)
+    _, dims_nbytes, _ = read_tag(FileCursor(io.BytesIO(element), 24))
+    name_pos = 32 + _padded(dims_nbytes)
+    if element[name_pos:name_pos + 8] == struct.pack('<II', MI_INT8, 0):
+        element = element[:name_pos] + struct.pack('<I', 1 << 16 | MI_INT8) + b'x\0\0\0' + element[name_pos + 8:]
+    data = loadmat(io.BytesIO(file_header + element), **kwargs)
+    values = [value for key, value in data.items() if not key.startswith('__')]
+    return values[0]
+
+
+class MatV5Index:
+    '''
+    Byte-offset index of a MAT v5 file
+    Top-level variables are located by walking the element tags only,
+    and elements of a given cell variable (e.g. 'img') are indexed on demand,
+    so that any of them can be decoded without reading the others.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        self.lock = threading.RLock()
+        self.header = self.f.read(HEADER_SIZE)
+        if self.header[126:128] != b'IM':
+            raise ValueError('Big-endian MAT-files are not supported ({}).'.format(filename))
+        self.variables = self._index_variables()
+        self._cells = {}
+
+    def close(self):
+        self.f.close()
+
+    def _index_variables(self):
+        ''' Walk top-level data elements
+        :returns: dict name -> (offset, nbytes, compressed)
+        '''
+        variables = {}
+        self.f.seek(0, io.SEEK_END)
+        file_size = self.f.tell()
+        pos = HEADER_SIZE
+        while pos + 8 <= file_size:
+            cursor = FileCursor(self.f, pos)
+            mdtype, nbytes, _ = read_tag(cursor)
+            if mdtype == MI_COMPRESSED:
+                inner = InflateCursor(self.f, pos + 8, nbytes)
+                _, inner_nbytes, _ = read_tag(inner)
+                name = read_matrix_header(inner, inner_nbytes)['name']
+                variables[name] = (pos, nbytes, True)
+                pos += 8 + nbytes
+            elif mdtype == MI_MATRIX:
+                name = read_matrix_header(cursor, nbytes)['name']
+                variables[name] = (pos, nbytes, False)
+                pos += 8 + _padded(nbytes)
+            else:
+                pos += 8 + _padded(nbytes)
+        return variables
+
+    def variable_cursor(self, name):
+        ''' Cursor positioned at the (uncompressed) miMATRIX tag of a variable '''
+        pos, nbytes, compressed = self.variables[name]
+        if compressed:
+            return InflateCursor(self.f, pos + 8, nbytes)
+        return FileCursor(self.f, pos)
+
+    def matrix_element(self, name):
+        ''' Uncompressed miMATRIX element (tag included) of a top-level variable '''
+        with self.lock:
+            cursor = self.variable_cursor(name)
+            mdtype, nbytes, _ = read_tag(cursor)
+            return struct.pack('<II', mdtype, nbytes) + cursor.read(nbytes)
+
+    def variable_span(self, name):
+        ''' (start, stop) file offsets of a top-level variable, tag included '''
+        pos, nbytes, compressed = self.variables[name]
+        return pos, pos + 8 + (nbytes if compressed else _padded(nbytes))
+
+    def raw_variable(self, name):
+        ''' Raw bytes of a top-level variable, exactly as stored in the file '''
+        start, stop = self.variable_span(name)
+        with self.lock:
+            self.f.seek(start)
+            return self.f.read(stop - start)
+
+    def cell(self, name):
+        ''' Lazily indexed cell variable '''
+        with self.lock:
+            if name not in self._cells:
+                self._cells[name] = CellIndex(self, name)
+            return self._cells[name]
+
+
+class CellIndex:
+    '''
+    Index of the elements of a cell variable of a MAT v5 file
+    Elements are scanned (headers only) up to the requested one. For each
+    element, the reader position is checkpointed: a direct file offset for
+    uncompressed files, a decompressor snapshot for compressed ones.
+    '''
+
+    def __init__(self, index, name):
+        self.index = index
+        self.cursor = index.variable_cursor(name)
+        _, nbytes, _ = read_tag(self.cursor)
+        header = read_matrix_header(self.cursor, nbytes)
+        if header['class'] != MX_CELL_CLASS:
+            raise ValueError("Variable '{}' is not a cell array.".format(name))
+        self.size = int(np.prod(header['dims']))
+        # Per element: (checkpoint, element size with tag, dims)
+        self.entries = []
+
+    def __len__(self):
+        return self.size
+
+    def _scan_to(self, k):
+        while len(self.entries) <= k:
+            state = self.cursor.checkpoint()
+            _, nbytes, _ = read_tag(self.cursor)
+            header = read_matrix_header(self.cursor, nbytes)
+            self.cursor.skip(_padded(nbytes) - header['header_size'])
+            self.entries.append((state, 8 + _padded(nbytes), header['dims']))
+
+    def shape(self, k):
+        ''' Dimensions of element k, read from its header only '''
+        with self.index.lock:
+            self._scan_to(k)
+            return tuple(self.entries[k][2])
+
+    def raw(self, k):
+        ''' Raw (uncompressed) miMATRIX element k '''
+        if not 0 <= k < self.size:
+            raise IndexError('Cell index out of range.')
+        with self.index.lock:
+            self._scan_to(k)
+            state, nbytes, _ = self.entries[k]
+            saved = self.cursor.checkpoint()
+            self.cursor.restore(state)
+            element = self.cursor.read(nbytes)
+            self.cursor.restore(saved)
+            return element
+
+    def load(self, k, **kwargs):
+        ''' Decode element k with scipy (same conventions as loadmat) '''
+        return decode_matrix(self.index.header, self.raw(k), **kwargs)
+
+
+### WRITING ###
+
+def pack_element(mdtype, data):
+    ''' Data element (tag and payload), padded to 8 bytes '''
+    if mdtype != MI_MATRIX and len(data) <= 4:
+        # Small data element format
+        return struct.pack('<I', len(data) << 16 | mdtype) + data.ljust(4, b'\0')
+    return struct.pack('<II', mdtype, len(data)) + data + b'\0' * ((-len(data)) % 8)
+
+
+def pack_matrix(mxclass, dims, mdtype, data, name=''):
+    ''' miMATRIX element of a numeric or char array
+    :param mxclass: Matlab array class (e.g. MX_DOUBLE_CLASS)
+    :param dims: array dimensions
+    :param mdtype: data type of the stored values (e.g. MI_DOUBLE)
+    :param data: raw values, in column-major order
+    :param name: variable name (empty for struct fields or cell elements)
+    '''
+    content = pack_element(MI_UINT32, struct.pack('<II', mxclass, 0))
+    content += pack_element(MI_INT32, struct.pack('<{}i'.format(len(dims)), *dims))
+    content += pack_element(MI_INT8, name.encode('latin1'))
+    content += pack_element(mdtype, data)
+    return pack_element(MI_MATRIX, content)
+
+
+def pack_char(text):
+    ''' miMATRIX element of a char row vector (0x0 if empty, as Matlab '') '''
+    dims = (1, len(text)) if text else (0, 0)
+    return pack_matrix(MX_CHAR_CLASS, dims, MI_UINT16, text.encode('utf-16-le'))
+
+
+def pack_int64(values):
+    ''' miMATRIX element of an int64 row vector (0x0 if empty)
+    Python integers are passed as int64 to Matlab, hence the type of indices saved through Matlab
+    '''
+    values = np.asarray(values, dtype='<i8').ravel()
+    dims = (1, values.size) if values.size else (0, 0)
+    return pack_matrix(MX_INT64_CLASS, dims, MI_INT64, values.tobytes())
+
+
+def compress_element(element):
+    ''' miCOMPRESSED top-level element, as written by Matlab -v7 '''
+    data = zlib.compress(element)
+    return struct.pack('<II', MI_COMPRESSED, len(data)) + data
+
+
+def set_struct_fields(element, new_fields):
+    ''' Add or replace fields of a struct array, other fields being kept as opaque bytes
+    :param element: raw (uncompressed) miMATRIX element of the struct array
+    :param new_fields: dict field name -> list of raw miMATRIX elements (one per struct element)
+    :returns: updated raw miMATRIX element
+    '''
+    cursor = FileCursor(io.BytesIO(element), 0)
+    mdtype, nbytes, _ = read_tag(cursor)
+    start = cursor.tell()
+    header = read_matrix_header(cursor, nbytes)
+    if mdtype != MI_MATRIX or header['class'] != MX_STRUCT_CLASS:
+        raise ValueError('Variable is not a struct array.')
+    prefix = element[start:cursor.tell()] # array flags, dimensions and name
+
+    _, field_len = read_element(cursor)
+    field_len = struct.unpack('<i', field_len)[0]
+    _, names = read_element(cursor)
+    fields = [names[i:i+field_len].split(b'\0')[0].decode('latin1') for i in range(0, len(names), field_len)]
+
+    size = int(np.prod(header['dims']))
+    values = []
+    for _ in range(size):
+        values.append({})
+        for field in fields:
+            pos = cursor.tell()
+            _, value_nbytes, _ = read_tag(cursor)
+            cursor.skip(_padded(value_nbytes))
+            values[-1][field] = element[pos:cursor.tell()]
+
+    for field, field_values in new_fields.items():
+        if len(field_values) != size:
+            raise ValueError("Expected {} values for field '{}', got {}.".format(size, field, len(field_values)))
+        if field not in fields:
+            fields.append(field)
+        for value, new_value in zip(values, field_values):
+            value[field] = new_value
+
+    field_len = max(field_len, max(len(field) for field in fields) + 1)
+    content = prefix
+    content += pack_element(MI_INT32, struct.pack('<i', field_len))
+    content += pack_element(MI_INT8, b''.join(field.encode('latin1').ljust(field_len, b'\0') for field in fields))
+    content += b''.join(value[field] for value in values for field in fields)
+    return pack_element(MI_MATRIX, content)
+
+
+# Suffix of the undo record of an in-place variable update (see replace_variable())
+UNDO_SUFFIX = '.undo'
+# Bytes copied at once when a file is rewritten
+COPY_CHUNK = 2**20
+# In-place updates and their recovery don't overlap within the app (e.g. a workspace reopened while it is saved)
+_update_lock = threading.Lock()
+
+
+def _sync_write(filename, data):
+    ''' Write a small file atomically and flush it to disk '''
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+def _write_at(f, pos, data):
+    ''' Write data at a file offset, drop what follows and flush to disk '''
+    f.seek(pos)
+    f.write(data)
+    f.truncate()
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def recover_update(filename):
+    ''' Roll back an in-place variable update interrupted by a crash (see replace_variable())
+    :returns: True if the file was restored
+    '''
+    undo_file = filename + UNDO_SUFFIX
+    with _update_lock:
+        if not os.path.exists(undo_file):
+            return False
+        with open(undo_file, 'rb') as f:
+            record = f.read()
+        pos, = struct.unpack('<Q', record[:8])
+        with open(filename, 'r+b') as f:
+            _write_at(f, pos, record[8:])
+        os.remove(undo_file)
+    return True
+
+
+def _update_in_place(filename, pos, element):
+    ''' Replace the end of a file from a given offset, through an undo record of the bytes replaced '''
+    undo_file = filename + UNDO_SUFFIX
+    with _update_lock:
+        with open(filename, 'r+b') as f:
+            f.seek(pos)
+            previous = f.read()
+            # The file is only changed once the undo record is on disk
+            _sync_write(undo_file, struct.pack('<Q', pos) + previous)
+            try:
+                _write_at(f, pos, element)
+            except BaseException:
+                # E.g. full disk: put back the previous bytes right away (the undo record is kept if it fails too)
+                _write_at(f, pos, previous)
+                os.remove(undo_file)
+                raise
+        os.remove(undo_file)
+
+
+def replace_variable(filename, name, element):
+    ''' Replace (or add) a top-level variable of a MAT v5 file, as Matlab save -append
+    If the variable is the last one of the file, only the variable itself is written, in place: the
+    bytes it replaces are saved into an undo record first, so that an interrupted update is rolled back
+    (right away on errors, or by recover_update() after a crash). Otherwise, the file is rewritten into
+    a new one, other variables being copied by chunks, which replaces the original once complete; the
+    variable is moved at the end, so that later updates are done in place. Either way, the offsets of
+    the other variables (e.g. 'img' sequences being read) don't change.
+    :param filename: MAT v5 file to update
+    :param name: variable name
+    :param element: new top-level element (miMATRIX or miCOMPRESSED) for the variable
+    '''
+    recover_update(filename)
+    index = MatV5Index(filename)
+    try:
+        offsets = sorted(pos for pos, _, _ in index.variables.values())
+        if name in index.variables and index.variables[name][0] == offsets[-1]:
+            pos = index.variables[name][0]
+            index.close()
+            _update_in_place(filename, pos, element)
+            return
+
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(index.header)
+                for var_name in sorted(index.variables, key=lambda var_name: index.variables[var_name][0]):
+                    if var_name != name:
+                        start, stop = index.variable_span(var_name)
+                        index.f.seek(start)
+                        _copy_bytes(index.f, out, stop - start)
+                out.write(element)
+                out.flush()
+                os.fsync(out.fileno())
+            index.close()
+            shutil.copymode(filename, tmp_file)
+            os.replace(tmp_file, filename)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+    finally:
+        index.close()
+
+
+def _copy_bytes(src, dst, nbytes):
+    ''' Copy nbytes from the current position of a file, COPY_CHUNK at a time '''
+    while nbytes > 0:
+        data = src.read(min(nbytes, COPY_CHUNK))
+        if not data:
+            raise ValueError('Unexpected end of file.')
+        dst.write(data)
+        nbytes -= len(data)
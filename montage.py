@@ -0,0 +1,85 @@
+'''
+Montage overview of all slices of a workspace
+One tile per slice (downsampled magnitude frame), assembled into a single uint8 image,
+so that the whole workspace is drawn as one matplotlib image instead of one axis per slice.
+'''
+
+import math
+
+import numpy as np
+
+
+# Default tile size (pixels) of a slice in the montage
+TILE_SIZE = 128
+
+
+class Montage:
+    '''
+    Tiles layout of a montage, and resampling of frames into it
+    Frames are resampled (nearest neighbour) to fit their tile, keeping their aspect ratio.
+    Frames with the same shape are resampled together, in one indexing operation.
+    '''
+
+    def __init__(self, shapes, tile_size=TILE_SIZE, nbr_columns=None):
+        '''
+        :param shapes: full resolution image shape (H, W) of each slice
+        :param tile_size: tile size in pixels
+        :param nbr_columns: number of tiles per row (default: about twice as many columns as rows)
+        '''
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.tile_size = tile_size
+        self.nbr_columns = nbr_columns or max(1, math.ceil(math.sqrt(2 * len(shapes))))
+        self.nbr_rows = max(1, math.ceil(len(shapes) / self.nbr_columns))
+        # Scale from full resolution images to tiles, and offset of the (centered) image in its tile
+        self.scales = [tile_size / max(shape) for shape in self.shapes]
+        self.offsets = [((tile_size - round(shape[0] * scale)) // 2, (tile_size - round(shape[1] * scale)) // 2)
+                        for shape, scale in zip(self.shapes, self.scales)]
+
+    @property
+    def shape(self):
+        return (self.nbr_rows * self.tile_size, self.nbr_columns * self.tile_size)
+
+    def tile_origin(self, index):
+        ''' Top left corner (row, column) of a tile in the montage '''
+        return (index // self.nbr_columns) * self.tile_size, (index % self.nbr_columns) * self.tile_size
+
+    def render(self, frames):
+        ''' Assemble frames into the montage image
+        :param frames: one 2D uint8 frame per slice (can be downsampled from the full resolution
+            image shape given on creation), or None for an empty tile
+        :returns: uint8 montage image
+        '''
+        montage = np.zeros(self.shape, dtype=np.uint8)
+        groups = {}
+        for index, frame in enumerate(frames):
+            if frame is not None:
+                groups.setdefault((frame.shape, self.shapes[index]), []).append(index)
+        for (frame_shape, shape), indices in groups.items():
+            scale = self.scales[indices[0]]
+            height, width = round(shape[0] * scale), round(shape[1] * scale)
+            # Source pixel of each tile pixel center (frame might be downsampled from shape)
+            rows = np.minimum(((np.arange(height) + 0.5) / scale * frame_shape[0] / shape[0]).astype(int), frame_shape[0] - 1)
+            columns = np.minimum(((np.arange(width) + 0.5) / scale * frame_shape[1] / shape[1]).astype(int), frame_shape[1] - 1)
+            tiles = np.stack([frames[index] for index in indices])[:, rows[:, None], columns[None, :]]
+            for index, tile in zip(indices, tiles):
+                row, column = self.tile_origin(index)
+                row_offset, column_offset = self.offsets[index]
+                montage[row + row_offset:row + row_offset + height, column + column_offset:column + column_offset + width] = tile
+        return montage
+
+    def tile_at(self, x, y):
+        ''' Slice index of the tile at montage coordinates (x, y), or None '''
+        if x is None or y is None or x < -0.5 or y < -0.5:
+            return None
+        row, column = int((y + 0.5) // self.tile_size), int((x + 0.5) // self.tile_size)
+        index = row * self.nbr_columns + column
+        if column >= self.nbr_columns or index >= len(self.shapes):
+            return None
+        return index
+
+    def to_montage(self, index, x, y):
+        ''' Montage coordinates of full resolution image coordinates of a slice (e.g. contours) '''
+        row, column = self.tile_origin(index)
+        row_offset, column_offset = self.offsets[index]
+        scale = self.scales[index]
+        return (np.asarray(x) + 0.5) * scale - 0.5 + column + column_offset, (np.asarray(y) + 0.5) * scale - 0.5 + row + row_offset
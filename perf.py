@@ -0,0 +1,263 @@
+'''
+Performance measurement helpers: start-up timings, hot path timings (performance panel),
+and session-wide cProfile/tracemalloc capture (DENSE_PROFILE environment variable)
+'''
+
+import os
+import sys
+import csv
+import json
+import math
+import time
+import atexit
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    '''
+    Import and initialization timings, reported with --profile-startup
+    Timings are always collected (negligible cost), and only printed if enabled
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.t0 = time.perf_counter()
+        self.records = []
+        self.reported = False
+
+    def mark(self, label):
+        ''' Record time elapsed since start (first import of this module) '''
+        self.records.append((label, time.perf_counter() - self.t0, None))
+        if self.enabled and self.reported:
+            self._print(self.records[-1])
+
+    @contextmanager
+    def timed(self, label):
+        ''' Record duration of the enclosed block '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.records.append((label, end - self.t0, end - start))
+            if self.enabled and self.reported:
+                self._print(self.records[-1])
+
+    def _print(self, record, stream=None):
+        label, elapsed, duration = record
+        duration = '' if duration is None else '{:8.1f} ms'.format(1000 * duration)
+        print('[startup] {:9.1f} ms  {:<40} {}'.format(1000 * elapsed, label, duration), file=stream or sys.stderr, flush=True)
+
+    def report(self, stream=None):
+        ''' Print all timings recorded so far, later ones are printed as they come '''
+        if not self.enabled:
+            return
+        for record in self.records:
+            self._print(record, stream)
+        self.reported = True
+
+
+startup = StartupProfiler()
+
+
+### HOT PATHS ###
+
+# Number of most recent occurrences of each event kept for percentiles
+ROLLING_WINDOW = 500
+# Percentiles shown in the performance panel and exports
+PERCENTILES = [50, 90, 99]
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def memory_usage():
+    ''' Current memory use in bytes: traced allocations if tracemalloc is on,
+    otherwise resident set size (Linux only), None if not available
+    '''
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def percentile(values, q):
+    ''' Nearest-rank percentile of a non-empty sorted list '''
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+class EventStats:
+    ''' Rolling durations (and memory use deltas) of one event '''
+
+    def __init__(self, window):
+        self.count = 0
+        self.total = 0.
+        self.durations = deque(maxlen=window)
+        self.memory = deque(maxlen=window)
+
+    def summary(self):
+        durations = sorted(self.durations)
+        row = {'count': self.count, 'last_ms': 1000 * self.durations[-1], 'mean_ms': 1000 * self.total / self.count}
+        for q in PERCENTILES:
+            row['p{}_ms'.format(q)] = 1000 * percentile(durations, q)
+        row['max_ms'] = 1000 * durations[-1]
+        memory = sorted(self.memory)
+        row['memory_median_mb'] = percentile(memory, 50) / 2**20 if memory else None
+        row['memory_max_mb'] = memory[-1] / 2**20 if memory else None
+        # Microsecond / kilobyte resolution
+        return {key: value if isinstance(value, int) or value is None else round(value, 3) for key, value in row.items()}
+
+
+class HotPathProfiler:
+    '''
+    Timings of the app hot paths (workspace opening, rendering, slice change, saving),
+    shown with rolling percentiles in the performance panel
+    Always on: timing an event costs about a microsecond, and events timed with memory=True
+    (coarse ones only) also read the memory use before and after.
+    '''
+
+    def __init__(self, window=ROLLING_WINDOW):
+        self.window = window
+        self.events = {}
+
+    @contextmanager
+    def timed(self, label, memory=False):
+        ''' Record duration (and memory use delta if memory is True) of the enclosed block
+        :param label: event name, sub-steps of an event being named 'event.step'
+        '''
+        before = memory_usage() if memory else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            after = memory_usage() if before is not None else None
+            self.record(label, duration, None if after is None else after - before)
+
+    def record(self, label, duration, memory=None):
+        ''' Add an occurrence of an event (duration in seconds, memory use delta in bytes) '''
+        stats = self.events.get(label)
+        if stats is None:
+            stats = self.events.setdefault(label, EventStats(self.window))
+        stats.count += 1
+        stats.total += duration
+        stats.durations.append(duration)
+        if memory is not None:
+            stats.memory.append(memory)
+
+    def summary(self):
+        ''' One row dict per event (sorted by name), durations in ms and memory deltas in MB '''
+        return [dict(event=label, **self.events[label].summary()) for label in sorted(self.events)]
+
+    def reset(self):
+        self.events = {}
+
+    def export(self, filename):
+        ''' Write summary (and recent durations, for JSON) to a .json or .csv file '''
+        rows = self.summary()
+        if str(filename).lower().endswith('.csv'):
+            with open(filename, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ['event'])
+                writer.writeheader()
+                writer.writerows(rows)
+            return
+        data = {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'window': self.window,
+            'session_profiling': session.modes if session is not None else [],
+            'events': rows,
+            'durations_ms': {label: [1000 * d for d in stats.durations] for label, stats in sorted(self.events.items())},
+        }
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=1)
+
+
+hot = HotPathProfiler()
+
+
+### SESSION PROFILING ###
+
+# Environment variable turning on profiling of a whole session: 'cprofile', 'tracemalloc' or both
+# (comma separated), reports being written on exit to the folder given by PROFILE_DIR_ENV (default: current folder)
+PROFILE_ENV = 'DENSE_PROFILE'
+PROFILE_DIR_ENV = 'DENSE_PROFILE_DIR'
+PROFILE_MODES = ['cprofile', 'tracemalloc']
+# Number of functions / allocation sites listed in reports
+REPORT_LINES = 40
+
+
+class SessionProfiler:
+    '''
+    cProfile and/or tracemalloc capture of a whole app session
+    cProfile statistics are saved as a .prof file (pstats format, e.g. for snakeviz), along
+    with a text report of the slowest functions, tracemalloc as a text report of the
+    allocation sites holding the most memory at exit, and the peak traced memory.
+    '''
+
+    def __init__(self, modes, folder='.'):
+        unknown = set(modes) - set(PROFILE_MODES)
+        if unknown:
+            raise ValueError('Unknown profiling mode(s) {}, should be in {}.'.format(sorted(unknown), PROFILE_MODES))
+        self.modes = list(modes)
+        self.folder = folder
+        self.stem = os.path.join(folder, 'dense_profile_{}'.format(time.strftime('%Y%m%d-%H%M%S')))
+        self.profiler = None
+        self.files = []
+
+    def start(self):
+        if 'tracemalloc' in self.modes:
+            tracemalloc.start()
+        if 'cprofile' in self.modes:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        # Reports are written however the app exits
+        atexit.register(self.stop)
+
+    def stop(self):
+        ''' Stop capture and write reports (once)
+        :returns: list of written files
+        '''
+        atexit.unregister(self.stop)
+        os.makedirs(self.folder, exist_ok=True)
+        if self.profiler is not None:
+            import pstats
+            self.profiler.disable()
+            self.profiler.dump_stats(self.stem + '.prof')
+            with open(self.stem + '_cprofile.txt', 'w') as f:
+                pstats.Stats(self.profiler, stream=f).sort_stats('cumulative').print_stats(REPORT_LINES)
+            self.files += [self.stem + '.prof', self.stem + '_cprofile.txt']
+            self.profiler = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(self.stem + '_tracemalloc.txt', 'w') as f:
+                print('Traced memory at exit: {:.1f} MB, peak: {:.1f} MB\n'.format(current / 2**20, peak / 2**20), file=f)
+                for stat in snapshot.statistics('lineno')[:REPORT_LINES]:
+                    print(stat, file=f)
+            self.files.append(self.stem + '_tracemalloc.txt')
+        for filename in self.files:
+            print('[profile] written {}'.format(filename), file=sys.stderr, flush=True)
+        return self.files
+
+
+def start_session_profiler(environ=os.environ):
+    ''' Start session profiling if requested by the DENSE_PROFILE environment variable
+    :returns: SessionProfiler, or None if not requested
+    '''
+    global session
+    modes = [mode.strip().lower() for mode in environ.get(PROFILE_ENV, '').split(',') if mode.strip()]
+    if not modes:
+        return None
+    session = SessionProfiler(modes, environ.get(PROFILE_DIR_ENV, '.'))
+    session.start()
+    return session
+
+
+session = None
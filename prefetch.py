@@ -0,0 +1,149 @@
+import os
+import threading
+
+from workspace import Workspace
+
+
+class WorkspacePrefetcher:
+    '''
+    Background loading of the workspaces likely to be opened next
+    A background thread opens the target workspaces (in order of priority), then decodes
+    their cine sequences (first slice of each workspace first), until a memory cap is reached.
+    With a budget shared with the opened workspaces, decoding also stops once the budget is full,
+    so that prefetching never evicts the sequences being reviewed.
+    '''
+
+    def __init__(self, max_bytes, budget=None, image_cache=None):
+        '''
+        :param max_bytes: memory cap of decoded sequences held by prefetched workspaces
+        :param budget: optional cache.SequenceBudget of prefetched workspaces
+        :param image_cache: optional imgcache.ImageCache of prefetched workspaces
+        '''
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.image_cache = image_cache
+        # Set when decoding made the budget evict sequences, until targets or cap change
+        self.budget_full = False
+        self.targets = []
+        self.workspaces = {} # filename -> (Workspace, mtime at opening)
+        self.failed = set() # (filename, sequence index) that could not be decoded
+        self.opening = None # workspace being opened by the background thread
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='workspace-prefetcher', daemon=True)
+        self.thread.start()
+
+    def update(self, filenames):
+        ''' Set workspaces to prefetch, in order of priority
+        Prefetched workspaces that are not targets anymore are closed.
+        '''
+        with self.condition:
+            self.targets = list(filenames)
+            self.budget_full = False
+            for filename in list(self.workspaces):
+                if filename not in self.targets:
+                    self.workspaces.pop(filename)[0].close()
+            self.condition.notify_all()
+
+    def set_max_bytes(self, max_bytes):
+        with self.condition:
+            self.max_bytes = max_bytes
+            self.budget_full = False
+            self.condition.notify_all()
+
+    def take(self, filename):
+        ''' Prefetched workspace, removed from the prefetcher
+        :returns: Workspace, or None if not prefetched (or modified since)
+        '''
+        with self.condition:
+            # If being opened, it's faster to wait for it
+            while self.opening == filename:
+                self.condition.wait()
+            ws, mtime = self.workspaces.pop(filename, (None, None))
+            if filename in self.targets:
+                self.targets.remove(filename)
+            self.condition.notify_all()
+        if ws is not None and mtime != _mtime(filename):
+            ws.close()
+            return None
+        return ws
+
+    def give(self, ws):
+        ''' Hand over an opened workspace (e.g. the one being closed), kept if among targets '''
+        with self.condition:
+            if ws.filename in self.targets and ws.filename not in self.workspaces:
+                self.workspaces[ws.filename] = (ws, _mtime(ws.filename))
+                self.condition.notify_all()
+                return
+        ws.close()
+
+    def nbytes(self):
+        return sum(ws.imgs.nbytes() for ws, _ in list(self.workspaces.values()))
+
+    def _next_task(self):
+        ''' Next workspace to open, or (workspace, sequence index) to decode, or None '''
+        for filename in self.targets:
+            if filename not in self.workspaces:
+                return filename
+        if self.nbytes() >= self.max_bytes or self.budget_full:
+            return None
+        if self.budget is not None and self.budget.full():
+            return None
+        # First slice of every workspace first (what is displayed on opening), then other slices
+        for first_only in [True, False]:
+            for filename in self.targets:
+                ws = self.workspaces[filename][0]
+                for img_indices in ws.slice_indices()[:1] if first_only else ws.slice_indices():
+                    for idx in img_indices:
+                        if idx-1 not in ws.imgs.loaded and (filename, idx-1) not in self.failed:
+                            return ws, idx-1
+        return None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                task = self._next_task()
+                while task is None:
+                    self.condition.wait()
+                    task = self._next_task()
+                if isinstance(task, str):
+                    self.opening = task
+
+            if isinstance(task, str):
+                try:
+                    ws = Workspace(task, self.budget, self.image_cache)
+                    mtime = _mtime(task)
+                except Exception:
+                    # Can't be opened now: error will be reported when actually opened
+                    with self.condition:
+                        self.opening = None
+                        if task in self.targets:
+                            self.targets.remove(task)
+                        self.condition.notify_all()
+                    continue
+                with self.condition:
+                    self.opening = None
+                    self.condition.notify_all()
+                    # Targets might have changed meanwhile
+                    if task in self.targets and task not in self.workspaces:
+                        self.workspaces[task] = (ws, mtime)
+                        continue
+                ws.close()
+            else:
+                ws, k = task
+                evictions = self.budget.evictions if self.budget is not None else 0
+                try:
+                    ws.imgs[k]
+                except Exception:
+                    # Not retried (e.g. workspace closed meanwhile, or invalid sequence)
+                    with self.condition:
+                        self.failed.add((ws.filename, k))
+                if self.budget is not None and self.budget.evictions != evictions:
+                    with self.condition:
+                        self.budget_full = True
+
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
@@ -0,0 +1,391 @@
+'''
+Contour quality metrics of ROIs, for automatic QC flagging
+Contours of all frames of all ROIs of a workspace are interpolated together (see splines.py),
+then measured as arrays over frames:
+    area            myocardium area (pixels^2): ring between epi and endo (SA), closed epi + endo contour (LA)
+    perimeter       endo and epi contour lengths
+    thickness       distance from endo points to the epi contour (min, median, max)
+    intersections   self-intersecting endo or epi contour, endo crossing epi
+    centroid        mean epi contour point, for temporal smoothness
+ROIs are flagged from these metrics, with the frames where each check fails (see roi_flags()).
+Workspaces of a dataset are measured in parallel (one workspace per worker process), into a report
+with one row per ROI:
+
+    python qc.py DATASET_FOLDER [--output qc_report.csv] [--flagged-only]
+    python main.py qc ...
+'''
+
+import sys
+import csv
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+import splines
+from workspace import Workspace, ROI_TYPES
+from batch import find_workspaces
+
+
+# Number of points of the contours measured
+QC_SAMPLES = 48
+# Maximum number of (frame, segment, segment) triplets tested at once, bounds memory use
+CHUNK_PAIRS = 2**21
+
+# Flag thresholds
+MIN_THICKNESS = 1.0         # pixels
+MAX_THICKNESS_RATIO = 3.0   # maximum wall thickness of a frame / median wall thickness of the ROI
+MAX_AREA_CHANGE = 0.3       # area change between consecutive frames / median area of the ROI
+MAX_CENTROID_SHIFT = 0.2    # centroid shift between consecutive frames / epi equivalent radius
+FLAGS = ['self-intersection', 'endo/epi crossing', 'endo outside epi', 'thin wall', 'uneven wall',
+         'area jump', 'centroid jump']
+
+REPORT_FIELDS = ['workspace', 'roi', 'name', 'type', 'frames', 'area_mean', 'area_min', 'area_max',
+                 'endo_perimeter_mean', 'epi_perimeter_mean', 'thickness_min', 'thickness_median',
+                 'thickness_max', 'max_area_change', 'max_centroid_shift', 'flags']
+
+
+### FRAME METRICS ###
+
+def _cross(u, v):
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def _cross_matrix(u, v):
+    ''' Cross products of all pairs of vectors (N, a, 2) and (N, b, 2) -> (N, a, b), as one matrix product '''
+    return u @ np.stack([v[..., 1], -v[..., 0]], axis=1)
+
+
+def _segments(points, closed):
+    ''' Start and end points of the segments of polylines (N, n, 2) '''
+    if closed:
+        return points, np.roll(points, -1, axis=1)
+    return points[:, :-1], points[:, 1:]
+
+
+def polygon_area(points):
+    ''' Signed area of closed polygons (N, n, 2) (shoelace formula) '''
+    x, y = points[..., 0], points[..., 1]
+    return 0.5 * np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1)
+
+
+def adjacent_pairs(nbr_segments, closed):
+    ''' Pairs of segments of a polyline sharing an end point (or the same segment), (m, m) bool '''
+    offsets = np.abs(np.subtract.outer(np.arange(nbr_segments), np.arange(nbr_segments)))
+    if closed:
+        offsets = np.minimum(offsets, nbr_segments - offsets)
+    return offsets <= 1
+
+
+def any_crossing(segments_a, segments_b, exclude=None):
+    ''' Whether segments of a cross segments of b, for each frame
+    Only proper crossings count (segments only touching do not).
+    :param segments_a: start and end points (N, a, 2) of the segments of a
+    :param segments_b: start and end points (N, b, 2) of the segments of b
+    :param exclude: (a, b) bool array of pairs not tested, e.g. adjacent_pairs() when a is b
+    :returns: (N,) bool
+    '''
+    (p1, q1), (p2, q2) = segments_a, segments_b
+    result = np.zeros(len(p1), dtype=bool)
+    chunk = max(1, CHUNK_PAIRS // (p1.shape[1] * p2.shape[1]))
+    for start in range(0, len(p1), chunk):
+        frames = slice(start, start + chunk)
+        a_start, a_end, b_start, b_end = p1[frames], q1[frames], p2[frames], q2[frames]
+        a_dir, b_dir = a_end - a_start, b_end - b_start
+        # Both end points of each segment strictly on either side of the other segment, with
+        # cross(d, p - s) = cross(d, p) - cross(d, s) for all pairs at once
+        a_offset, b_offset = _cross(a_dir, a_start)[:, :, None], _cross(b_dir, b_start)[:, None]
+        a_sides = (_cross_matrix(a_dir, b_start) - a_offset) * (_cross_matrix(a_dir, b_end) - a_offset)
+        b_sides = (_cross_matrix(a_start, b_dir) + b_offset) * (_cross_matrix(a_end, b_dir) + b_offset)
+        crossing = (a_sides < 0) & (b_sides < 0)
+        if exclude is not None:
+            crossing &= ~exclude
+        result[frames] = np.any(crossing, axis=(1, 2))
+    return result
+
+
+def point_distances(points, segments):
+    ''' Distance from each point to the closest segment, for each frame
+    :param points: (N, n, 2) points
+    :param segments: start and end points (N, m, 2) of the segments
+    :returns: (N, n) distances
+    '''
+    starts, ends = segments
+    distances = np.empty(points.shape[:2])
+    chunk = max(1, CHUNK_PAIRS // (points.shape[1] * starts.shape[1]))
+    for start in range(0, len(points), chunk):
+        frames = slice(start, start + chunk)
+        p, a, b = points[frames, :, None], starts[frames, None], ends[frames, None]
+        direction = b - a
+        length = np.maximum(np.sum(direction**2, axis=3), np.finfo(float).tiny)
+        t = np.clip(np.sum((p - a) * direction, axis=3) / length, 0, 1)
+        closest = a + t[..., None] * direction
+        distances[frames] = np.sqrt(np.min(np.sum((p - closest)**2, axis=3), axis=2))
+    return distances
+
+
+def frame_metrics(contours, orientation):
+    ''' Metrics of every frame of a batch of contours
+    :param contours: endo and epi contours of each frame (N, 2, 2, n), see utils.roi_contours()
+    :param orientation: "SA" or "LA"
+    :returns: dict of (N,) arrays: area, epi_area, endo_perimeter, epi_perimeter, thickness_min,
+              thickness_median, thickness_max, centroid_x, centroid_y, self_intersection, crossing,
+              inverted (endo area larger than epi area, SA only)
+    '''
+    if orientation not in ROI_TYPES:
+        raise ValueError('ROI orientation axis should be either SA or LA.')
+    closed = orientation == 'SA'
+    endo, epi = np.moveaxis(contours[:, 0], 1, 2), np.moveaxis(contours[:, 1], 1, 2)
+    if closed:
+        # Periodic contours end on their first point
+        endo, epi = endo[:, :-1], epi[:, :-1]
+    centroid = epi.mean(axis=1, keepdims=True)
+    # Centered coordinates, for precision of the products below
+    endo, epi = endo - centroid, epi - centroid
+    endo_segments, epi_segments = _segments(endo, closed), _segments(epi, closed)
+
+    metrics = {}
+    if closed:
+        endo_area, epi_area = np.abs(polygon_area(endo)), np.abs(polygon_area(epi))
+        metrics['area'] = epi_area - endo_area
+        metrics['inverted'] = endo_area >= epi_area
+    else:
+        # Single closed contour, as drawn (see utils.contour_lines())
+        epi_area = np.abs(polygon_area(np.concatenate([epi, endo], axis=1)))
+        metrics['area'] = epi_area
+        metrics['inverted'] = np.zeros(len(contours), dtype=bool)
+    metrics['epi_area'] = epi_area
+    metrics['endo_perimeter'] = np.sum(np.linalg.norm(endo_segments[1] - endo_segments[0], axis=2), axis=1)
+    metrics['epi_perimeter'] = np.sum(np.linalg.norm(epi_segments[1] - epi_segments[0], axis=2), axis=1)
+
+    thickness = point_distances(endo, epi_segments)
+    metrics['thickness_min'] = thickness.min(axis=1)
+    metrics['thickness_median'] = np.median(thickness, axis=1)
+    metrics['thickness_max'] = thickness.max(axis=1)
+
+    metrics['centroid_x'], metrics['centroid_y'] = centroid[:, 0].T
+    if closed:
+        metrics['self_intersection'] = any_crossing(endo_segments, endo_segments, adjacent_pairs(endo.shape[1], True)) \
+            | any_crossing(epi_segments, epi_segments, adjacent_pairs(epi.shape[1], True))
+    else:
+        # Closed epi + endo contour, as drawn (also catches an endo running the wrong way)
+        polygon_segments = _segments(np.concatenate([epi, endo], axis=1), True)
+        metrics['self_intersection'] = any_crossing(polygon_segments, polygon_segments, adjacent_pairs(2 * endo.shape[1], True))
+    metrics['crossing'] = any_crossing(endo_segments, epi_segments)
+    return metrics
+
+
+### ROI METRICS AND FLAGS ###
+
+def _nbr_frames(positions):
+    return np.shape(positions)[0] if np.ndim(positions) else 0
+
+
+def roi_flags(metrics):
+    ''' QC flags of a ROI
+    :param metrics: frame metrics of all frames of the ROI (see frame_metrics())
+    :returns: dict flag name (see FLAGS) -> frames (1-based) where the check fails, failed checks only
+    '''
+    checks = {
+        'self-intersection': metrics['self_intersection'],
+        'endo/epi crossing': metrics['crossing'],
+        'endo outside epi': metrics['inverted'],
+        'thin wall': metrics['thickness_min'] < MIN_THICKNESS,
+        'uneven wall': metrics['thickness_max'] > MAX_THICKNESS_RATIO * np.median(metrics['thickness_median']),
+    }
+    # Temporal smoothness, flagged on the second frame of each pair of consecutive frames
+    area_change, centroid_shift = temporal_changes(metrics)
+    checks['area jump'] = np.concatenate([[False], area_change > MAX_AREA_CHANGE])
+    checks['centroid jump'] = np.concatenate([[False], centroid_shift > MAX_CENTROID_SHIFT])
+    flags = {}
+    for name in FLAGS:
+        frames = np.flatnonzero(checks[name]) + 1
+        if len(frames):
+            flags[name] = frames.tolist()
+    return flags
+
+
+def temporal_changes(metrics):
+    ''' Area change and centroid shift between consecutive frames of a ROI, relative to its size
+    :returns: two arrays of length (frames - 1)
+    '''
+    area_change = np.abs(np.diff(metrics['area'])) / max(np.median(np.abs(metrics['area'])), np.finfo(float).tiny)
+    radius = max(np.sqrt(np.median(metrics['epi_area']) / np.pi), np.finfo(float).tiny)
+    centroid_shift = np.hypot(np.diff(metrics['centroid_x']), np.diff(metrics['centroid_y'])) / radius
+    return area_change, centroid_shift
+
+
+def roi_summary(metrics):
+    ''' Per-ROI summary of its frame metrics, with its flags '''
+    area_change, centroid_shift = temporal_changes(metrics)
+    return {
+        'frames': len(metrics['area']),
+        'area_mean': float(np.mean(metrics['area'])),
+        'area_min': float(np.min(metrics['area'])),
+        'area_max': float(np.max(metrics['area'])),
+        'endo_perimeter_mean': float(np.mean(metrics['endo_perimeter'])),
+        'epi_perimeter_mean': float(np.mean(metrics['epi_perimeter'])),
+        'thickness_min': float(np.min(metrics['thickness_min'])),
+        'thickness_median': float(np.median(metrics['thickness_median'])),
+        'thickness_max': float(np.max(metrics['thickness_max'])),
+        'max_area_change': float(np.max(area_change, initial=0)),
+        'max_centroid_shift': float(np.max(centroid_shift, initial=0)),
+        'flags': roi_flags(metrics),
+    }
+
+
+def _contours(rois, rows, orientation):
+    ''' Contours of all frames of some ROIs, interpolated in one batch
+    :returns: (total frames, 2, 2, QC_SAMPLES) contours, ROI after ROI
+    '''
+    # Consider coordinates - 1 because assumes it comes from Matlab (see utils.roi_contours())
+    curves = [np.asarray(points, dtype=np.float64) - 1 for r in rows for frame in rois[r]['Position'] for points in frame[:2]]
+    contours = splines.interpolate_curves(curves, closed=orientation == 'SA', nbr_samples=QC_SAMPLES)
+    return contours.reshape(len(curves) // 2, 2, 2, QC_SAMPLES)
+
+
+def workspace_qc(rois):
+    ''' QC metrics and flags of all ROIs of a workspace
+    Frames of all ROIs of the same type are measured together.
+    :param rois: 'roi' struct array of the workspace
+    :returns: list (one per ROI) of None (ROIs not SA/LA, or without frames), or summary dict
+              (see roi_summary()), with an 'error' message instead if its contours can't be measured
+    '''
+    results = [None for _ in range(len(rois))]
+    for orientation in ROI_TYPES:
+        rows = [r for r, roi in enumerate(rois) if roi['Type'] == orientation and _nbr_frames(roi['Position'])]
+        if not rows:
+            continue
+        try:
+            groups = [(rows, _contours(rois, rows, orientation))]
+        except (ValueError, TypeError, IndexError):
+            # Some ROIs have invalid anchor points: measured one by one
+            groups = []
+            for r in rows:
+                try:
+                    groups.append(([r], _contours(rois, [r], orientation)))
+                except (ValueError, TypeError, IndexError) as err:
+                    results[r] = {'error': '{}: {}'.format(type(err).__name__, err)}
+        for group_rows, contours in groups:
+            metrics = frame_metrics(contours, orientation)
+            offsets = np.cumsum([0] + [_nbr_frames(rois[r]['Position']) for r in group_rows])
+            for i, r in enumerate(group_rows):
+                results[r] = roi_summary({name: values[offsets[i]:offsets[i+1]] for name, values in metrics.items()})
+    return results
+
+
+def frames_text(frames):
+    ''' Frame numbers as ranges, e.g. [1, 2, 3, 7] -> '1-3, 7' '''
+    ranges = []
+    for frame in frames:
+        if ranges and frame == ranges[-1][1] + 1:
+            ranges[-1][1] = frame
+        else:
+            ranges.append([frame, frame])
+    return ', '.join(str(a) if a == b else '{}-{}'.format(a, b) for a, b in ranges)
+
+
+def flags_text(flags):
+    ''' Flags as text, e.g. 'thin wall (frames 3-5); area jump (frames 12)' '''
+    return '; '.join('{} (frames {})'.format(name, frames_text(frames)) for name, frames in flags.items())
+
+
+### DATASET REPORT ###
+
+def qc_workspace(filename):
+    ''' Worker task: QC of the ROIs of one workspace (header only, no images read)
+    :param filename: workspace path
+    :returns: dict with 'file', 'error' and 'rois' (list of dicts with 'roi' (1-based), 'name', 'type'
+              and the ROI summary, see workspace_qc())
+    '''
+    result = {'file': str(filename), 'error': None, 'rois': []}
+    try:
+        with Workspace(str(filename)) as ws:
+            for r, summary in enumerate(workspace_qc(ws.rois)):
+                if summary is not None:
+                    result['rois'].append(dict(roi=r + 1, name=str(ws.rois[r]['Name']), type=str(ws.rois[r]['Type']), **summary))
+    except Exception as err:
+        result['error'] = '{}: {}'.format(type(err).__name__, err)
+    return result
+
+
+def run_qc(folder, pattern='*.dns', jobs=None, progress=None):
+    ''' QC of all workspaces of a folder with a process pool
+    :param folder: folder searched (recursively) for workspaces
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param progress: optional callback(number done, total, result)
+    :returns: list of results (see qc_workspace()), sorted by path
+    '''
+    # Only needed by the command line (the app imports this module on start-up)
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(qc_workspace, path) for path in find_workspaces(folder, pattern)]
+        for future in as_completed(futures):
+            results.append(future.result())
+            if progress is not None:
+                progress(len(results), len(futures), results[-1])
+    return sorted(results, key=lambda result: result['file'])
+
+
+def write_report(results, filename, folder=None, flagged_only=False):
+    ''' Write a QC report, one row per ROI (.csv) or the full results (.json)
+    :param results: results of run_qc()
+    :param folder: dataset folder, workspace paths being written relative to it
+    :param flagged_only: only write flagged ROIs (and workspaces that could not be read)
+    '''
+    rows = []
+    for result in results:
+        workspace = Path(result['file']).relative_to(folder).as_posix() if folder is not None else result['file']
+        if result['error']:
+            rows.append({'workspace': workspace, 'flags': 'error: ' + result['error']})
+        for roi in result['rois']:
+            if flagged_only and not roi.get('flags') and not roi.get('error'):
+                continue
+            row = dict(roi, workspace=workspace)
+            row['flags'] = 'error: ' + roi['error'] if roi.get('error') else flags_text(roi['flags'])
+            rows.append(row)
+
+    if Path(filename).suffix.lower() == '.json':
+        with open(filename, 'w') as f:
+            json.dump(rows, f, indent=1)
+        return
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: round(value, 3) if isinstance(value, float) else value for key, value in row.items()})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure ROI contours of a dataset and flag suspicious ones')
+    parser.add_argument('folder', help='dataset folder (searched recursively)')
+    parser.add_argument('--output', default='qc_report.csv', help='report file, .csv or .json (default: qc_report.csv)')
+    parser.add_argument('--pattern', default='*.dns', help='workspace file pattern (default: *.dns)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: all CPUs)')
+    parser.add_argument('--flagged-only', action='store_true', help='only report flagged ROIs')
+    args = parser.parse_args(argv)
+
+    def progress(done, total, result):
+        flagged = sum(bool(roi.get('flags') or roi.get('error')) for roi in result['rois'])
+        message = result['error'] or '{} ROIs, {} flagged'.format(len(result['rois']), flagged)
+        print('[{:>{w}}/{}] {}: {}'.format(done, total, result['file'], message, w=len(str(total))),
+              file=sys.stderr, flush=True)
+
+    start = time.perf_counter()
+    results = run_qc(args.folder, args.pattern, args.jobs, progress)
+    write_report(results, args.output, args.folder, args.flagged_only)
+
+    rois = [roi for result in results for roi in result['rois']]
+    counts = {name: sum(name in roi.get('flags', {}) for roi in rois) for name in FLAGS}
+    print('{} workspaces, {} ROIs in {:.1f} s: {} flagged ({})'.format(
+        len(results), len(rois), time.perf_counter() - start, sum(bool(roi.get('flags') or roi.get('error')) for roi in rois),
+        ', '.join('{} {}'.format(count, name) for name, count in counts.items() if count) or 'none'), file=sys.stderr)
+    return 1 if any(result['error'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import weakref
+
+import numpy as np
+
+import perf
+import utils
+
+
+# Display window of each panel, as (low, high) intensity percentiles of the whole cine
+# (magnitude first, then phases)
+MAG_PERCENTILES = (1, 99.5)
+PHA_PERCENTILES = (0.5, 99.5)
+# Maximum number of pixels used to estimate display windows
+WINDOW_SAMPLES = 2**18
+# ROI zoom (see crop_box()): margin around the contours, relative to their extent,
+# and minimum size (pixels) of the displayed region
+CROP_MARGIN = 0.25
+CROP_MIN_SIZE = 24
+
+
+def display_window(img, percentiles):
+    ''' Robust display range of a cine sequence
+    :param img: cine sequence (H, W, T)
+    :param percentiles: (low, high) percentiles
+    :returns: (vmin, vmax)
+    '''
+    values = img.ravel()
+    # Estimated on evenly spaced pixels for large sequences
+    if values.size > WINDOW_SAMPLES:
+        values = values[::values.size // WINDOW_SAMPLES + 1]
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return 0.0, 1.0
+    vmin, vmax = np.percentile(values, percentiles)
+    if vmax <= vmin:
+        vmax = vmin + 1
+    return float(vmin), float(vmax)
+
+
+class DisplayCube:
+    '''
+    Cine sequence prepared for display, once per sequence: intensities mapped to uint8
+    with a window fixed for the whole cine (constant contrast across frames), frames first,
+    so that a frame is a zero-copy contiguous view. A 2x downsampled level can be added
+    for overview displays.
+    '''
+    __slots__ = ('levels', 'window', 'nbytes', '__weakref__')
+
+    def __init__(self, img, percentiles=MAG_PERCENTILES, downsampled=False):
+        '''
+        :param img: cine sequence (H, W, T)
+        :param percentiles: display window percentiles
+        :param downsampled: also build the 2x downsampled level
+        '''
+        self.window = display_window(img, percentiles)
+        vmin, vmax = self.window
+        cube = np.moveaxis(img, 2, 0) - vmin
+        cube *= 255 / (vmax - vmin)
+        np.clip(cube, 0, 255, out=cube)
+        self.levels = [np.ascontiguousarray(cube, dtype=np.uint8)]
+        if downsampled:
+            self.add_downsampled()
+        self.nbytes = sum(level.nbytes for level in self.levels)
+
+    def add_downsampled(self):
+        ''' Add 2x downsampled level (2x2 pixels mean), if not built yet '''
+        if len(self.levels) > 1:
+            return
+        cube = self.levels[0]
+        nbr_frames, height, width = cube.shape
+        blocks = cube[:, :height//2*2, :width//2*2].reshape(nbr_frames, height//2, 2, width//2, 2)
+        self.levels.append(((blocks.sum(axis=(2, 4), dtype=np.uint16) + 2) // 4).astype(np.uint8))
+        self.nbytes = sum(level.nbytes for level in self.levels)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def frame(self, frame, level=0):
+        ''' Frame view (uint8, no copy)
+        :param frame: frame index (0-based)
+        :param level: 0 for full resolution, 1 for 2x downsampled
+        '''
+        return self.levels[level][frame]
+
+
+class FrameData:
+    '''
+    Ready-to-display data of one frame of a slice: images, their display range,
+    and contour lines of the selected ROI
+    Images can be views of display cubes, which are then kept alive by the frame: its size
+    includes its share of each cube (one frame of it), so that the cached frames of a whole
+    cine account for their cubes.
+    '''
+    __slots__ = ('images', 'clims', 'contours', 'cubes', 'nbytes')
+
+    def __init__(self, images, contours, clims=None, cubes=()):
+        self.images = images
+        if clims is None:
+            clims = [None if img is None else (img.min(), img.max()) for img in images]
+        self.clims = clims
+        self.contours = contours
+        self.cubes = [cube for cube in cubes if cube is not None]
+        self.nbytes = sum(img.nbytes for img in images if img is not None and img.base is None)
+        self.nbytes += sum(x.nbytes + y.nbytes for x, y in contours)
+        self.nbytes += sum(cube.nbytes // len(cube) for cube in self.cubes)
+
+
+def crop_box(roi_contours, shape, margin=CROP_MARGIN, min_size=CROP_MIN_SIZE):
+    ''' Square region of the images around the contours of all frames of a ROI
+    The region is the same for the whole cine, so that the motion of the contours stays visible.
+    :param roi_contours: contours of all frames of the ROI (see utils.roi_contours())
+    :param shape: images shape (H, W)
+    :param margin: margin on each side, relative to the largest extent of the contours
+    :param min_size: minimum size (pixels) of the region
+    :returns: (row start, row stop, column start, column stop), or None if there are no contours
+    '''
+    points = np.asarray(roi_contours, dtype=float)
+    x, y = points[:, :, 0], points[:, :, 1]
+    if not np.isfinite(x).any() or not np.isfinite(y).any():
+        return None
+    x_min, x_max, y_min, y_max = np.nanmin(x), np.nanmax(x), np.nanmin(y), np.nanmax(y)
+    size = int(np.ceil(max(max(x_max - x_min, y_max - y_min) * (1 + 2 * margin), min_size)))
+
+    box = []
+    # Centered on the contours, shifted to stay inside the images
+    for center, length in [((y_min + y_max) / 2, shape[0]), ((x_min + x_max) / 2, shape[1])]:
+        extent = min(size, length)
+        start = int(np.clip(np.round(center - extent / 2), 0, length - extent))
+        box += [start, start + extent]
+    return tuple(box)
+
+
+def prepare_frame(cubes, frame, roi_data=None, roi_contours=None, crop=None):
+    ''' Gather display data of a frame
+    :param cubes: DisplayCube of each image panel (None if not available)
+    :param frame: frame index (0-based)
+    :param roi_data: selected ROI entry ('roi' struct element), or None
+    :param roi_contours: contours of all frames of the ROI (see utils.roi_contours()),
+        interpolated for this frame only if not given
+    :param crop: optional region of the images to display (see crop_box()), contours being moved into it
+    :returns: FrameData
+    '''
+    images = []
+    for cube in cubes:
+        # If z-axis img doesn't exists, None (displayed as a black img)
+        try:
+            images.append(cube.frame(frame))
+        except (AttributeError, IndexError):
+            images.append(None)
+    if crop is not None:
+        row_start, row_stop, col_start, col_stop = crop
+        # Views of the display cube frames
+        images = [None if img is None else img[row_start:row_stop, col_start:col_stop] for img in images]
+
+    contours = []
+    if roi_data is not None:
+        # Number of frames for ROI and slice might differ, no contours displayed then (nor for
+        # frames without anchor points)
+        try:
+            if roi_contours is None:
+                roi_contours = utils.roi_contours(roi_data['Type'], roi_data['Position'][frame:frame+1])
+                frame = 0
+            if np.isfinite(roi_contours[frame]).all():
+                contours = utils.contour_lines(*roi_contours[frame], roi_data['Type'])
+        except IndexError:
+            pass
+        if crop is not None:
+            contours = [(x - col_start, y - row_start) for x, y in contours]
+    return FrameData(images, contours, clims=[(0, 255)] * len(images), cubes=cubes)
+
+
+class FrameBuilder:
+    '''
+    Builds FrameData of a workspace from (filename, sequence indices, frame, ROI index, zoom) keys
+    Display cubes of sequences are shared by the frames built from them, and kept as long as they
+    are used (e.g. by frames of a render cache, see FrameData), while contours of all frames of a ROI
+    (and the region they are zoomed on, see crop_box()) are computed once, on first use.
+    Can be called from a background thread (e.g. to fill a render cache).
+    '''
+
+    def __init__(self, workspace, nbr_panels=4):
+        self.workspace = workspace
+        self.nbr_panels = nbr_panels
+        self.cubes = weakref.WeakValueDictionary()
+        self.roi_contours = {}
+        self.crops = {}
+
+    def display_cube(self, idx, magnitude=True, downsampled=False):
+        ''' Display cube of a sequence
+        :param idx: sequence index (0-based)
+        :param magnitude: magnitude (or phase) sequence, sets the display window
+        :param downsampled: make sure the 2x downsampled level is built
+        '''
+        cube = self.cubes.get(idx)
+        if cube is None:
+            with perf.hot.timed('frame_builder.read_sequence', memory=True):
+                img = self.workspace.imgs[idx]
+            with perf.hot.timed('frame_builder.display_cube'):
+                cube = self.cubes[idx] = DisplayCube(img, MAG_PERCENTILES if magnitude else PHA_PERCENTILES)
+        if downsampled:
+            cube.add_downsampled()
+        return cube
+
+    def contours(self, roi_index):
+        ''' Contours of all frames of a ROI (see utils.roi_contours()) '''
+        if roi_index not in self.roi_contours:
+            roi_data = self.workspace.rois[roi_index]
+            with perf.hot.timed('frame_builder.contours'):
+                self.roi_contours[roi_index] = utils.roi_contours(roi_data['Type'], roi_data['Position'])
+        return self.roi_contours[roi_index]
+
+    def crop(self, roi_index, shape):
+        ''' Region of images of a given shape zoomed on a ROI (see crop_box()) '''
+        if (roi_index, shape) not in self.crops:
+            self.crops[roi_index, shape] = crop_box(self.contours(roi_index), shape)
+        return self.crops[roi_index, shape]
+
+    def __call__(self, key):
+        ''' Render cache builder
+        :returns: (FrameData, nbytes)
+        '''
+        _, images_idx, frame, roi_index, zoom = key
+        cubes = [self.display_cube(idx, i == 0) for i, idx in enumerate(images_idx[:self.nbr_panels])]
+        cubes += [None] * (self.nbr_panels - len(cubes))
+        if roi_index is None:
+            data = prepare_frame(cubes, frame)
+        else:
+            crop = self.crop(roi_index, cubes[0].frame(0).shape) if zoom else None
+            data = prepare_frame(cubes, frame, self.workspace.rois[roi_index], self.contours(roi_index), crop)
+        return data, data.nbytes
+
+
+class FrameRenderer:
+    '''
+    Images panel renderer reusing matplotlib artists
+    One image and a few contour lines per axis are created when the scene changes
+    (slice, ROI or image size). On frame changes, only their data is updated and they
+    are redrawn by blitting them over a cached background, instead of a full canvas.draw().
+    '''
+
+    def __init__(self, canvas, axes):
+        '''
+        :param canvas: matplotlib FigureCanvas
+        :param axes: list of matplotlib axes (one per image panel)
+        '''
+        self.canvas = canvas
+        self.axes = axes
+        self.images = []
+        self.lines = []
+        self.layout = None
+        self.background = None
+        # Any full redraw (e.g. window resize) invalidates the cached background
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self.images + [line for lines in self.lines for line in lines]:
+            self.canvas.figure.draw_artist(artist)
+
+    def _setup(self, images, clims, contours, layout):
+        ''' Create artists for a new scene (previous ones removed) '''
+        # Artists are removed rather than axes cleared (much faster than axis.cla())
+        for artist in self.images + [line for lines in self.lines for line in lines]:
+            artist.remove()
+        self.images, self.lines = [], []
+        for axis, img, clim, available in zip(self.axes, images, clims, layout[1]):
+            axis.axis('off')
+            self.images.append(axis.imshow(img, cmap='gray', animated=True))
+            if clim is not None:
+                self.images[-1].set_clim(*clim)
+            self.lines.append([axis.plot(x, y, c='red', animated=True)[0] for x, y in contours] if available else [])
+        self.layout = layout
+        # Background (everything but animated artists) is cached by _on_draw()
+        self.canvas.draw()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+    def draw_frame(self, data, full=False):
+        ''' Display a prepared frame (see prepare_frame()) '''
+        self.draw(data.images, data.contours, full=full, clims=data.clims)
+
+    def draw(self, images, contours, full=False, clims=None):
+        ''' Display a frame
+        :param images: one 2D image per axis (None if not available, shown as a black image without contours)
+        :param contours: list of contour lines (x, y) to overlay on each available image
+        :param full: force a full redraw (e.g. slice or ROI change)
+        :param clims: optional (vmin, vmax) per image, computed from the image otherwise
+        '''
+        clims = clims or [None] * len(images)
+        shape = next(img.shape for img in images if img is not None)
+        available = tuple(img is not None for img in images)
+        images = [np.zeros(shape) if img is None else img for img in images]
+        layout = (tuple(img.shape for img in images), available, len(contours))
+
+        if full or layout != self.layout or self.background is None:
+            self._setup(images, clims, contours, layout)
+            return
+
+        for artist, img, clim in zip(self.images, images, clims):
+            artist.set_data(img)
+            # Same per-frame contrast as imshow()
+            if clim is None:
+                artist.autoscale()
+            else:
+                artist.set_clim(*clim)
+        for lines in self.lines:
+            for line, (x, y) in zip(lines, contours):
+                line.set_data(x, y)
+
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
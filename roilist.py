@@ -0,0 +1,233 @@
+'''
+ROI panel model and delegate
+ROIs are held as structured records (name, SeqIndex, type, corrected name and image indices),
+shown as rich text with the corrected image indices colored, the suggested slice of ROIs
+without correction in gray (see suggest.py), and QC flags in red (see qc.py). Rich text layouts are built once
+per row and cached by the delegate until the row changes.
+'''
+
+import html
+
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize
+from PyQt5.QtGui import QTextDocument, QAbstractTextDocumentLayout, QPalette, QColor
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionViewItem, QStyle, QApplication
+
+from workspace import ROI_TYPES
+from qc import flags_text
+
+
+# Color of the corrected image indices
+CORRECTED_COLOR = '#32CD32'
+# Color of the suggested slices
+SUGGESTED_COLOR = '#A0A0A0'
+# Color of the QC flags
+FLAG_COLOR = '#E04040'
+# Item data role of the rich text (HTML) of a row
+HtmlRole = Qt.UserRole + 1
+
+
+class RoiRecord:
+    ''' One ROI of the panel '''
+
+    def __init__(self, name, seq_index, roi_type):
+        '''
+        :param name: ROI name
+        :param seq_index: image indices (1-based) the ROI was drawn on
+        :param roi_type: ROI type ('SA', 'LA', others can't be corrected)
+        '''
+        self.name = name if isinstance(name, str) else ''
+        self.seq_index = [int(i) for i in np.atleast_1d(seq_index) if not np.isnan(i)]
+        self.type = roi_type
+
+    @property
+    def enabled(self):
+        return self.type in ROI_TYPES
+
+
+class RoiListModel(QAbstractListModel):
+    '''
+    ROIs of a workspace, with their user-set corrections
+    names and assoc (corrected name and image indices of each ROI, '' and [] if not set)
+    are the lists saved into the workspace (see workspace.update_workspace_corrected()).
+    '''
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.records = []
+        self.names = []
+        self.assoc = []
+        # Suggested slice of each ROI (see suggest.suggest()), or None
+        self.suggestions = []
+        # QC metrics and flags of each ROI (see qc.workspace_qc()), or None
+        self.qc = []
+
+    def set_rois(self, rois, names, assoc):
+        ''' Replace the ROIs of the panel
+        :param rois: 'roi' struct array of the workspace
+        :param names: corrected name of each ROI
+        :param assoc: corrected image indices of each ROI
+        '''
+        self.beginResetModel()
+        self.records = [RoiRecord(roi['Name'], roi['SeqIndex'], roi['Type']) for roi in rois]
+        self.names = list(names)
+        self.assoc = [list(indices) for indices in assoc]
+        self.suggestions = [None for _ in self.records]
+        self.qc = [None for _ in self.records]
+        self.endResetModel()
+
+    def set_correction(self, row, name, indices):
+        ''' Set (or clear, with '' and []) the correction of a ROI '''
+        self.names[row] = name
+        self.assoc[row] = [int(i) for i in indices]
+        self.dataChanged.emit(self.index(row), self.index(row))
+
+    def clear_corrections(self):
+        ''' Clear the corrections of all ROIs, notified as one change of all rows '''
+        self.names = ['' for _ in self.records]
+        self.assoc = [[] for _ in self.records]
+        if self.records:
+            self.dataChanged.emit(self.index(0), self.index(len(self.records) - 1))
+
+    def set_suggestions(self, suggestions):
+        ''' Set the suggested slices of all ROIs, notified as one change of all rows '''
+        self.suggestions = list(suggestions)
+        if self.records:
+            self.dataChanged.emit(self.index(0), self.index(len(self.records) - 1))
+
+    def suggestion(self, row):
+        ''' Suggested slice of a ROI that has no correction yet, or None '''
+        if row is None or self.names[row] or self.assoc[row]:
+            return None
+        return self.suggestions[row]
+
+    def set_qc(self, results):
+        ''' Set the QC results of all ROIs, notified as one change of all rows '''
+        self.qc = list(results)
+        if self.records:
+            self.dataChanged.emit(self.index(0), self.index(len(self.records) - 1))
+
+    def qc_flags(self, row):
+        ''' QC flags of a ROI (see qc.roi_flags()), {'error': message} if it couldn't be measured '''
+        result = self.qc[row] if row < len(self.qc) else None
+        if result is None:
+            return {}
+        if 'error' in result:
+            return {'error': result['error']}
+        return result['flags']
+
+    def set_name(self, row, name):
+        ''' Change the displayed name of a ROI '''
+        self.records[row].name = name
+        self.dataChanged.emit(self.index(row), self.index(row))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+
+    def flags(self, index):
+        # Non-standard short or long axis ROIs are disabled
+        if not index.isValid() or not self.records[index.row()].enabled:
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        record = self.records[row]
+        if role == Qt.DisplayRole:
+            text = '{}\t{}'.format(record.name, record.seq_index)
+            if self.names[row] or self.assoc[row]:
+                text = '{} - {}\t{}'.format(self.names[row], text, self.assoc[row])
+            elif self.suggestion(row) is not None:
+                text = '{}\t{}?'.format(text, _suggestion_text(self.suggestions[row]))
+            if self.qc_flags(row):
+                text = '{}\t! {}'.format(text, ', '.join(self.qc_flags(row)))
+            return text
+        if role == HtmlRole:
+            text = '{} {}'.format(html.escape(record.name), record.seq_index)
+            if self.names[row] or self.assoc[row]:
+                text = '{} - {} <span style="color:{};">{}</span>'.format(
+                    html.escape(self.names[row]), text, CORRECTED_COLOR, self.assoc[row])
+            elif self.suggestion(row) is not None:
+                text = '{} <span style="color:{};">{}?</span>'.format(
+                    text, SUGGESTED_COLOR, html.escape(_suggestion_text(self.suggestions[row])))
+            if self.qc_flags(row):
+                text = '{} <span style="color:{};">! {}</span>'.format(
+                    text, FLAG_COLOR, html.escape(', '.join(self.qc_flags(row))))
+            return '<pre>' + text + '</pre>'
+        if role == Qt.ToolTipRole:
+            lines = []
+            if self.suggestion(row) is not None:
+                lines.append('Suggested slice: {} (score {:.2f})'.format(
+                    _suggestion_text(self.suggestions[row]), self.suggestions[row]['score']))
+            flags = self.qc_flags(row)
+            if 'error' in flags:
+                lines.append('QC: contours could not be measured ({})'.format(flags['error']))
+            elif flags:
+                lines.append('QC: ' + flags_text(flags))
+            return '\n'.join(lines) or None
+        if role == Qt.ForegroundRole and not record.enabled:
+            return QColor(Qt.gray)
+        return None
+
+
+def _suggestion_text(suggestion):
+    return '{} {}'.format(suggestion['name'], suggestion['seq_index']).strip()
+
+
+class RoiDelegate(QStyledItemDelegate):
+    '''
+    Draws ROI rows as rich text (HtmlRole of the model)
+    Text documents are laid out once per row, and rebuilt only when the row data changes
+    (or the model is reset), instead of on every paint and size hint.
+    '''
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.documents = {}
+        model.dataChanged.connect(self.invalidate)
+        model.modelReset.connect(self.documents.clear)
+        model.rowsInserted.connect(lambda *args: self.documents.clear())
+        model.rowsRemoved.connect(lambda *args: self.documents.clear())
+
+    def invalidate(self, top_left, bottom_right, roles=()):
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self.documents.pop(row, None)
+
+    def document(self, index):
+        ''' Laid out text document of a row (cached) '''
+        doc = self.documents.get(index.row())
+        if doc is None:
+            doc = QTextDocument()
+            doc.setHtml(index.data(HtmlRole))
+            self.documents[index.row()] = doc
+        return doc
+
+    def paint(self, painter, option, index):
+        options = QStyleOptionViewItem(option)
+        self.initStyleOption(options, index)
+        doc = self.document(index)
+
+        # Item background (selection, hover), without text
+        options.text = ''
+        style = QApplication.style() if options.widget is None else options.widget.style()
+        style.drawControl(QStyle.CE_ItemViewItem, options, painter, options.widget)
+
+        ctx = QAbstractTextDocumentLayout.PaintContext()
+        if option.state & QStyle.State_Selected:
+            ctx.palette.setColor(QPalette.Text, option.palette.color(QPalette.Active, QPalette.HighlightedText))
+        # Disabled items in gray
+        if not index.flags() & Qt.ItemIsEnabled:
+            ctx.palette.setColor(QPalette.Text, QColor(Qt.gray))
+
+        text_rect = style.subElementRect(QStyle.SE_ItemViewItemText, options, options.widget)
+        painter.save()
+        painter.translate(text_rect.topLeft())
+        painter.setClipRect(text_rect.translated(-text_rect.topLeft()))
+        doc.documentLayout().draw(painter, ctx)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        doc = self.document(index)
+        return QSize(int(doc.idealWidth()), int(doc.size().height()))
@@ -0,0 +1,169 @@
+'''
+Background saving of workspaces, so that the UI never waits for the save backend
+'''
+
+import os
+import threading
+from pathlib import Path
+
+import perf
+import matfile
+
+
+def must_release(filename):
+    ''' Whether a workspace file must be closed by the app while it is overwritten
+    Open files can't be replaced on Windows, and HDF5 files can't be opened for reading and
+    writing at once. Otherwise it is kept open (the 'img' sequences read by the app keep their offsets,
+    see matfile.replace_variable()).
+    '''
+    return os.name == 'nt' or matfile.mat_version(filename) == '7.3'
+
+
+def temp_file(output_file):
+    ''' Temporary file a released workspace is written to, next to it and with the same extension
+    (Matlab chooses the file format from it)
+    '''
+    path = Path(output_file)
+    return str(path.with_name('.{}.saving{}'.format(path.stem, path.suffix)))
+
+
+class SaveJob:
+    '''
+    Corrections of a workspace to save, as they were when the save was requested
+    '''
+
+    def __init__(self, filename, output_file, names, assoc, workspace=None, journal_records=None):
+        '''
+        :param filename: workspace path
+        :param output_file: output path (can be filename)
+        :param names: corrected names (copied)
+        :param assoc: corrected image indices (copied)
+        :param workspace: opened Workspace of filename, released while its file is overwritten
+        :param journal_records: journal records included in names/assoc (see journal.py)
+        '''
+        self.filename = str(filename)
+        self.output_file = str(output_file)
+        self.names = list(names)
+        self.assoc = [list(indices) for indices in assoc]
+        self.workspace = workspace
+        self.journal_records = journal_records or []
+        self.error = None
+
+    @property
+    def name(self):
+        return Path(self.output_file).name
+
+
+class SaveWorker:
+    '''
+    Queue of workspaces to save, processed in order by a background thread
+    Jobs hold a snapshot of the corrections taken on submission. A job still waiting for an
+    output file that is saved again is replaced by the new one (only the latest corrections
+    are written). Callbacks are called from the worker thread.
+    '''
+
+    def __init__(self, backend_loader, on_status=None, on_done=None):
+        '''
+        :param backend_loader: backends.BackendLoader (the worker waits for the backend to be started)
+        :param on_status: optional callback(message)
+        :param on_done: optional callback(SaveJob), job.error being set if the save failed
+        '''
+        self.backend_loader = backend_loader
+        self.on_status = on_status
+        self.on_done = on_done
+        self.queue = []
+        self.running = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='save-worker', daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        ''' Queue a job, replacing a waiting job with the same output file
+        :returns: True if it replaced a waiting job
+        '''
+        with self.condition:
+            for i, queued in enumerate(self.queue):
+                if os.path.abspath(queued.output_file) == os.path.abspath(job.output_file):
+                    self.queue[i] = job
+                    coalesced = True
+                    break
+            else:
+                self.queue.append(job)
+                coalesced = False
+            self.condition.notify_all()
+        self._status('Saving {}...{}'.format(job.name, self._pending_text()))
+        return coalesced
+
+    def pending(self):
+        ''' Number of jobs queued or running '''
+        with self.condition:
+            return len(self.queue) + (self.running is not None)
+
+    def wait(self, timeout=None):
+        ''' Wait for all jobs to be done
+        :returns: True if done, False on timeout
+        '''
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and self.running is None, timeout)
+
+    def _pending_text(self):
+        pending = self.pending()
+        return ' ({} pending)'.format(pending) if pending > 1 else ''
+
+    def _status(self, message):
+        if self.on_status is not None:
+            self.on_status(message)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                job = self.running = self.queue.pop(0)
+
+            self._status('Saving {}...{}'.format(job.name, self._pending_text()))
+            try:
+                backend = self.backend_loader.get()
+                os.makedirs(os.path.dirname(os.path.abspath(job.output_file)), exist_ok=True)
+                with perf.hot.timed('save_worker.{}_backend'.format(backend.name), memory=True):
+                    if job.workspace is not None and os.path.abspath(job.output_file) == os.path.abspath(job.filename) \
+                            and must_release(job.filename):
+                        self._save_released(backend, job)
+                    else:
+                        backend.update_workspace_corrected(job.names, job.assoc, job.filename, job.output_file)
+            except Exception as err:
+                job.error = err
+
+            if job.error is None:
+                self._status('Saved {}{}'.format(job.output_file, ' ({} pending)'.format(len(self.queue)) if self.queue else ''))
+            else:
+                self._status('Failed to save {}: {}'.format(job.output_file, job.error))
+            # Done callback before the job is marked as done (see wait())
+            if self.on_done is not None:
+                self.on_done(job)
+            with self.condition:
+                self.running = None
+                self.condition.notify_all()
+
+    def _save_released(self, backend, job):
+        ''' Save a workspace that must be released while overwritten (see must_release())
+        The workspace is written to a temporary file while the app keeps reading it, and only
+        released to be replaced: sequences not loaded yet can't be read for that short time.
+        '''
+        tmp = temp_file(job.output_file)
+        # Left over by an interrupted save (backends update existing output files)
+        _remove(tmp)
+        try:
+            backend.update_workspace_corrected(job.names, job.assoc, job.filename, tmp)
+            with job.workspace.released():
+                os.replace(tmp, job.output_file)
+        except BaseException:
+            _remove(tmp)
+            raise
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
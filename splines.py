@@ -0,0 +1,117 @@
+'''
+Batched cubic spline interpolation of anchor points into contours
+Same curves as scipy.interpolate.splprep(s=0, per=closed) followed by splev, i.e. parametric
+cubic interpolating splines over the normalized chord length: periodic splines for closed
+curves, not-a-knot splines for open curves. Curves with the same number of anchor points
+are interpolated together, with one batched linear solve for their spline moments.
+'''
+
+import numpy as np
+
+
+def chord_parameters(points):
+    ''' Normalized cumulative chord length of curves (splprep default parameter)
+    :param points: (B, m, 2) anchor points
+    :returns: (B, m) parameters, from 0 to 1
+    '''
+    chords = np.sqrt(np.sum(np.diff(points, axis=1)**2, axis=2))
+    u = np.concatenate([np.zeros((len(points), 1)), np.cumsum(chords, axis=1)], axis=1)
+    return u / u[:, -1:]
+
+
+def spline_moments(u, values, closed):
+    ''' Second derivatives at the knots of cubic interpolating splines
+    :param u: (B, m) knots (data sites)
+    :param values: (B, m, d) data values (for closed curves, last value equal to the first one)
+    :param closed: periodic splines if True, not-a-knot splines otherwise
+    :returns: (B, m, d) second derivatives
+    '''
+    nbr_curves, m = u.shape
+    h = np.diff(u, axis=1)
+    slopes = np.diff(values, axis=1) / h[:, :, None]
+    system = np.zeros((nbr_curves, m, m))
+    rhs = np.zeros(values.shape)
+    rows = np.arange(1, m-1)
+    # Continuity of first derivatives at interior knots
+    system[:, rows, rows-1] = h[:, :-1]
+    system[:, rows, rows] = 2 * (h[:, :-1] + h[:, 1:])
+    system[:, rows, rows+1] = h[:, 1:]
+    rhs[:, 1:-1] = 6 * (slopes[:, 1:] - slopes[:, :-1])
+    if closed:
+        # Same first and second derivatives at both ends
+        system[:, 0, [0, 1, m-2]] = np.stack([2 * (h[:, -1] + h[:, 0]), h[:, 0], h[:, -1]], axis=1)
+        rhs[:, 0] = 6 * (slopes[:, 0] - slopes[:, -1])
+        system[:, m-1, [0, m-1]] = [1, -1]
+    else:
+        # Not-a-knot: continuous third derivative at the second and second to last knots
+        system[:, 0, :3] = np.stack([h[:, 1], -(h[:, 0] + h[:, 1]), h[:, 0]], axis=1)
+        system[:, m-1, m-3:] = np.stack([h[:, -1], -(h[:, -2] + h[:, -1]), h[:, -2]], axis=1)
+    return np.linalg.solve(system, rhs)
+
+
+def evaluate_splines(u, values, moments, samples):
+    ''' Evaluate cubic splines given by their knots, values and second derivatives
+    :param samples: (S,) sorted parameters to evaluate at, in [0, 1]
+    :returns: (d, B, S) values
+    '''
+    nbr_curves, m = u.shape
+    # Polynomial coefficients of each segment, in powers of (t - segment start)
+    h = np.diff(u, axis=1)[:, :, None]
+    coefficients = np.stack([
+        values[:, :-1],
+        np.diff(values, axis=1) / h - h * (2 * moments[:, :-1] + moments[:, 1:]) / 6,
+        moments[:, :-1] / 2,
+        np.diff(moments, axis=1) / (6 * h),
+    ])
+    # Dimensions first, so that computations run along samples
+    coefficients = np.moveaxis(coefficients, 3, 1).reshape(4, -1, nbr_curves * (m-1))
+
+    # Segment of each sample, for each curve: number of interior knots below the sample,
+    # counted as steps (first sample above each knot) then cumulated along samples
+    steps = np.searchsorted(samples, u[:, 1:-1], 'left') + np.arange(nbr_curves)[:, None] * (len(samples) + 1)
+    steps = np.bincount(steps.ravel(), minlength=nbr_curves * (len(samples) + 1))
+    segment = np.cumsum(steps.reshape(nbr_curves, -1)[:, :-1], axis=1)
+    segment += np.arange(nbr_curves)[:, None] * (m-1)
+    c0, c1, c2, c3 = coefficients[:, :, segment]
+    t = samples[None, :] - u.ravel()[segment + segment // (m-1)]
+    # Horner scheme, in place
+    values = c3 * t
+    values += c2
+    values *= t
+    values += c1
+    values *= t
+    values += c0
+    return values
+
+
+def min_points(closed):
+    ''' Minimum number of anchor points of a curve
+    Cubic splines need more data points than their degree (as splprep), the first point
+    being repeated at the end of closed curves
+    '''
+    return 3 if closed else 4
+
+
+def interpolate_curves(curves, closed, nbr_samples=101):
+    ''' Interpolate anchor points of curves into contours
+    :param curves: list of (m, 2) anchor points arrays (m can differ between curves)
+    :param closed: closed (periodic) curves if True, open curves otherwise
+    :param nbr_samples: number of contour points, evenly spaced in the spline parameter
+    :returns: (nbr curves, 2, nbr_samples) contour coordinates
+    '''
+    samples = np.linspace(0, 1, nbr_samples)
+    contours = np.empty((len(curves), 2, nbr_samples))
+    groups = {}
+    for i, points in enumerate(curves):
+        groups.setdefault(len(points), []).append(i)
+    for m, indices in groups.items():
+        if m < min_points(closed):
+            raise ValueError('{} curves need at least {} anchor points ({} given).'.format(
+                'Closed' if closed else 'Open', min_points(closed), m))
+        points = np.array([curves[i] for i in indices], dtype=np.float64)
+        if closed:
+            points = np.concatenate([points, points[:, :1]], axis=1)
+        u = chord_parameters(points)
+        moments = spline_moments(u, points, closed)
+        contours[indices] = np.moveaxis(evaluate_splines(u, points, moments, samples), 0, 1)
+    return contours
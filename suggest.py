@@ -0,0 +1,259 @@
+'''
+Automatic ROI-to-slice match suggestions
+Every (ROI, slice) pair of a workspace is scored at once, as (nbr ROIs, nbr slices) matrices:
+    seq_index   overlap of the ROI SeqIndex (images it was drawn on) with the image indices of the slice
+    frames      same number of frames in the ROI ('Position') and in the slice cine sequences
+    protocol    slice ProtocolName hints (SA, LA, 2ch, 3ch, 4ch...) agreeing with the ROI type
+    edges       image gradient along the interpolated ROI contours, on the magnitude images of the slice
+The best scoring slice of each SA/LA ROI is suggested, with a slice category guessed from its
+protocol name. The app computes suggestions in the background on opening, with edge alignment scored on
+the slices already loaded or cached only, so that no image is decoded for them (see analysis.py), and the
+user accepts them one by one (see main.py), or they can be written as a batch.py corrections mapping:
+
+    python suggest.py DATASET_FOLDER [--output suggestions.csv] [--min-score 0.5] [--no-images]
+    python main.py suggest ...
+'''
+
+import re
+import sys
+import csv
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+import utils
+from workspace import Workspace, ROI_TYPES
+from batch import find_workspaces
+
+
+# Weight of each score in the total score (scores are in [0, 1])
+WEIGHTS = {'seq_index': 0.4, 'frames': 0.2, 'protocol': 0.15, 'edges': 0.25}
+# Suggestions below this total score are not made
+MIN_SCORE = 0.5
+# Frames compared for edge alignment (relative position in the cardiac cycle)
+EDGE_FRAMES = [0, 0.25, 0.5, 0.75]
+# Number of points of the interpolated contours used for edge alignment
+EDGE_SAMPLES = 64
+
+# Protocol name patterns of slice categories and orientations (case-insensitive)
+CATEGORY_PATTERNS = {
+    'base': r'bas(e|al)',
+    'mid': r'mid',
+    'apex': r'apex|apical',
+    '2ch': r'2\s*-?\s*ch|two\s*-?\s*ch',
+    '3ch': r'3\s*-?\s*ch|three\s*-?\s*ch|lvot',
+    '4ch': r'4\s*-?\s*ch|four\s*-?\s*ch',
+}
+ORIENTATION_PATTERNS = {
+    'SA': r'\bsa(x)?\b|short',
+    'LA': r'\bla(x)?\b|long|[234]\s*-?\s*ch|(two|three|four)\s*-?\s*ch|lvot',
+}
+# Orientation of each slice category
+CATEGORY_ORIENTATIONS = {'base': 'SA', 'mid': 'SA', 'apex': 'SA', '2ch': 'LA', '3ch': 'LA', '4ch': 'LA'}
+
+
+def protocol_category(protocol):
+    ''' Slice category hinted by a protocol name
+    :returns: one of workspace.SLICE_CATEGORIES, or '' if none (or several) match
+    '''
+    matches = [cat for cat, pattern in CATEGORY_PATTERNS.items() if re.search(pattern, str(protocol), re.IGNORECASE)]
+    return matches[0] if len(matches) == 1 else ''
+
+
+def protocol_orientation(protocol):
+    ''' Orientation ('SA' or 'LA') hinted by a protocol name, or None '''
+    category = protocol_category(protocol)
+    if category:
+        return CATEGORY_ORIENTATIONS[category]
+    matches = [o for o, pattern in ORIENTATION_PATTERNS.items() if re.search(pattern, str(protocol), re.IGNORECASE)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _indices(value):
+    ''' Image indices (int) of a SeqIndex-like value, NaNs removed '''
+    return [int(i) for i in np.atleast_1d(np.asarray(value, dtype=float).ravel()) if not np.isnan(i)]
+
+
+def _nbr_frames(positions):
+    return np.shape(positions)[0] if np.ndim(positions) else 0
+
+
+def header_scores(ws):
+    ''' Scores of all (ROI, slice) pairs from the workspace header (and sequence shapes)
+    :param ws: Workspace
+    :returns: dict score name -> (nbr ROIs, nbr slices) array, for 'seq_index', 'frames' and 'protocol'
+    '''
+    slices = ws.slice_indices()
+    rois = ws.rois
+    nbr_images = max([max(s) for s in slices] + [max(_indices(roi['SeqIndex']) or [0]) for roi in rois])
+
+    # Overlap of image indices, as one product of indicator matrices
+    slice_images = np.zeros((len(slices), nbr_images + 1))
+    for s, img_indices in enumerate(slices):
+        slice_images[s, img_indices] = 1
+    roi_images = np.zeros((len(rois), nbr_images + 1))
+    for r, roi in enumerate(rois):
+        roi_images[r, _indices(roi['SeqIndex'])] = 1
+    overlap = roi_images @ slice_images.T
+    seq_index = overlap / np.maximum(roi_images.sum(axis=1, keepdims=True), 1)
+
+    shapes = [ws.imgs.shape(img_indices[0]-1) for img_indices in slices]
+    slice_frames = np.array([shape[2] if len(shape) > 2 else 1 for shape in shapes])
+    roi_frames = np.array([_nbr_frames(roi['Position']) for roi in rois])
+    frames = (roi_frames[:, None] == slice_frames[None, :]).astype(float)
+
+    # 1 if the protocol orientation is the ROI type, 0 if it's the other one, 0.5 if unknown
+    slice_orientations = np.array([protocol_orientation(ws.metadata[img_indices[0]-1]) or '' for img_indices in slices])
+    roi_types = np.array([str(roi['Type']) for roi in rois])
+    protocol = np.where(slice_orientations[None, :] == '', 0.5,
+                        (slice_orientations[None, :] == roi_types[:, None]).astype(float))
+    return {'seq_index': seq_index, 'frames': frames, 'protocol': protocol}
+
+
+def gradient_maps(img, frames):
+    ''' Gradient magnitude of some frames of a magnitude sequence, normalized to a mean of 1
+    :param img: (H, W, T) magnitude sequence
+    :param frames: frame indices
+    :returns: (len(frames), H, W) float32 array
+    '''
+    images = np.moveaxis(np.asarray(img[:, :, frames], dtype=np.float32), 2, 0)
+    grad_y, grad_x = np.gradient(images, axis=(1, 2))
+    grad = np.hypot(grad_x, grad_y)
+    grad /= np.maximum(grad.mean(axis=(1, 2), keepdims=True), np.finfo(np.float32).tiny)
+    return grad
+
+
+def edge_scores(ws, roi_rows=None, loaded_only=False):
+    ''' Alignment of ROI contours with the image edges of each slice
+    Contours of a few frames of each ROI are sampled on the gradient maps of the same relative frames
+    of every slice: ratio r of the mean gradient along the contours to the mean gradient of the images,
+    as a score r / (1 + r) (0.5 if contours are not on edges more than anywhere else).
+    Slices with the same image shape are sampled together, for all ROIs at once.
+    :param ws: Workspace (magnitude sequences are read)
+    :param roi_rows: ROIs to score (default: SA/LA ROIs), others get 0.5
+    :param loaded_only: only score slices whose magnitude sequence is loaded or in the on-disk cache
+                        (see workspace.SequenceList.peek()), others get 0.5
+    :returns: (nbr ROIs, nbr slices) array
+    '''
+    slices = ws.slice_indices()
+    scores = np.full((len(ws.rois), len(slices)), 0.5)
+    if roi_rows is None:
+        roi_rows = [r for r, roi in enumerate(ws.rois) if roi['Type'] in ROI_TYPES and _nbr_frames(roi['Position'])]
+    if not roi_rows or not slices:
+        return scores
+
+    # Contour points of each ROI at the compared frames, (R, F, 2 (x, y), P)
+    points = []
+    for r in roi_rows:
+        roi = ws.rois[r]
+        positions = roi['Position']
+        frames = np.round(np.array(EDGE_FRAMES) * (_nbr_frames(positions) - 1)).astype(int)
+        contours = utils.roi_contours(roi['Type'], [positions[f] for f in frames], EDGE_SAMPLES // 2)
+        points.append(np.concatenate([contours[:, 0], contours[:, 1]], axis=2))
+    points = np.array(points)
+    # Frames without contours (missing anchor points) are left out of the scores
+    valid = np.isfinite(points).all(axis=2) # (R, F, P)
+    points = np.round(np.nan_to_num(points)).astype(np.int64)
+
+    groups = {}
+    for s, img_indices in enumerate(slices):
+        groups.setdefault(tuple(ws.imgs.shape(img_indices[0]-1)[:2]), []).append(s)
+    for (height, width), group in groups.items():
+        maps, scored = [], []
+        for s in group:
+            img = ws.imgs.peek(slices[s][0]-1) if loaded_only else ws.imgs[slices[s][0]-1]
+            if img is None:
+                continue
+            nbr_frames = img.shape[2] if img.ndim > 2 else 1
+            img = img.reshape(height, width, nbr_frames)
+            maps.append(gradient_maps(img, np.round(np.array(EDGE_FRAMES) * (nbr_frames - 1)).astype(int)))
+            scored.append(s)
+        if not scored:
+            continue
+        maps = np.array(maps) # (S, F, H, W)
+
+        # Points outside of the images count as no edge
+        x, y = points[:, :, 0], points[:, :, 1]
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        frame = np.arange(len(EDGE_FRAMES))[None, :, None]
+        values = maps[:, frame, np.clip(y, 0, height-1), np.clip(x, 0, width-1)] * inside * valid # (S, R, F, P)
+        # No contours at all: ratio 1, i.e. score 0.5
+        ratio = np.where(valid.any(axis=(1, 2)), values.sum(axis=(2, 3)) / np.maximum(valid.sum(axis=(1, 2)), 1), 1)
+        scores[np.ix_(roi_rows, scored)] = (ratio / (1 + ratio)).T
+    return scores
+
+
+def score_matrix(ws, images=True, loaded_only=False):
+    ''' All scores of all (ROI, slice) pairs of a workspace
+    :param ws: Workspace
+    :param images: also score edge alignment (reads the magnitude sequences), 0.5 otherwise
+    :param loaded_only: edge alignment of the slices already loaded or cached only (see edge_scores())
+    :returns: dict score name -> (nbr ROIs, nbr slices) array, with the weighted 'total'
+    '''
+    scores = header_scores(ws)
+    scores['edges'] = edge_scores(ws, loaded_only=loaded_only) if images else np.full(scores['frames'].shape, 0.5)
+    scores['total'] = sum(WEIGHTS[name] * scores[name] for name in WEIGHTS)
+    return scores
+
+
+def suggest(ws, images=True, min_score=MIN_SCORE, loaded_only=False):
+    ''' Suggested slice of each ROI
+    :param ws: Workspace
+    :param images: use edge alignment (see score_matrix())
+    :param min_score: minimum total score of a suggestion
+    :param loaded_only: edge alignment of the slices already loaded or cached only (see edge_scores())
+    :returns: list (one per ROI) of None or dict {'slice' (index), 'name' (slice category, '' if unknown),
+              'seq_index' (1-based image indices), 'score'}
+    '''
+    slices = ws.slice_indices()
+    suggestions = [None for _ in range(len(ws.rois))]
+    if not slices:
+        return suggestions
+    total = score_matrix(ws, images, loaded_only)['total']
+    best = np.argmax(total, axis=1)
+    for r, roi in enumerate(ws.rois):
+        if roi['Type'] not in ROI_TYPES or total[r, best[r]] < min_score:
+            continue
+        s = best[r]
+        name = protocol_category(ws.metadata[slices[s][0]-1])
+        # Category of the other orientation is not suggested
+        if name and CATEGORY_ORIENTATIONS[name] != roi['Type']:
+            name = ''
+        suggestions[r] = {'slice': int(s), 'name': name, 'seq_index': slices[s], 'score': round(float(total[r, s]), 3)}
+    return suggestions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Suggest the slice of each ROI of a dataset, as a batch.py corrections mapping')
+    parser.add_argument('folder', help='dataset folder (searched recursively)')
+    parser.add_argument('--output', help='output CSV file (default: standard output)')
+    parser.add_argument('--pattern', default='*.dns', help='workspace file pattern (default: *.dns)')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE, help='minimum score of a suggestion (default: {})'.format(MIN_SCORE))
+    parser.add_argument('--no-images', action='store_true', help='do not read images (no edge alignment score)')
+    args = parser.parse_args(argv)
+
+    f = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(f)
+        writer.writerow(['workspace', 'roi', 'name', 'seq_index', 'score'])
+        for path in find_workspaces(args.folder, args.pattern):
+            try:
+                with Workspace(str(path)) as ws:
+                    suggestions = suggest(ws, images=not args.no_images, min_score=args.min_score)
+            except Exception as err:
+                print('{}: {}: {}'.format(path, type(err).__name__, err), file=sys.stderr)
+                continue
+            for r, suggestion in enumerate(suggestions):
+                # Suggestions without slice category can't be applied as they are
+                if suggestion is not None and suggestion['name']:
+                    writer.writerow([Path(path).relative_to(args.folder).as_posix(), r + 1, suggestion['name'],
+                                     ' '.join(str(i) for i in suggestion['seq_index']), suggestion['score']])
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
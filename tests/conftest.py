@@ -0,0 +1,32 @@
+'''
+Shared fixtures: small synthetic workspaces (see benchmarks/synthetic.py)
+Run from the repository root: python -m pytest tests
+'''
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+import synthetic
+
+
+@pytest.fixture
+def workspace_file(tmp_path):
+    ''' Synthetic workspace (4 slices, 3 ROIs) '''
+    filename = str(tmp_path / 'ws.dns')
+    synthetic.make_workspace(filename, nbr_slices=4, size=32, frames=6, nbr_rois=3)
+    return filename
+
+
+@pytest.fixture
+def dataset_folder(tmp_path):
+    ''' Dataset of 5 corrected synthetic workspaces, in sub-folders '''
+    folder = tmp_path / 'dataset'
+    for i in range(5):
+        synthetic.make_workspace(str(folder / 'patient{}'.format(i // 2) / 'ws{}.dns'.format(i)),
+                                 nbr_slices=2, size=24, frames=4, nbr_rois=2, corrected=True, seed=i)
+    return str(folder)
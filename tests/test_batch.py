@@ -0,0 +1,76 @@
+'''
+Headless batch corrections (see batch.py)
+'''
+
+import json
+
+import pytest
+
+import synthetic
+from batch import read_corrections, apply_corrections, run_batch
+from workspace import Workspace, roi_corrections
+
+
+def test_read_corrections(tmp_path):
+    csv_file = tmp_path / 'corrections.csv'
+    csv_file.write_text('workspace,roi,name,seq_index\np1/ws.dns,1,mid,"5 6 7"\nws.dns,ROI 2,,\n')
+    json_file = tmp_path / 'corrections.json'
+    json_file.write_text(json.dumps({'p1/ws.dns': [{'roi': 1, 'name': 'mid', 'seq_index': [5, 6, 7]}],
+                                     'ws.dns': [{'roi': 'ROI 2', 'name': None, 'seq_index': None}]}))
+    for filename in [csv_file, json_file]:
+        corrections = read_corrections(str(filename))
+        assert corrections['p1/ws.dns'] == [{'roi': corrections['p1/ws.dns'][0]['roi'], 'name': 'mid', 'seq_index': [5, 6, 7]}]
+        assert str(corrections['p1/ws.dns'][0]['roi']) == '1'
+        assert corrections['ws.dns'] == [{'roi': 'ROI 2', 'name': '', 'seq_index': []}]
+
+
+def test_apply_corrections(workspace_file):
+    with Workspace(workspace_file) as ws:
+        names, assoc, warnings = apply_corrections(ws, [
+            {'roi': 1, 'name': 'mid', 'seq_index': [5, 6, 7]},
+            {'roi': 'ROI 3', 'name': 'apex', 'seq_index': [8, 9, 10, 11]},
+            {'roi': '3', 'name': '', 'seq_index': []},
+        ])
+        assert (names, assoc, warnings) == (['mid', '', ''], [[5, 6, 7], [], []], [])
+        invalid = [
+            {'roi': 4, 'name': 'mid', 'seq_index': [5, 6, 7]},             # no such ROI
+            {'roi': 'ROI 9', 'name': 'mid', 'seq_index': [5, 6, 7]},       # no such name
+            {'roi': 1, 'name': 'middle', 'seq_index': [5, 6, 7]},          # unknown category
+            {'roi': 1, 'name': 'mid', 'seq_index': [5, 6]},                # not a slice
+            {'roi': 1, 'name': 'mid', 'seq_index': []},                    # name without indices
+        ]
+        for correction in invalid:
+            with pytest.raises(ValueError):
+                apply_corrections(ws, [correction])
+
+
+@pytest.fixture
+def input_folder(tmp_path):
+    folder = tmp_path / 'input'
+    for name in ['a.dns', 'sub/b.dns']:
+        synthetic.make_workspace(str(folder / name), nbr_slices=3, size=16, frames=4, nbr_rois=2)
+    return folder
+
+
+def test_run_batch(input_folder, tmp_path):
+    output_folder = tmp_path / 'output'
+    corrections = {
+        'a.dns': [{'roi': 1, 'name': 'base', 'seq_index': [1, 2, 3, 4]}],
+        'sub/b.dns': [{'roi': 1, 'name': 'mid', 'seq_index': [9, 9]}],
+    }
+    results = run_batch(str(input_folder), str(output_folder), corrections, jobs=1)
+    # A failing workspace doesn't stop the batch
+    assert [(result['file'], result['status']) for result in results] == [
+        (str(input_folder / 'a.dns'), 'saved'), (str(input_folder / 'sub' / 'b.dns'), 'error')]
+    assert 'does not match any slice' in results[1]['message']
+    with Workspace(str(output_folder / 'a.dns')) as ws:
+        assert roi_corrections(ws.rois) == (['base', ''], [[1, 2, 3, 4], []])
+    assert not (output_folder / 'sub' / 'b.dns').exists()
+
+
+def test_dry_run(input_folder, tmp_path):
+    output_folder = tmp_path / 'output'
+    results = run_batch(str(input_folder), str(output_folder), {'b.dns': [{'roi': 2, 'name': 'mid', 'seq_index': [5, 6, 7]}]},
+                        jobs=1, dry_run=True)
+    assert [result['status'] for result in results] == ['validated', 'validated']
+    assert not output_folder.exists()
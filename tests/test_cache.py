@@ -0,0 +1,81 @@
+'''
+Memory-bounded caches (see cache.py)
+'''
+
+import numpy as np
+
+from cache import LRUCache, SequenceBudget
+from workspace import Workspace
+
+
+def test_lru_eviction():
+    cache = LRUCache(100)
+    for key in 'abc':
+        cache.put(key, key.upper(), 40)
+    # Least recently used entry evicted
+    assert 'a' not in cache and cache.nbytes == 80
+    assert cache.get('b') == 'B'
+    cache.put('d', 'D', 40)
+    assert 'c' not in cache and 'b' in cache and 'd' in cache
+    cache.set_max_bytes(40)
+    assert list(cache.entries) == ['d'] and cache.nbytes == 40
+    # Most recent entry kept, even above budget on its own
+    cache.put('e', 'E', 1000)
+    assert list(cache.entries) == ['e']
+
+
+def test_lru_discard():
+    cache = LRUCache(1000)
+    for key in [('a', 1), ('a', 2), ('b', 1)]:
+        cache.put(key, None, 10)
+    cache.discard(lambda key: key[0] == 'a')
+    assert list(cache.entries) == [('b', 1)] and cache.nbytes == 10
+    assert cache.get(('a', 1), 'missing') == 'missing'
+
+
+class Owner:
+    ''' Sequence owner (see workspace.SequenceList) recording its evicted sequences '''
+
+    def __init__(self):
+        self.evicted = []
+
+    def evict(self, k):
+        self.evicted.append(k)
+
+
+def test_sequence_budget_eviction():
+    budget = SequenceBudget(100)
+    a, b = Owner(), Owner()
+    budget.add(a, 0, 40)
+    budget.add(b, 0, 40)
+    budget.touch(a, 0)
+    # Least recently used sequence of any owner evicted
+    budget.add(b, 1, 40)
+    assert (a.evicted, b.evicted) == ([], [0]) and budget.nbytes == 80 and budget.evictions == 1
+    assert not budget.full()
+    budget.add(a, 1, 20)
+    assert budget.full()
+    budget.set_max_bytes(30)
+    assert a.evicted == [0] and b.evicted == [0, 1] and budget.nbytes == 20
+    # Most recent sequence kept, even above budget on its own
+    budget.add(b, 2, 50)
+    assert a.evicted == [0, 1] and budget.nbytes == 50 and budget.evictions == 4
+    budget.discard(b)
+    assert budget.nbytes == 0 and b.evicted == [0, 1]
+
+
+def test_sequence_budget_shared_by_workspaces(workspace_file):
+    with Workspace(workspace_file) as ws:
+        sequence = ws.imgs[0].nbytes
+    budget = SequenceBudget(2 * sequence)
+    with Workspace(workspace_file, budget) as first, Workspace(workspace_file, budget) as second:
+        first.imgs[0]
+        second.imgs[0]
+        first.imgs[0]
+        second.imgs[1]
+        # Evicted sequences are read again on access
+        assert list(first.imgs.loaded) == [0] and list(second.imgs.loaded) == [1]
+        np.testing.assert_array_equal(second.imgs[0], first.imgs[0])
+        assert len(first.imgs.loaded) + len(second.imgs.loaded) == 2
+    # Closed workspaces leave the budget
+    assert budget.nbytes == 0
@@ -0,0 +1,89 @@
+'''
+Dataset catalog (see catalog.py): statuses, queries and incremental rescans
+'''
+
+import os
+
+import pytest
+
+import synthetic
+from catalog import Catalog, STATUS_TODO, STATUS_PARTIAL, STATUS_DONE, STATUS_ERROR
+from workspace import update_workspace_corrected
+
+
+@pytest.fixture
+def catalog_folder(tmp_path):
+    ''' One workspace of each status '''
+    folder = tmp_path / 'dataset'
+    synthetic.make_workspace(str(folder / 'todo.dns'), nbr_slices=4, size=16, frames=4, nbr_rois=4)
+    synthetic.make_workspace(str(folder / 'p_1' / 'done.dns'), nbr_slices=2, size=16, frames=4, nbr_rois=2, corrected=True)
+    synthetic.make_workspace(str(folder / 'p1' / 'partial.dns'), nbr_slices=2, size=16, frames=4, nbr_rois=2)
+    update_workspace_corrected(['base', ''], [[1, 2, 3, 4], []], str(folder / 'p1' / 'partial.dns'),
+                               str(folder / 'p1' / 'partial.dns'))
+    (folder / 'broken.dns').write_bytes(b'not a workspace')
+    return folder
+
+
+def statuses(catalog):
+    return {row['path']: row['status'] for row in catalog.query()}
+
+
+def test_scan(catalog_folder):
+    with Catalog(catalog_folder) as catalog:
+        counts = catalog.scan(jobs=1)
+        assert counts == {'added': 4, 'updated': 0, 'removed': 0, 'unchanged': 0, 'errors': 1}
+        assert statuses(catalog) == {'broken.dns': STATUS_ERROR, 'p1/partial.dns': STATUS_PARTIAL,
+                                     'p_1/done.dns': STATUS_DONE, 'todo.dns': STATUS_TODO}
+        assert catalog.query(status=STATUS_ERROR)[0]['error']
+
+        row = catalog.query(text='todo')[0]
+        assert (row['nbr_sequences'], row['nbr_slices'], row['nbr_rois'], row['nbr_sa'], row['nbr_la']) == (14, 4, 4, 3, 1)
+        slices = catalog.slices('todo.dns')
+        assert [(s['mag_index'], s['pha_index'], s['nbr_frames'], s['height']) for s in slices[:2]] == [
+            (1, '[2, 3, 4]', 4, 16), (5, '[6, 7]', 4, 16)]
+        rois = catalog.rois('p1/partial.dns')
+        assert [(r['name'], r['type'], r['nbr_frames'], r['corrected_name'], r['corrected_seq_index']) for r in rois] == [
+            ('ROI 1', 'SA', 4, 'base', '[1, 2, 3, 4]'), ('ROI 2', 'SA', 4, '', '[]')]
+
+
+def test_queries(catalog_folder):
+    with Catalog(catalog_folder) as catalog:
+        catalog.scan(jobs=1)
+        paths = lambda rows: [row['path'] for row in rows]
+        assert paths(catalog.query(roi_type='LA')) == ['todo.dns']
+        assert paths(catalog.query(corrected_name='base')) == ['p1/partial.dns', 'p_1/done.dns']
+        assert paths(catalog.query(corrected_name='base', status=STATUS_DONE)) == ['p_1/done.dns']
+        # LIKE wildcards in the text are matched literally
+        assert paths(catalog.query(text='p_')) == ['p_1/done.dns']
+        summary = catalog.summary()
+        assert summary['workspaces'] == 4 and summary[STATUS_TODO] == 1
+        assert summary['rois'] == {'SA': 7, 'LA': 1} and summary['corrected'] == {'base': 2, 'mid': 1}
+
+
+def test_incremental_rescan(catalog_folder, tmp_path):
+    db_path = tmp_path / 'catalog.sqlite'
+    with Catalog(catalog_folder, db_path) as catalog:
+        catalog.scan(jobs=1)
+    partial = str(catalog_folder / 'p1' / 'partial.dns')
+    update_workspace_corrected(['base', 'mid'], [[1, 2, 3, 4], [5, 6, 7]], partial, partial)
+    os.remove(str(catalog_folder / 'todo.dns'))
+
+    # Reopened from its file: only changes are read again
+    with Catalog(catalog_folder, db_path) as catalog:
+        assert catalog.scan(jobs=1) == {'added': 0, 'updated': 1, 'removed': 1, 'unchanged': 2, 'errors': 0}
+        assert statuses(catalog) == {'broken.dns': STATUS_ERROR, 'p1/partial.dns': STATUS_DONE, 'p_1/done.dns': STATUS_DONE}
+        assert catalog.scan(jobs=1, force=True)['updated'] == 3
+
+
+def test_refresh(catalog_folder, tmp_path):
+    with Catalog(catalog_folder) as catalog:
+        catalog.scan(jobs=1)
+        partial = catalog.full_path('p1/partial.dns')
+        update_workspace_corrected(['', ''], [[], []], partial, partial)
+        catalog.refresh(partial)
+        assert statuses(catalog)['p1/partial.dns'] == STATUS_PARTIAL
+        assert [row['corrected_name'] for row in catalog.rois('p1/partial.dns')] == ['', '']
+        # Outside of the dataset: ignored
+        synthetic.make_workspace(str(tmp_path / 'other.dns'), nbr_slices=1, size=16, frames=4, nbr_rois=1)
+        catalog.refresh(str(tmp_path / 'other.dns'))
+        assert len(catalog.query()) == 4
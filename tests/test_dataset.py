@@ -0,0 +1,85 @@
+'''
+Streaming dataset (see dataset.py): shards split the dataset, shuffling only depends on seed and epoch
+'''
+
+import pytest
+
+from dataset import RoiDataset, worker_shard
+from workspace import SLICE_CATEGORIES
+
+
+def sample_ids(dataset):
+    ''' (workspace, ROI index, frame) of the samples of an iteration, in order '''
+    return [(info['workspace'], info['roi_index'], info.get('frame')) for _, _, _, info in dataset]
+
+
+def make_dataset(folder, **kwargs):
+    return RoiDataset(folder, with_info=True, **kwargs)
+
+
+def test_samples(dataset_folder):
+    dataset = make_dataset(dataset_folder, target='mask')
+    samples = list(dataset)
+    # 5 workspaces of 2 corrected ROIs
+    assert len(samples) == 10
+    images, masks, label, info = samples[0]
+    assert images.shape == (4, 4, 24, 24) and masks.shape == (4, 24, 24)
+    assert SLICE_CATEGORIES[label] == info['corrected_name']
+    # Workspaces read in path order, ROIs in order
+    assert sample_ids(dataset) == [(filename, roi, None) for filename in dataset.files for roi in range(2)]
+
+
+def test_frame_unit(dataset_folder):
+    samples = list(make_dataset(dataset_folder, unit='frame'))
+    assert len(samples) == 10 * 4
+    images, contours, _, info = samples[1]
+    assert images.shape == (4, 24, 24) and contours.shape == (2, 2, 101) and info['frame'] == 1
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_shards_cover_dataset(dataset_folder, shuffle):
+    everything = sample_ids(make_dataset(dataset_folder, shuffle=shuffle, seed=3))
+    shards = [sample_ids(make_dataset(dataset_folder, shuffle=shuffle, seed=3, shard=(index, 3))) for index in range(3)]
+    assert all(shards)
+    assert sorted(sum(shards, [])) == sorted(everything)
+    # Workspaces are not split between shards
+    workspaces = [{sample[0] for sample in shard} for shard in shards]
+    assert sum(len(files) for files in workspaces) == len(set.union(*workspaces)) == 5
+
+
+def test_shuffle_determinism(dataset_folder):
+    reference = sample_ids(make_dataset(dataset_folder, unit='frame', shuffle=True, seed=1))
+    # Read ahead or not, and whatever the shuffle buffer size
+    assert sample_ids(make_dataset(dataset_folder, unit='frame', shuffle=True, seed=1, read_ahead=0)) == reference
+    assert sample_ids(make_dataset(dataset_folder, unit='frame', shuffle=True, seed=1, read_ahead=4)) == reference
+    small_buffer = sample_ids(make_dataset(dataset_folder, unit='frame', shuffle=True, seed=1, shuffle_buffer=1))
+    assert sorted(small_buffer) == sorted(reference)
+
+    dataset = make_dataset(dataset_folder, unit='frame', shuffle=True, seed=1)
+    dataset.set_epoch(1)
+    other_epoch = sample_ids(dataset)
+    assert other_epoch != reference and sorted(other_epoch) == sorted(reference)
+    dataset.set_epoch(0)
+    assert sample_ids(dataset) == reference
+    assert sample_ids(make_dataset(dataset_folder, unit='frame', shuffle=True, seed=2)) != reference
+
+
+def test_early_stop(dataset_folder):
+    dataset = make_dataset(dataset_folder, read_ahead=1)
+    iterator = iter(dataset)
+    next(iterator)
+    # Stops the read-ahead thread
+    iterator.close()
+    assert len(list(dataset)) == 10
+
+
+def test_worker_shard():
+    assert worker_shard() == (0, 1)
+    assert worker_shard((2, 4)) == (2, 4)
+
+
+def test_invalid_arguments(dataset_folder):
+    with pytest.raises(ValueError):
+        RoiDataset(dataset_folder, unit='slice')
+    with pytest.raises(ValueError):
+        RoiDataset(dataset_folder, target='labels')
@@ -0,0 +1,61 @@
+'''
+Training set export (see export.py): shards and manifest, resumable runs
+'''
+
+import os
+
+import numpy as np
+
+import utils
+from export import run_export, load_sample, workspace_key
+from workspace import Workspace
+
+
+def run(dataset_folder, output_folder, **kwargs):
+    done = []
+    manifest = run_export(dataset_folder, output_folder, jobs=1,
+                          progress=lambda count, total, part: done.append(part['workspace']), **kwargs)
+    return manifest, done
+
+
+def test_export(dataset_folder, tmp_path):
+    output_folder = str(tmp_path / 'export')
+    manifest, done = run(dataset_folder, output_folder)
+    # 5 workspaces of 2 corrected ROIs
+    assert len(done) == 5 and len(manifest['samples']) == 10 and manifest['errors'] == {}
+
+    sample = manifest['samples'][1]
+    assert sample['workspace'] == 'patient0/ws0.dns' and sample['corrected_name'] == 'mid'
+    assert sample['channels'] == ['mag', 'pha_x', 'pha_y'] and sample['offset'] == 4
+    assert sample['images'] == 'shards/{}_24x24_images.npy'.format(workspace_key('patient0/ws0.dns'))
+    images, contours, roi_masks = load_sample(output_folder, sample)
+    assert images.shape == (4, 4, 24, 24) and contours.shape == (4, 2, 2, 101) and roi_masks.dtype == np.uint8
+    with Workspace(os.path.join(dataset_folder, sample['workspace'])) as ws:
+        roi = ws.rois[sample['roi_index']]
+        for c, idx in enumerate(sample['corrected_seq_index']):
+            np.testing.assert_array_equal(images[:, c], np.moveaxis(ws.imgs[idx-1], 2, 0).astype(np.float32))
+        np.testing.assert_allclose(contours, utils.roi_contours(roi['Type'], roi['Position']), rtol=1e-6)
+    # Missing z phase filled with zeros
+    assert not images[:, 3].any() and roi_masks.any()
+
+
+def test_resume(dataset_folder, tmp_path):
+    output_folder = str(tmp_path / 'export')
+    reference, _ = run(dataset_folder, output_folder)
+    manifest, done = run(dataset_folder, output_folder)
+    assert done == [] and manifest == reference
+
+    # Only modified workspaces are exported again
+    os.utime(os.path.join(dataset_folder, 'patient1', 'ws2.dns'))
+    manifest, done = run(dataset_folder, output_folder)
+    assert done == ['patient1/ws2.dns'] and manifest['samples'] == reference['samples']
+    # Or all of them, with other settings
+    manifest, done = run(dataset_folder, output_folder, mask_supersample=2)
+    assert len(done) == 5 and load_sample(output_folder, manifest['samples'][0])[2].dtype == np.float32
+
+
+def test_errors(dataset_folder, tmp_path):
+    with open(os.path.join(dataset_folder, 'broken.dns'), 'wb') as f:
+        f.write(b'not a workspace')
+    manifest, _ = run(dataset_folder, str(tmp_path / 'export'))
+    assert list(manifest['errors']) == ['broken.dns'] and len(manifest['samples']) == 10
@@ -0,0 +1,72 @@
+'''
+On-disk image cache (see imgcache.py): lossless compaction, invalidation, pruning
+'''
+
+import os
+
+import numpy as np
+
+from imgcache import ImageCache, compact_array, run_warm
+from workspace import Workspace, update_workspace_corrected
+
+
+def test_compact_array():
+    integers = np.array([[0, 255], [3, 7]], dtype=np.float64)
+    assert compact_array(integers).dtype == np.uint8
+    assert compact_array(integers - 300).dtype == np.int16
+    assert compact_array(np.array([0.5, 1.25])).dtype == np.float32
+    assert compact_array(np.array([np.nan, 1.0])).dtype == np.float32
+    # Kept as they are when no smaller type holds the values exactly
+    for img in [np.array([0.1, 1]), np.array([np.nan, 0.1]), np.array([2.0**40]), np.array(['a'])]:
+        assert compact_array(img) is img
+    assert compact_array(np.array([1, 2], dtype=np.uint8)).dtype == np.uint8
+    for img in [integers, integers - 300, np.array([0.5, 1.25])]:
+        np.testing.assert_array_equal(compact_array(img), img)
+
+
+def test_cached_sequences(workspace_file, tmp_path):
+    cache = ImageCache(tmp_path / 'cache')
+    with Workspace(workspace_file) as ws:
+        reference = [np.array(ws.imgs[k]) for k in range(len(ws.imgs))]
+    with Workspace(workspace_file, image_cache=cache) as ws:
+        first = ws.imgs[0]
+        assert ws.imgs.cache.exists(0) and not ws.imgs.cache.exists(1)
+    # Read back memory-mapped, same values
+    with Workspace(workspace_file, image_cache=cache) as ws:
+        assert isinstance(ws.imgs[0], np.memmap)
+        np.testing.assert_array_equal(ws.imgs[0], reference[0])
+    np.testing.assert_array_equal(first, reference[0])
+
+
+def test_invalidated_on_change(workspace_file, tmp_path):
+    cache = ImageCache(tmp_path / 'cache')
+    with Workspace(workspace_file, image_cache=cache) as ws:
+        ws.imgs[0]
+    update_workspace_corrected(['base', '', ''], [[1, 2, 3, 4], [], []], workspace_file, workspace_file)
+    # Emptied when the workspace changed
+    entry = cache.entry(workspace_file)
+    assert not entry.exists(0)
+    entry.store(0, np.zeros((2, 2)))
+    # Corrupted cached sequence: read from the workspace again
+    with open(entry.path(1), 'wb') as f:
+        f.write(b'not an array')
+    with Workspace(workspace_file, image_cache=cache) as ws:
+        assert ws.imgs.cache.exists(0)
+        assert ws.imgs.cache.load(1) is None
+
+
+def test_warm_and_prune(dataset_folder, tmp_path):
+    cache = ImageCache(tmp_path / 'cache')
+    results = run_warm(dataset_folder, cache.folder, jobs=1)
+    assert len(results) == 5 and all(result['error'] is None and result['cached'] == result['sequences'] for result in results)
+    assert [result['cached'] for result in run_warm(dataset_folder, cache.folder, jobs=1)] == [0] * 5
+    nbytes = cache.nbytes()
+    assert nbytes > 0
+
+    # Entries of changed or deleted workspaces are removed
+    os.remove(results[0]['file'])
+    with open(results[1]['file'], 'ab') as f:
+        f.write(b'\0' * 8)
+    assert cache.prune() == 2
+    assert len(os.listdir(cache.folder)) == 3 and cache.nbytes() < nbytes
+    assert cache.prune() == 0
@@ -0,0 +1,80 @@
+'''
+Correction journals (see journal.py): records, their replay over a workspace, and compaction
+'''
+
+import json
+
+import numpy as np
+import pytest
+
+import backends
+from workspace import Workspace, roi_corrections, update_workspace_corrected
+from journal import Journal, read_journal, journal_corrections, replay, compact, journal_path
+
+
+def test_records_are_typed(workspace_file):
+    journal = Journal(workspace_file)
+    journal.apply(np.int64(1), 'mid', np.array([5, 6, 7]))
+    journal.delete(np.int64(0))
+    journal.delete_all()
+    journal.close()
+    records = read_journal(journal_path(workspace_file))
+    assert [record['op'] for record in records] == ['apply', 'delete', 'delete_all']
+    assert records[0]['roi'] == 1 and records[0]['seq_index'] == [5, 6, 7]
+    with pytest.raises(ValueError):
+        journal.append('rename', roi=0)
+
+
+def test_cut_line_is_ignored(workspace_file):
+    journal = Journal(workspace_file)
+    journal.apply(0, 'base', [1, 2, 3, 4])
+    journal.close()
+    with open(journal_path(workspace_file), 'ab') as f:
+        f.write(json.dumps({'op': 'delete', 'roi': 0}).encode()[:10])
+    assert [record['op'] for record in read_journal(journal_path(workspace_file))] == ['apply']
+    assert read_journal(journal_path(workspace_file) + '.missing') == []
+
+
+def test_journal_corrections():
+    rois = np.array([('SA',), ('LA',), ('other',)], dtype=[('Type', object)])
+    records = [
+        {'op': 'apply', 'roi': 0, 'name': 'mid', 'seq_index': [5, 6, 7]},
+        {'op': 'delete', 'roi': 1},
+        {'op': 'delete_all'},
+    ]
+    assert journal_corrections(records, rois) == [
+        {'roi': 1, 'name': 'mid', 'seq_index': [5, 6, 7]},
+        {'roi': 2, 'name': '', 'seq_index': []},
+        # Only ROIs that can be corrected
+        {'roi': 1, 'name': '', 'seq_index': []},
+        {'roi': 2, 'name': '', 'seq_index': []},
+    ]
+
+
+def test_replay(workspace_file):
+    update_workspace_corrected(['base', 'mid', ''], [[1, 2, 3, 4], [5, 6, 7], []], workspace_file, workspace_file)
+    records = [
+        {'op': 'apply', 'roi': 2, 'name': 'apex', 'seq_index': [8, 9, 10, 11]},
+        {'op': 'delete', 'roi': 0},
+        {'op': 'apply', 'roi': 1, 'name': 'apex', 'seq_index': [8, 9, 10, 11]},
+    ]
+    with Workspace(workspace_file) as ws:
+        # Replayed over the corrections saved in the workspace, in order
+        assert replay(ws, records) == (['', 'apex', 'apex'], [[], [8, 9, 10, 11], [8, 9, 10, 11]])
+        assert replay(ws, records + [{'op': 'delete_all'}]) == (['', '', ''], [[], [], []])
+        assert replay(ws, []) == roi_corrections(ws.rois)
+        with pytest.raises(ValueError):
+            replay(ws, [{'op': 'apply', 'roi': 10, 'name': 'mid', 'seq_index': [5, 6, 7]}])
+
+
+def test_compact(workspace_file):
+    journal = Journal(workspace_file)
+    journal.apply(0, 'base', [1, 2, 3, 4])
+    journal.apply(1, 'mid', [5, 6, 7])
+    journal.delete(1)
+    journal.close()
+    results = compact([(workspace_file, workspace_file)], backends.NativeBackend())
+    assert [result['status'] for result in results] == ['saved']
+    assert not Journal(workspace_file).exists()
+    with Workspace(workspace_file) as ws:
+        assert roi_corrections(ws.rois) == (['base', '', ''], [[1, 2, 3, 4], [], []])
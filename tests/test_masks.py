@@ -0,0 +1,59 @@
+'''
+Contour rasterization (see masks.py)
+'''
+
+import numpy as np
+
+import masks
+
+
+def circle(center, radius, nbr_points=400):
+    angles = np.linspace(0, 2 * np.pi, nbr_points, endpoint=False)
+    return np.stack([center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles)])
+
+
+def ring_contours(center=(31.5, 29.5), endo=8.0, epi=16.0):
+    ''' One frame of short-axis contours (1, 2, 2, n) '''
+    return np.array([[circle(center, endo), circle(center, epi)]])
+
+
+def test_short_axis_ring():
+    center, endo, epi = (31.5, 29.5), 8.0, 16.0
+    mask = masks.roi_masks(ring_contours(center, endo, epi), 'SA', (64, 64))[0]
+    rows, cols = np.mgrid[:64, :64]
+    distance = np.hypot(cols - center[0], rows - center[1])
+    # Pixel centers clearly inside or outside the ring
+    assert mask[(distance > endo + 0.5) & (distance < epi - 0.5)].all()
+    assert not mask[(distance < endo - 0.5) | (distance > epi + 0.5)].any()
+
+
+def test_coverage():
+    endo, epi = 8.0, 16.0
+    coverage = masks.roi_masks(ring_contours(endo=endo, epi=epi), 'SA', (64, 64), supersample=8)[0]
+    assert coverage.dtype == np.float32 and coverage.min() >= 0 and coverage.max() <= 1
+    assert abs(coverage.sum() / (np.pi * (epi**2 - endo**2)) - 1) < 0.01
+
+
+def test_output_shape():
+    # Twice the resolution: four times the area
+    mask = masks.roi_masks(ring_contours(), 'SA', (64, 64))[0]
+    large = masks.roi_masks(ring_contours(), 'SA', (64, 64), out_shape=(128, 128))[0]
+    assert large.shape == (128, 128)
+    assert abs(large.sum() / (4 * mask.sum()) - 1) < 0.02
+
+
+def test_long_axis_closed_contour():
+    # Epi then endo running back: a band between two arcs
+    angles = np.linspace(0, np.pi, 50)
+    epi = np.stack([32 + 20 * np.cos(angles), 10 + 20 * np.sin(angles)])
+    endo = np.stack([32 + 10 * np.cos(angles[::-1]), 10 + 10 * np.sin(angles[::-1])])
+    mask = masks.roi_masks(np.array([[endo, epi]]), 'LA', (64, 64))[0]
+    assert mask[25, 32] and not mask[15, 32] and not mask[35, 32]
+
+
+def test_frame_without_contours():
+    contours = np.concatenate([ring_contours(), np.full((1, 2, 2, 400), np.nan), ring_contours()])
+    for supersample in [1, 4]:
+        frames = masks.roi_masks(contours, 'SA', (64, 64), supersample)
+        assert not frames[1].any()
+        np.testing.assert_array_equal(frames[0], frames[2])
@@ -0,0 +1,145 @@
+'''
+MAT v5 writer (see matfile.py): corrections saved without Matlab read back with scipy and the app,
+and an interrupted save never leaves a partial workspace
+'''
+
+import os
+import struct
+
+import numpy as np
+import pytest
+from scipy.io import loadmat
+
+import synthetic
+import matfile
+from workspace import Workspace, update_workspace_corrected, roi_corrections
+
+
+NAMES = ['mid', '', 'base']
+ASSOC = [[5, 6, 7], [], [1, 2, 3, 4]]
+
+
+def assert_same(after, before):
+    ''' Equal values, cell arrays (object arrays) compared element-wise '''
+    assert after.shape == before.shape
+    if before.dtype == object:
+        for a, b in zip(after.ravel(), before.ravel()):
+            assert_same(a, b)
+    else:
+        np.testing.assert_array_equal(after, before)
+
+
+def corrected_fields(filename):
+    roi = loadmat(filename)['roi'][0]
+    names = [str(value[0]) if value.size else '' for value in roi['CorrectedNames']]
+    assoc = [value.ravel().tolist() for value in roi['CorrectedSeqIndex']]
+    return names, assoc
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_round_trip(tmp_path, compress):
+    in_file, out_file = str(tmp_path / 'in.dns'), str(tmp_path / 'out.dns')
+    synthetic.make_workspace(in_file, nbr_slices=4, size=32, frames=6, nbr_rois=3, compress=compress)
+    update_workspace_corrected(NAMES, ASSOC, in_file, out_file)
+
+    assert corrected_fields(out_file) == (NAMES, ASSOC)
+    source, saved = loadmat(in_file), loadmat(out_file)
+    for k in range(source['img'].shape[1]):
+        np.testing.assert_array_equal(saved['img'][0, k], source['img'][0, k])
+    for field in ['Name', 'Type', 'SeqIndex', 'Position']:
+        for before, after in zip(source['roi'][0][field], saved['roi'][0][field]):
+            assert_same(after, before)
+    with Workspace(out_file) as ws:
+        assert roi_corrections(ws.rois) == (NAMES, ASSOC)
+
+
+def test_later_updates_in_place(workspace_file):
+    with Workspace(workspace_file) as ws:
+        first = np.array(ws.imgs[0])
+        # 'roi' is the last variable: only it is written, in the same file
+        inode = os.stat(workspace_file).st_ino
+        update_workspace_corrected(['apex', '', ''], [[8], [], []], workspace_file, workspace_file)
+        update_workspace_corrected(NAMES, ASSOC, workspace_file, workspace_file)
+        assert os.stat(workspace_file).st_ino == inode
+        # Open workspace still reads its images
+        np.testing.assert_array_equal(ws.imgs[0], first)
+        np.testing.assert_array_equal(ws.imgs[len(ws.imgs) - 1], loadmat(workspace_file)['img'][0, -1])
+
+    assert corrected_fields(workspace_file) == (NAMES, ASSOC)
+    assert os.listdir(os.path.dirname(workspace_file)) == ['ws.dns']
+
+
+def test_rewrite_moves_variable_last(workspace_file):
+    # Variable added after 'roi'
+    extra = matfile.compress_element(matfile.pack_matrix(matfile.MX_DOUBLE_CLASS, (1, 1), matfile.MI_DOUBLE,
+                                                         np.float64(7).tobytes(), name='extra'))
+    matfile.replace_variable(workspace_file, 'extra', extra)
+    update_workspace_corrected(NAMES, ASSOC, workspace_file, workspace_file)
+    index = matfile.MatV5Index(workspace_file)
+    try:
+        assert max(index.variables, key=lambda name: index.variables[name][0]) == 'roi'
+    finally:
+        index.close()
+    saved = loadmat(workspace_file)
+    assert saved['extra'][0, 0] == 7
+    assert corrected_fields(workspace_file) == (NAMES, ASSOC)
+
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def test_failed_rewrite_keeps_workspace(workspace_file, monkeypatch):
+    extra = matfile.compress_element(matfile.pack_matrix(matfile.MX_DOUBLE_CLASS, (1, 1), matfile.MI_DOUBLE,
+                                                         np.float64(7).tobytes(), name='extra'))
+    matfile.replace_variable(workspace_file, 'extra', extra)
+    before = read_bytes(workspace_file)
+
+    def full_disk(*args):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(matfile.os, 'replace', full_disk)
+    with pytest.raises(OSError):
+        update_workspace_corrected(NAMES, ASSOC, workspace_file, workspace_file)
+    assert read_bytes(workspace_file) == before
+    assert os.listdir(os.path.dirname(workspace_file)) == ['ws.dns']
+
+
+def test_failed_update_in_place_is_rolled_back(workspace_file, monkeypatch):
+    update_workspace_corrected(NAMES, ASSOC, workspace_file, workspace_file)
+    before = read_bytes(workspace_file)
+    write_at = matfile._write_at
+
+    def full_disk(f, pos, data):
+        # Half written, then the disk is full
+        if data != before[pos:]:
+            f.seek(pos)
+            f.write(data[:len(data) // 2])
+            raise OSError(28, 'No space left on device')
+        write_at(f, pos, data)
+
+    monkeypatch.setattr(matfile, '_write_at', full_disk)
+    with pytest.raises(OSError):
+        update_workspace_corrected(['base', 'base', 'base'], [[1, 2, 3, 4]] * 3, workspace_file, workspace_file)
+    assert read_bytes(workspace_file) == before
+    assert os.listdir(os.path.dirname(workspace_file)) == ['ws.dns']
+
+
+def test_crashed_update_is_recovered(workspace_file):
+    update_workspace_corrected(NAMES, ASSOC, workspace_file, workspace_file)
+    before = read_bytes(workspace_file)
+    index = matfile.MatV5Index(workspace_file)
+    pos = index.variables['roi'][0]
+    index.close()
+    # Crash after the undo record was written, while the variable was being written
+    matfile._sync_write(workspace_file + matfile.UNDO_SUFFIX, struct.pack('<Q', pos) + before[pos:])
+    with open(workspace_file, 'r+b') as f:
+        f.seek(pos + 16)
+        f.write(b'\xff' * 64)
+        f.truncate()
+
+    with Workspace(workspace_file) as ws:
+        assert roi_corrections(ws.rois) == (NAMES, ASSOC)
+    assert read_bytes(workspace_file) == before
+    assert not os.path.exists(workspace_file + matfile.UNDO_SUFFIX)
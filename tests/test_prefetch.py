@@ -0,0 +1,107 @@
+'''
+Background workspace prefetching (see prefetch.py)
+'''
+
+import os
+import time
+
+import pytest
+
+import synthetic
+from cache import SequenceBudget
+from prefetch import WorkspacePrefetcher
+from workspace import Workspace
+
+
+@pytest.fixture
+def workspace_files(tmp_path):
+    filenames = [str(tmp_path / 'ws{}.dns'.format(i)) for i in range(2)]
+    for i, filename in enumerate(filenames):
+        synthetic.make_workspace(filename, nbr_slices=3, size=16, frames=4, nbr_rois=2, seed=i)
+    return filenames
+
+
+@pytest.fixture
+def make_prefetcher():
+    prefetchers = []
+
+    def make(*args, **kwargs):
+        prefetchers.append(WorkspacePrefetcher(*args, **kwargs))
+        return prefetchers[-1]
+    yield make
+    for prefetcher in prefetchers:
+        prefetcher.update([])
+
+
+def wait_idle(prefetcher, timeout=10):
+    ''' Wait until the background thread has nothing left to do '''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with prefetcher.condition:
+            if prefetcher._next_task() is None and prefetcher.opening is None:
+                return
+        time.sleep(0.01)
+    raise TimeoutError('prefetcher still busy')
+
+
+def all_loaded(ws):
+    return all(idx-1 in ws.imgs.loaded for indices in ws.slice_indices() for idx in indices)
+
+
+def test_prefetch_targets(workspace_files, make_prefetcher):
+    prefetcher = make_prefetcher(2**30)
+    prefetcher.update(workspace_files)
+    wait_idle(prefetcher)
+    assert sorted(prefetcher.workspaces) == sorted(workspace_files)
+    ws = prefetcher.take(workspace_files[0])
+    try:
+        assert ws.filename == workspace_files[0] and all_loaded(ws)
+    finally:
+        ws.close()
+    # Taken workspaces are not targets anymore
+    assert workspace_files[0] not in prefetcher.targets and prefetcher.take(workspace_files[0]) is None
+    prefetcher.update([])
+    assert prefetcher.workspaces == {}
+
+
+def test_memory_cap(workspace_files, make_prefetcher):
+    prefetcher = make_prefetcher(1)
+    prefetcher.update(workspace_files)
+    wait_idle(prefetcher)
+    # Workspaces opened, a single sequence decoded: the first one of the first target
+    first, second = (prefetcher.workspaces[filename][0] for filename in workspace_files)
+    assert list(first.imgs.loaded) == [first.slice_indices()[0][0] - 1] and not second.imgs.loaded
+    prefetcher.set_max_bytes(2**30)
+    wait_idle(prefetcher)
+    assert all_loaded(first) and all_loaded(second)
+
+
+def test_shared_budget_is_not_evicted(workspace_files, make_prefetcher):
+    with Workspace(workspace_files[0]) as ws:
+        sequence = ws.imgs[0].nbytes
+    # Room for 2 sequences: decoding stops once the budget is full
+    budget = SequenceBudget(2 * sequence)
+    prefetcher = make_prefetcher(2**30, budget)
+    prefetcher.update(workspace_files)
+    wait_idle(prefetcher)
+    assert budget.full() and budget.evictions == 0
+    assert sum(len(ws.imgs.loaded) for ws, _ in prefetcher.workspaces.values()) == 2
+
+
+def test_modified_workspace_is_not_taken(workspace_files, make_prefetcher):
+    prefetcher = make_prefetcher(2**30)
+    prefetcher.update(workspace_files)
+    wait_idle(prefetcher)
+    stat = os.stat(workspace_files[0])
+    os.utime(workspace_files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert prefetcher.take(workspace_files[0]) is None
+
+
+def test_give(workspace_files, make_prefetcher):
+    prefetcher = make_prefetcher(1)
+    prefetcher.update(workspace_files[1:])
+    wait_idle(prefetcher)
+    ws = Workspace(workspace_files[0])
+    # Not a target: closed
+    prefetcher.give(ws)
+    assert workspace_files[0] not in prefetcher.workspaces and ws.closed
@@ -0,0 +1,77 @@
+'''
+Contour QC metrics and flags (see qc.py)
+'''
+
+import csv
+
+import numpy as np
+
+import qc
+from workspace import Workspace
+
+
+def circle(radius, center=(40.0, 40.0), nbr_points=qc.QC_SAMPLES):
+    # Periodic contours end on their first point (see utils.roi_contours())
+    angles = np.linspace(0, 2 * np.pi, nbr_points)
+    return np.stack([center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles)])
+
+
+def ring(endo=8.0, epi=16.0, nbr_frames=3):
+    return np.array([[circle(endo), circle(epi)]] * nbr_frames)
+
+
+def test_ring_metrics():
+    metrics = qc.frame_metrics(ring(), 'SA')
+    np.testing.assert_allclose(metrics['area'], np.pi * (16**2 - 8**2), rtol=0.02)
+    np.testing.assert_allclose(metrics['endo_perimeter'], 2 * np.pi * 8, rtol=0.01)
+    np.testing.assert_allclose(metrics['thickness_median'], 8, rtol=0.01)
+    np.testing.assert_allclose(metrics['centroid_x'], 40, atol=1e-9)
+    assert not metrics['self_intersection'].any() and not metrics['crossing'].any() and not metrics['inverted'].any()
+    assert qc.roi_summary(metrics)['flags'] == {}
+
+
+def test_flags():
+    contours = ring(nbr_frames=6)
+    # Endo and epi swapped on frame 2, endo crossing epi on frame 4, twisted epi on frame 5
+    contours[1] = contours[1, ::-1]
+    contours[3, 0] = circle(8.0, center=(48.0, 40.0))
+    epi = contours[4, 1]
+    epi[:, 10:14] = epi[:, 13:9:-1]
+    flags = qc.roi_summary(qc.frame_metrics(contours, 'SA'))['flags']
+    assert flags['endo outside epi'] == [2]
+    assert 4 in flags['endo/epi crossing'] and 4 in flags['thin wall']
+    assert flags['self-intersection'] == [5]
+    assert flags['area jump'] == [2, 3]
+    assert qc.flags_text({'thin wall': [3, 4, 5, 9]}) == 'thin wall (frames 3-5, 9)'
+
+
+def test_workspace_qc(workspace_file):
+    with Workspace(workspace_file) as ws:
+        results = qc.workspace_qc(ws.rois)
+        assert [result['frames'] for result in results] == [6, 6, 6]
+        assert all('error' not in result for result in results)
+        # ROI with an empty frame is reported, others are still measured
+        positions = ws.rois[1]['Position']
+        positions[2, 0], positions[2, 1] = np.empty((0, 0)), np.empty((0, 0))
+        results = qc.workspace_qc(ws.rois)
+    assert 'error' in results[1] and 'error' not in results[0] and 'error' not in results[2]
+
+
+def test_report(dataset_folder, tmp_path):
+    with open(str(tmp_path / 'broken.dns'), 'wb') as f:
+        f.write(b'not a workspace')
+    results = qc.run_qc(dataset_folder, jobs=1)
+    assert len(results) == 5 and all(result['error'] is None and len(result['rois']) == 2 for result in results)
+    assert results[0]['rois'][0]['roi'] == 1 and results[0]['rois'][0]['type'] == 'SA'
+
+    results += [qc.qc_workspace(str(tmp_path / 'broken.dns'))]
+    report = str(tmp_path / 'report.csv')
+    qc.write_report(results, report, flagged_only=True)
+    with open(report, newline='') as f:
+        rows = list(csv.DictReader(f))
+    flagged = [roi for result in results for roi in result['rois'] if roi['flags']]
+    assert len(rows) == len(flagged) + 1 and all(row['flags'] for row in rows)
+    assert rows[-1]['flags'].startswith('error: ')
+    qc.write_report(results[:1], report, folder=dataset_folder)
+    with open(report, newline='') as f:
+        assert [row['workspace'] for row in csv.DictReader(f)] == ['patient0/ws0.dns'] * 2
@@ -0,0 +1,117 @@
+'''
+Frame preparation (see render.py): display cubes, frame data and their size in a render cache,
+and the region a ROI is zoomed on
+'''
+
+import gc
+
+import numpy as np
+
+from cache import LRUCache
+from render import DisplayCube, FrameBuilder, prepare_frame, display_window, crop_box, CROP_MIN_SIZE
+from workspace import Workspace
+
+
+def test_display_cube():
+    img = np.random.default_rng(0).normal(100, 10, size=(32, 24, 5))
+    cube = DisplayCube(img, (1, 99))
+    assert len(cube) == 5 and cube.frame(2).shape == (32, 24) and cube.frame(2).dtype == np.uint8
+    # Same window for the whole cine
+    vmin, vmax = display_window(img, (1, 99))
+    expected = np.clip((img[:, :, 2] - vmin) * (255 / (vmax - vmin)), 0, 255).astype(np.uint8)
+    np.testing.assert_array_equal(cube.frame(2), expected)
+    # Frames are views
+    assert cube.frame(2).base is not None
+    cube.add_downsampled()
+    assert cube.frame(2, level=1).shape == (16, 12)
+    assert cube.nbytes == 5 * (32 * 24 + 16 * 12)
+
+
+def test_frame_size_includes_cube_share():
+    cubes = [DisplayCube(np.random.default_rng(k).normal(size=(16, 16, 4))) for k in range(2)]
+    data = prepare_frame(cubes + [None], 1)
+    assert data.images[2] is None
+    # One frame of each cube
+    assert data.nbytes == 2 * 16 * 16
+
+
+def test_cubes_released_with_cached_frames(workspace_file):
+    with Workspace(workspace_file) as ws:
+        builder = FrameBuilder(ws)
+        idx = tuple(i - 1 for i in ws.slice_indices()[0])
+        nbr_frames = ws.imgs.shape(0)[2]
+        keys = [(workspace_file, idx, frame, None, False) for frame in range(nbr_frames)]
+        cache = LRUCache(2**30)
+        for key in keys:
+            cache.put(key, *builder(key))
+        # Cubes are shared by the frames, and the cached cine accounts for them
+        assert len(builder.cubes) == len(idx)
+        assert cache.nbytes == sum(cube.nbytes for cube in builder.cubes.values())
+        assert builder(keys[0])[0].cubes[0] is builder.display_cube(idx[0])
+
+        cache.clear()
+        gc.collect()
+        assert len(builder.cubes) == 0
+
+
+def test_frame_without_anchor_points(workspace_file):
+    with Workspace(workspace_file) as ws:
+        # Empty frame of the first ROI, e.g. not drawn in DENSEanalysis
+        positions = ws.rois[0]['Position']
+        positions[1, 0], positions[1, 1] = np.empty((0, 0)), np.empty((0, 0))
+        builder = FrameBuilder(ws)
+        idx = tuple(i - 1 for i in ws.slice_indices()[0])
+        shape = ws.imgs.shape(idx[0])[:2]
+        assert np.isnan(builder.contours(0)[1]).all() and np.isfinite(builder.contours(0)[0]).all()
+        assert builder.crop(0, shape) is not None
+        for zoom in [False, True]:
+            assert builder((workspace_file, idx, 1, 0, zoom))[0].contours == []
+            assert len(builder((workspace_file, idx, 0, 0, zoom))[0].contours) == 2
+
+
+def box_contours(x0, x1, y0, y1, nbr_frames=3):
+    ''' Contours (T, 2, 2, 4) of all frames spanning [x0, x1] x [y0, y1] '''
+    square = np.array([[x0, x1, x1, x0], [y0, y0, y1, y1]], dtype=float)
+    return np.tile(square, (nbr_frames, 2, 1, 1))
+
+
+def test_centered_square():
+    box = crop_box(box_contours(40, 60, 50, 60), (128, 128), margin=0.25)
+    row_start, row_stop, col_start, col_stop = box
+    # Largest extent (20 pixels) with a 5 pixel margin on each side, same size along both axes
+    assert row_stop - row_start == col_stop - col_start == 30
+    assert (col_start, col_stop) == (35, 65)
+    assert row_start <= 50 and row_stop > 60
+
+
+def test_clamped_inside_image():
+    for contours in [box_contours(0, 10, 0, 10), box_contours(118, 127, 120, 127)]:
+        row_start, row_stop, col_start, col_stop = crop_box(contours, (128, 128))
+        assert 0 <= row_start < row_stop <= 128 and 0 <= col_start < col_stop <= 128
+        assert row_stop - row_start == col_stop - col_start
+    # Not larger than the images
+    assert crop_box(box_contours(0, 100, 0, 100), (64, 128)) == (0, 64, 0, 128)
+
+
+def test_minimum_size_and_missing_contours():
+    row_start, row_stop, col_start, col_stop = crop_box(box_contours(50, 51, 50, 51), (128, 128))
+    assert row_stop - row_start == col_stop - col_start == CROP_MIN_SIZE
+    assert crop_box(np.full((3, 2, 2, 10), np.nan), (128, 128)) is None
+    assert crop_box(np.empty((0, 2, 2, 10)), (128, 128)) is None
+
+
+def test_zoomed_frame():
+    img = np.random.default_rng(0).normal(size=(64, 64, 3))
+    cube = DisplayCube(img, (1, 99))
+    roi = {'Type': 'SA'}
+    contours = box_contours(20, 30, 24, 40)
+    crop = crop_box(contours, (64, 64))
+    data = prepare_frame([cube, None], 1, roi, contours, crop)
+    row_start, row_stop, col_start, col_stop = crop
+    assert data.images[0].shape == (row_stop - row_start, col_stop - col_start)
+    np.testing.assert_array_equal(data.images[0], cube.frame(1)[row_start:row_stop, col_start:col_stop])
+    assert data.images[1] is None
+    full = prepare_frame([cube, None], 1, roi, contours)
+    for (x, y), (full_x, full_y) in zip(data.contours, full.contours):
+        np.testing.assert_allclose(x, full_x - col_start)
+        np.testing.assert_allclose(y, full_y - row_start)
@@ -0,0 +1,106 @@
+'''
+Background saving (see saver.py): jobs in order, coalesced while waiting, released workspaces
+'''
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import saver
+import synthetic
+from backends import NativeBackend
+from saver import SaveJob, SaveWorker
+from workspace import Workspace, roi_corrections
+
+
+class Loader:
+    ''' Started backend (see backends.BackendLoader) '''
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, timeout=None):
+        return self.backend
+
+
+class RecordingBackend(NativeBackend):
+    ''' Native backend recording its calls, the first one waiting for 'resume' '''
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.resume = threading.Event()
+
+    def update_workspace_corrected(self, corrected_names, corrected_seqindex, in_file, out_file):
+        self.started.set()
+        self.resume.wait(10)
+        self.calls.append((list(corrected_names), out_file))
+        super().update_workspace_corrected(corrected_names, corrected_seqindex, in_file, out_file)
+
+
+@pytest.fixture
+def workspace_files(tmp_path):
+    filenames = [str(tmp_path / '{}.dns'.format(name)) for name in 'ab']
+    for filename in filenames:
+        synthetic.make_workspace(filename, nbr_slices=3, size=16, frames=4, nbr_rois=2)
+    return filenames
+
+
+def test_jobs_coalesced(workspace_files):
+    a, b = workspace_files
+    backend = RecordingBackend()
+    done = []
+    worker = SaveWorker(Loader(backend), on_done=done.append)
+    assert not worker.submit(SaveJob(a, a, ['base', ''], [[1, 2, 3, 4], []]))
+    backend.started.wait(10)
+    # Running job is not replaced, waiting ones are
+    assert not worker.submit(SaveJob(a, a, ['mid', ''], [[5, 6, 7], []]))
+    assert not worker.submit(SaveJob(b, b, ['base', ''], [[1, 2, 3, 4], []]))
+    assert worker.submit(SaveJob(a, a, ['apex', ''], [[8, 9, 10, 11], []]))
+    assert worker.pending() == 3
+    backend.resume.set()
+    assert worker.wait(10)
+    assert backend.calls == [(['base', ''], a), (['apex', ''], a), (['base', ''], b)]
+    assert [job.error for job in done] == [None] * 3 and worker.pending() == 0
+    with Workspace(a) as ws:
+        assert roi_corrections(ws.rois)[0] == ['apex', '']
+
+
+def test_failed_save(workspace_files, tmp_path):
+    backend = RecordingBackend()
+    backend.resume.set()
+    done = []
+    worker = SaveWorker(Loader(backend), on_done=done.append)
+    worker.submit(SaveJob(str(tmp_path / 'missing.dns'), str(tmp_path / 'missing.dns'), [''], [[]]))
+    worker.submit(SaveJob(workspace_files[0], str(tmp_path / 'out' / 'a.dns'), ['base', ''], [[1, 2, 3, 4], []]))
+    assert worker.wait(10)
+    # Following jobs still run
+    assert isinstance(done[0].error, OSError) and done[1].error is None
+    assert os.path.exists(str(tmp_path / 'out' / 'a.dns'))
+
+
+def test_released_workspace(workspace_files, monkeypatch):
+    filename = workspace_files[0]
+    # As on Windows, or for HDF5 workspaces
+    monkeypatch.setattr(saver, 'must_release', lambda filename: True)
+    backend = RecordingBackend()
+    worker = SaveWorker(Loader(backend))
+    with Workspace(filename) as ws:
+        worker.submit(SaveJob(filename, filename, ['mid', ''], [[5, 6, 7], []], ws))
+        backend.started.wait(10)
+        # Written to a temporary file, the workspace can still be read meanwhile
+        acquired = ws.imgs.lock.acquire(timeout=5)
+        if acquired:
+            ws.imgs.lock.release()
+        first = np.array(ws.imgs[0])
+        backend.resume.set()
+        assert worker.wait(10)
+        assert acquired and backend.calls == [(['mid', ''], saver.temp_file(filename))]
+        # Reopened on the new file
+        np.testing.assert_array_equal(ws.imgs[0], first)
+        with Workspace(filename) as saved:
+            assert roi_corrections(saved.rois)[0] == ['mid', '']
+            np.testing.assert_array_equal(ws.imgs[len(ws.imgs) - 1], saved.imgs[len(ws.imgs) - 1])
+    assert sorted(os.listdir(os.path.dirname(filename))) == ['a.dns', 'b.dns']
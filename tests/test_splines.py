@@ -0,0 +1,83 @@
+'''
+Batched spline interpolation (see splines.py): same contours as the per-curve splprep/splev it replaced
+'''
+
+import numpy as np
+import pytest
+from scipy.interpolate import splprep, splev
+
+import utils
+import splines
+
+
+def splprep_contour(points, closed, nbr_samples=101):
+    ''' Reference: splprep/splev of one curve, closed by repeating its first point (as utils.anchor_to_contour() did) '''
+    if closed:
+        points = np.concatenate([points, points[:1]])
+    tck, _ = splprep(points.T, s=0, per=closed)
+    return np.array(splev(np.linspace(0, 1, nbr_samples), tck))
+
+
+def random_curves(rng, closed, counts):
+    curves = []
+    for m in counts:
+        if closed:
+            angles = np.sort(rng.uniform(0, 2 * np.pi, m))
+            points = np.stack([30 + 10 * np.cos(angles), 30 + 12 * np.sin(angles)], axis=1)
+        else:
+            t = np.linspace(0, 1, m)
+            points = np.stack([20 * t, 5 * np.sin(3 * t)], axis=1)
+        curves.append(points + rng.normal(0, 0.5, points.shape))
+    return curves
+
+
+@pytest.mark.parametrize('closed', [True, False])
+def test_same_as_splprep(closed):
+    rng = np.random.default_rng(0)
+    # Several anchor counts interpolated in one call
+    curves = random_curves(rng, closed, [4, 5, 8, 8, 13, 24])
+    contours = splines.interpolate_curves(curves, closed)
+    assert contours.shape == (len(curves), 2, 101)
+    for points, contour in zip(curves, contours):
+        np.testing.assert_allclose(contour, splprep_contour(points, closed), atol=1e-9)
+
+
+def test_too_few_points():
+    with pytest.raises(ValueError):
+        splines.interpolate_curves([np.zeros((2, 2))], closed=True)
+    with pytest.raises(ValueError):
+        splines.interpolate_curves([np.zeros((3, 2))], closed=False)
+
+
+@pytest.mark.parametrize('orientation', ['SA', 'LA'])
+def test_roi_contours(orientation):
+    rng = np.random.default_rng(1)
+    # Matlab (1-based) anchors of 3 frames
+    positions = np.empty((3, 2), dtype=object)
+    for frame in range(3):
+        for c in range(2):
+            positions[frame, c] = random_curves(rng, orientation == 'SA', [8])[0] + 1
+    contours = utils.roi_contours(orientation, positions)
+    assert contours.shape == (3, 2, 2, 101)
+    for frame in range(3):
+        for c in range(2):
+            np.testing.assert_allclose(contours[frame, c], splprep_contour(positions[frame, c] - 1, orientation == 'SA'), atol=1e-9)
+
+
+@pytest.mark.parametrize('orientation', ['SA', 'LA'])
+def test_missing_anchor_points(orientation):
+    rng = np.random.default_rng(2)
+    closed = orientation == 'SA'
+    positions = np.empty((4, 2), dtype=object)
+    for frame in range(4):
+        for c in range(2):
+            positions[frame, c] = random_curves(rng, closed, [8])[0] + 1
+    # Empty frame, and too few anchor points on one contour
+    positions[1, 0], positions[1, 1] = np.empty((0, 0)), np.empty((0, 0))
+    positions[3, 1] = positions[3, 1][:splines.min_points(closed) - 1]
+    contours = utils.roi_contours(orientation, positions)
+    assert contours.shape == (4, 2, 2, 101)
+    # Only these frames have no contours
+    assert np.isnan(contours[[1, 3]]).all()
+    np.testing.assert_allclose(contours[[0, 2]], utils.roi_contours(orientation, positions[[0, 2]]))
+    assert np.isnan(utils.roi_contours(orientation, positions[1:2])).all()
@@ -0,0 +1,79 @@
+'''
+Slice suggestions of ROIs (see suggest.py)
+'''
+
+import csv
+
+import numpy as np
+
+import suggest
+from cache import SequenceBudget
+from imgcache import ImageCache, warm_workspace
+from suggest import edge_scores, header_scores
+from workspace import Workspace
+
+
+def test_suggest(workspace_file):
+    with Workspace(workspace_file) as ws:
+        slices = ws.slice_indices()
+        scores = header_scores(ws)
+        # ROI r drawn on slice r
+        np.testing.assert_array_equal(np.argmax(scores['seq_index'], axis=1), [0, 1, 2])
+        assert scores['protocol'][0, 3] == 0 and scores['protocol'][0, 0] == 1
+        for images in [True, False]:
+            suggestions = suggest.suggest(ws, images=images)
+            assert [(s['slice'], s['name'], s['seq_index']) for s in suggestions] == [
+                (0, 'base', slices[0]), (1, 'mid', slices[1]), (2, 'apex', slices[2])]
+        assert suggest.suggest(ws, min_score=1.1) == [None] * 3
+
+
+def test_loaded_slices_only(workspace_file):
+    with Workspace(workspace_file) as ws:
+        reference = edge_scores(ws)
+    budget = SequenceBudget(2**30)
+    with Workspace(workspace_file, budget) as ws:
+        # Nothing decoded nor loaded
+        assert (edge_scores(ws, loaded_only=True) == 0.5).all()
+        assert ws.imgs.loaded == {}
+        ws.imgs[ws.slice_indices()[1][0]-1]
+        nbytes = budget.nbytes
+        scores = edge_scores(ws, loaded_only=True)
+        assert budget.nbytes == nbytes and len(ws.imgs.loaded) == 1
+    np.testing.assert_allclose(scores[:, 1], reference[:, 1])
+    assert (np.delete(scores, 1, axis=1) == 0.5).all()
+
+
+def test_cached_slices(workspace_file, tmp_path):
+    with Workspace(workspace_file) as ws:
+        reference = edge_scores(ws)
+    cache = ImageCache(tmp_path / 'cache')
+    assert warm_workspace(workspace_file, cache.folder)['error'] is None
+    with Workspace(workspace_file, image_cache=cache) as ws:
+        np.testing.assert_allclose(edge_scores(ws, loaded_only=True), reference)
+        assert ws.imgs.loaded == {}
+
+
+def test_edge_scores_without_anchor_points(workspace_file):
+    with Workspace(workspace_file) as ws:
+        reference = edge_scores(ws)
+        positions = ws.rois[0]['Position']
+        for frame in range(len(positions)):
+            positions[frame, 0], positions[frame, 1] = np.empty((0, 0)), np.empty((0, 0))
+        scores = edge_scores(ws)
+    # No contours to score: no alignment with any slice
+    assert (scores[0] == 0.5).all()
+    np.testing.assert_array_equal(scores[1:], reference[1:])
+
+
+def test_corrections_file(dataset_folder, tmp_path):
+    output = tmp_path / 'suggestions.csv'
+    assert suggest.main([dataset_folder, '--output', str(output), '--no-images']) == 0
+    with open(output, newline='') as f:
+        rows = list(csv.DictReader(f))
+    # 5 workspaces of 2 ROIs (ROI numbers are 1-based)
+    assert len(rows) == 10
+    assert rows[:2] == [
+        {'workspace': 'patient0/ws0.dns', 'roi': '1', 'name': 'base', 'seq_index': '1 2 3 4', 'score': rows[0]['score']},
+        {'workspace': 'patient0/ws0.dns', 'roi': '2', 'name': 'mid', 'seq_index': '5 6 7', 'score': rows[1]['score']},
+    ]
+    assert all(float(row['score']) >= suggest.MIN_SCORE for row in rows)
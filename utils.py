@@ -1,4 +1,3 @@
-from scipy.interpolate import splprep, splev
 import numpy as np
 
 def imshow(axis, img):
@@ -18,49 +17,83 @@ def clear_figures(axes):
         axis.cla()
 
 
-def roishow(axis, endo_contours, epi_contours, orientation):
-    ''' Show ROI contours on a given plot
-    :param axis: matplotlib axis (can have something plotted already)
+def contour_lines(endo_contours, epi_contours, orientation):
+    ''' Lines to draw for ROI contours
     :param endo_contours: endo contour coordinates from n points -> (2, n)
     :param epi_contours: epi contour coordinates from n points -> (2, n)
     :param orientation: "SA" or "LA"
+    :returns: list of (x, y) coordinates arrays
     '''
-    # If short-axis, plot the two contours
+    # If short-axis, two contours
     if orientation == 'SA':
-        axis.plot(epi_contours[0], epi_contours[1], c='red')
-        axis.plot(endo_contours[0], endo_contours[1], c='red')
-    # Otherwise, consider it a single closed contour and plot
+        return [(epi_contours[0], epi_contours[1]), (endo_contours[0], endo_contours[1])]
+    # Otherwise, consider it a single closed contour
     elif orientation == 'LA':
         contours = np.concatenate([epi_contours, endo_contours, epi_contours[:, 0:1]], axis=1)
-        axis.plot(contours[0], contours[1], c='red')
+        return [(contours[0], contours[1])]
     else:
         raise ValueError('ROI orientation axis should be either SA or LA.')
 
 
-def anchor_to_contour(orientation, endo_points, epi_points):
+def roishow(axis, endo_contours, epi_contours, orientation):
+    ''' Show ROI contours on a given plot
+    :param axis: matplotlib axis (can have something plotted already)
+    :param endo_contours: endo contour coordinates from n points -> (2, n)
+    :param epi_contours: epi contour coordinates from n points -> (2, n)
+    :param orientation: "SA" or "LA"
+    '''
+    for x, y in contour_lines(endo_contours, epi_contours, orientation):
+        axis.plot(x, y, c='red')
+
+
+def anchor_to_contour(orientation, endo_points, epi_points, nbr_samples=101):
     ''' From a few anchor points, extrapolate "continuous" contours
     :param orientation: "SA" or "LA"
     :param endo_points: m endo anchor point coordinates (m, 2) (gen. from Matlab, starts from 1)
     :param epi_points: m epi anchor point coordinates (m, 2) (gen. from Matlab, starts from 1)
+    :param nbr_samples: number of contour points
+    :returns: endo and epi contours, (2, nbr_samples) each
     '''
-    # If short-axis, add back first point at the end to obtain a closed interpolation
-    if orientation == 'SA':
-        epi_points = np.concatenate([epi_points, epi_points[0:1]], axis=0)
-        endo_points = np.concatenate([endo_points, endo_points[0:1]], axis=0)
-        closed = True
-    elif orientation == 'LA':
-        closed = False
-    else:
-        raise ValueError('ROI orientation axis should be either SA or LA')
+    endo_contours, epi_contours = roi_contours(orientation, [(endo_points, epi_points)], nbr_samples)[0]
+    return endo_contours, epi_contours
+
 
-    # Consider coordinates - 1 because assumes it comes from Matlab
-    # 100 points interpolation
-    endo_interp, _ = splprep([endo_points[:,0]-1, endo_points[:,1]-1], s=0, per=closed)
-    endo_sampling = np.arange(0, 1.01, 0.01)
-    endo_contour = splev(endo_sampling, endo_interp)
+def _anchor_points(frame):
+    ''' Endo and epi anchor points of a frame ('Position' row), (m, 2) each, or None if missing '''
+    try:
+        curves = [np.asarray(points, dtype=np.float64) for points in frame[:2]]
+    except (TypeError, ValueError, IndexError):
+        return None
+    if len(curves) != 2 or any(points.ndim != 2 or points.shape[1] != 2 or not np.isfinite(points).all()
+                               for points in curves):
+        return None
+    return curves
+
+
+def roi_contours(orientation, positions, nbr_samples=101):
+    ''' Contours of all frames of a ROI, interpolated in one batch (see splines.py)
+    Same curves as splprep(s=0, per=closed) and splev, closed (periodic) for short-axis ROIs
+    :param orientation: "SA" or "LA"
+    :param positions: endo and epi anchor points of each frame ('Position' field of a ROI, (T, 2))
+    :param nbr_samples: number of contour points
+    :returns: (T, 2, 2, nbr_samples) endo then epi contours (x, y) of each frame, NaN for frames
+              with missing anchor points (or too few of them)
+    '''
+    if orientation not in ('SA', 'LA'):
+        raise ValueError('ROI orientation axis should be either SA or LA')
 
-    epi_interp, _ = splprep([epi_points[:,0]-1, epi_points[:,1]-1], s=0, per=closed)
-    epi_sampling = np.arange(0, 1.01, 0.01)
-    epi_contour = splev(epi_sampling, epi_interp)
+    # Deferred import (only needed once a ROI is displayed)
+    import splines
 
-    return np.array(endo_contour), np.array(epi_contour)
\ No newline at end of file
+    closed = orientation == 'SA'
+    contours = np.full((len(positions), 2, 2, nbr_samples), np.nan)
+    frames, curves = [], []
+    for t, frame in enumerate(positions):
+        points = _anchor_points(frame)
+        if points is not None and all(len(p) >= splines.min_points(closed) for p in points):
+            frames.append(t)
+            # Consider coordinates - 1 because assumes it comes from Matlab
+            curves += [p - 1 for p in points]
+    if frames:
+        contours[frames] = splines.interpolate_curves(curves, closed, nbr_samples).reshape(len(frames), 2, 2, nbr_samples)
+    return contours
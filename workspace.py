@@ -0,0 +1,434 @@
+import io
+import itertools
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+import matfile
+
+
+# Workspace variables needed before any image is displayed
+HEADER_VARIABLES = ['seq', 'dns', 'roi']
+
+# Slice categories a ROI can be assigned to
+SLICE_CATEGORIES = ['base', 'mid', 'apex', '2ch', '3ch', '4ch']
+# ROI types that can be corrected (short and long axis)
+ROI_TYPES = ['SA', 'LA']
+
+
+def slice_indices(dns):
+    ''' Image indices (1-based, as in Matlab) of each slice of a workspace
+    Magnitude index first, then available phase indices (z-phase can be missing)
+    :param dns: 'dns' struct array of the workspace
+    :returns: list of lists of int
+    '''
+    indices = []
+    for i in range(len(dns)):
+        img_indices = [dns[i]['MagIndex'][0]] + dns[i]['PhaIndex'][~np.isnan(dns[i]['PhaIndex'])].tolist()
+        indices.append(np.array(img_indices).astype(int).tolist())
+    return indices
+
+
+def slice_label(metadata, img_indices):
+    ''' Slice name as displayed in the slice selection drop-down menu
+    :param metadata: sequence protocol names ('seq' ProtocolName field)
+    :param img_indices: image indices (1-based) of the slice
+    :returns: string 'ProtocolName - [i] [j] [k]'
+    '''
+    text = metadata[img_indices[0]-1] + ' -'
+    for idx in img_indices:
+        text += ' [{}]'.format(idx)
+    return text
+
+
+def roi_corrections(rois):
+    ''' User-set corrections saved in a 'roi' struct array
+    :param rois: 'roi' struct array of the workspace
+    :returns: (corrected names, corrected image indices), '' and [] for ROIs without correction
+    '''
+    if 'CorrectedNames' not in rois.dtype.names:
+        return ['' for _ in range(len(rois))], [[] for _ in range(len(rois))]
+    names = [i if len(i)>0 else '' for i in rois['CorrectedNames']]
+    assoc = [[int(idx) for idx in np.atleast_1d(i)] for i in rois['CorrectedSeqIndex']]
+    return names, assoc
+
+
+class SequenceList:
+    '''
+    List-like access to the 'img' cine sequences of a workspace
+    Sequences are only read from disk when first accessed, then kept in memory,
+    or until evicted by a shared memory budget (see cache.SequenceBudget) and read again.
+    With an on-disk cache, sequences are read from it (memory-mapped) instead of decoded,
+    and cached when first decoded.
+    '''
+
+    def __init__(self, reader, budget=None, cache=None):
+        '''
+        :param reader: workspace reader
+        :param budget: optional cache.SequenceBudget the loaded sequences are accounted in
+        :param cache: optional imgcache.CacheEntry of the workspace
+        '''
+        self.reader = reader
+        self.budget = budget
+        self.cache = cache
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return self.reader.nbr_sequences()
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('Sequence index out of range.')
+        with self.lock:
+            img = self.loaded.get(k)
+            read = img is None
+            if read:
+                img = self.cache.load(k) if self.cache is not None else None
+                if img is None:
+                    img = self.reader.read_sequence(k)
+                    if self.cache is not None:
+                        img = self.cache.store(k, img)
+                self.loaded[k] = img
+        # Budget is updated outside of the lock, as it evicts sequences of other lists
+        if self.budget is not None:
+            if read:
+                self.budget.add(self, k, img.nbytes)
+            else:
+                self.budget.touch(self, k)
+        return img
+
+    def peek(self, k):
+        ''' Sequence k if available without decoding it: loaded, or memory-mapped from the on-disk
+        cache (not kept), otherwise None. The budget is not updated, so nothing is evicted.
+        '''
+        img = self.loaded.get(k)
+        if img is None and self.cache is not None:
+            img = self.cache.load(k)
+        return img
+
+    def evict(self, k):
+        ''' Drop loaded sequence k (read again on next access)
+        Not locked, so that it never waits for a read or a released workspace.
+        '''
+        self.loaded.pop(k, None)
+
+    def nbytes(self):
+        ''' Memory held by loaded sequences '''
+        return sum(img.nbytes for img in list(self.loaded.values()))
+
+    def forget(self):
+        ''' Remove loaded sequences from the budget (e.g. when closed) '''
+        if self.budget is not None:
+            self.budget.discard(self)
+
+    def shape(self, k):
+        ''' Shape of sequence k, without loading its data '''
+        img = self.loaded.get(k)
+        if img is not None:
+            return img.shape
+        with self.lock:
+            return self.reader.sequence_shape(k)
+
+
+class MatV5Reader:
+    '''
+    Workspace reader for MAT v5 files (Matlab default up to '-v7')
+    Header structs are decoded with scipy, while 'img' sequences are
+    located by byte offset and decoded one at a time.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = matfile.MatV5Index(filename)
+        self._img = None
+
+    def read_header(self):
+        # Decode header variables from their own bytes only, so that
+        # 'img' is not even skipped through
+        from scipy.io import loadmat
+        names = [name for name in HEADER_VARIABLES if name in self.index.variables]
+        raw = b''.join(self.index.raw_variable(name) for name in names)
+        return loadmat(io.BytesIO(self.index.header + raw), squeeze_me=True)
+
+    def _img_cell(self):
+        if self._img is None:
+            self._img = self.index.cell('img')
+        return self._img
+
+    def nbr_sequences(self):
+        return len(self._img_cell())
+
+    def sequence_shape(self, k):
+        return self._img_cell().shape(k)
+
+    def read_sequence(self, k):
+        return self._img_cell().load(k, squeeze_me=True)
+
+    def close(self):
+        self.index.close()
+
+
+class HDF5Reader:
+    '''
+    Workspace reader for MAT v7.3 (HDF5) files, needs h5py
+    Header structs are converted to the same layout as scipy.io.loadmat(squeeze_me=True),
+    'img' sequences are read from their own (chunked) datasets on demand.
+    '''
+
+    def __init__(self, filename):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('h5py is required to open Matlab v7.3 workspaces ({}).'.format(filename))
+        self.filename = filename
+        self.f = h5py.File(filename, 'r')
+        self.lock = threading.RLock()
+
+    def read_header(self):
+        with self.lock:
+            return {name: self._convert(self.f[name]) for name in HEADER_VARIABLES if name in self.f}
+
+    def _img_refs(self):
+        return self.f['img'][()].ravel(order='F')
+
+    def nbr_sequences(self):
+        with self.lock:
+            return self.f['img'].size
+
+    def sequence_shape(self, k):
+        with self.lock:
+            return self.f[self._img_refs()[k]].shape[::-1]
+
+    def read_sequence(self, k):
+        with self.lock:
+            return self._convert(self.f[self._img_refs()[k]])
+
+    def close(self):
+        self.f.close()
+
+    def _convert(self, obj):
+        ''' Convert a Matlab v7.3 object to its scipy.io.loadmat(squeeze_me=True) equivalent '''
+        import h5py
+        mclass = obj.attrs.get('MATLAB_class', b'')
+        mclass = mclass.decode() if isinstance(mclass, bytes) else str(mclass)
+
+        if isinstance(obj, h5py.Group):
+            if mclass != 'struct':
+                return None # Opaque objects (e.g. function handles)
+            fields = list(obj.keys())
+            if 'MATLAB_fields' in obj.attrs:
+                fields = [b''.join(field).decode() for field in obj.attrs['MATLAB_fields']]
+            values = {name: obj[name] for name in fields}
+            # Struct arrays: each field holds references to the element values
+            is_array = all(isinstance(value, h5py.Dataset) and value.dtype == h5py.ref_dtype
+                           and 'MATLAB_class' not in value.attrs for value in values.values())
+            if is_array and fields:
+                size = values[fields[0]].size
+                out = np.empty(size, dtype=[(name, object) for name in fields])
+                for name in fields:
+                    for i, ref in enumerate(values[name][()].ravel(order='F')):
+                        out[name][i] = self._convert(self.f[ref])
+            else:
+                out = np.empty(1, dtype=[(name, object) for name in fields])
+                for name in fields:
+                    out[name][0] = self._convert(values[name])
+            return out.reshape(()) if out.size == 1 else out
+
+        if obj.attrs.get('MATLAB_empty', 0):
+            return '' if mclass == 'char' else np.array([])
+        data = obj[()]
+        if mclass == 'cell':
+            out = np.empty(data.size, dtype=object)
+            for i, ref in enumerate(data.ravel(order='F')):
+                out[i] = self._convert(self.f[ref])
+            # HDF5 dimensions are the reverse of the Matlab ones
+            out = np.squeeze(out.reshape(data.shape[::-1], order='F'))
+            return out.item() if out.size == 1 else out
+        if mclass == 'char':
+            return ''.join(chr(c) for c in data.T.ravel())
+        if mclass == 'logical':
+            data = data.astype(bool)
+        arr = np.squeeze(np.asarray(data).T)
+        if not arr.shape and arr.dtype.isbuiltin:
+            return arr.item()
+        return arr
+
+
+def open_reader(filename):
+    ''' Reader matching the MAT-file version of a workspace '''
+    if matfile.mat_version(filename) == '7.3':
+        return HDF5Reader(filename)
+    # Save interrupted by a crash (see matfile.replace_variable())
+    try:
+        matfile.recover_update(filename)
+    except OSError:
+        pass
+    return MatV5Reader(filename)
+
+
+class Workspace:
+    '''
+    DENSEanalysis workspace (.dns, or .mat) opened lazily
+    'seq', 'dns' and 'roi' are parsed on opening, while the 'img' cine sequences
+    are only read when accessed through self.imgs (e.g. on slice selection).
+    '''
+
+    def __init__(self, filename, budget=None, image_cache=None):
+        '''
+        :param filename: workspace file
+        :param budget: optional cache.SequenceBudget shared with other workspaces (see SequenceList)
+        :param image_cache: optional imgcache.ImageCache the sequences are read from (and cached into)
+        '''
+        self.filename = filename
+        self.reader = open_reader(filename)
+        header = self.reader.read_header()
+
+        self.metadata = header['seq']['ProtocolName']
+        self.rois = header['roi']
+        self.dns = header['dns']
+        # If only 1 ROI entry in the data, need to force array structure
+        # (Otherwise 0-d array loaded)
+        if self.rois.size == 1:
+            self.rois = self.rois.reshape(1,)
+        # Same if only 1 slice entry:
+        if self.dns.size == 1:
+            self.dns = self.dns.reshape(1,)
+
+        self.imgs = SequenceList(self.reader, budget, image_cache.entry(filename) if image_cache is not None else None)
+        self.closed = False
+
+    def slice_indices(self):
+        return slice_indices(self.dns)
+
+    @contextmanager
+    def released(self):
+        ''' Close the file while the block runs (e.g. when overwriting it), then reopen it
+        Sequences already loaded are kept. Reading other sequences waits for the block to end,
+        so that the block can run on another thread (e.g. a background save, see saver.py).
+        '''
+        with self.imgs.lock:
+            if self.closed:
+                yield
+                return
+            self.reader.close()
+            try:
+                yield
+            finally:
+                # Not reopened if closed meanwhile
+                if not self.closed:
+                    self.reader = open_reader(self.filename)
+                    self.imgs.reader = self.reader
+
+    def close(self):
+        self.closed = True
+        self.reader.close()
+        self.imgs.forget()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+### WRITING ###
+
+# Fields added to the 'roi' struct by the QC app
+CORRECTED_FIELDS = ['CorrectedNames', 'CorrectedSeqIndex']
+
+
+def update_workspace_corrected(corrected_names, corrected_seqindex, in_file, out_file):
+    ''' Python equivalent of update_workspace_corrected.m (no Matlab needed)
+    Add or replace the 'CorrectedNames' and 'CorrectedSeqIndex' fields of the 'roi' struct
+    of in_file, and save it in out_file. Only 'roi' is written if out_file exists already,
+    other variables (e.g. 'seq' and its function handles) are never decoded.
+    :param corrected_names: corrected name of each ROI ('' if not set)
+    :param corrected_seqindex: corrected image indices of each ROI ([] if not set)
+    :param in_file: source workspace
+    :param out_file: output workspace (can be in_file)
+    '''
+    if not os.path.exists(out_file):
+        shutil.copyfile(in_file, out_file)
+    in_version, out_version = matfile.mat_version(in_file), matfile.mat_version(out_file)
+    if in_version != out_version:
+        raise ValueError('Cannot save a Matlab v{} workspace into a v{} file ({}).'.format(in_version, out_version, out_file))
+
+    if in_version == '7.3':
+        _update_hdf5_roi(corrected_names, corrected_seqindex, in_file, out_file)
+        return
+
+    index = matfile.MatV5Index(in_file)
+    try:
+        roi = index.matrix_element('roi')
+    finally:
+        index.close()
+    roi = matfile.set_struct_fields(roi, {
+        'CorrectedNames': [matfile.pack_char(name) for name in corrected_names],
+        'CorrectedSeqIndex': [matfile.pack_int64(indices) for indices in corrected_seqindex],
+    })
+    matfile.replace_variable(out_file, 'roi', matfile.compress_element(roi))
+
+
+def _h5_write_value(group, name, value, mclass):
+    ''' Write a char or int64 row vector as Matlab v7.3 does '''
+    if len(value) == 0:
+        # Empty arrays are stored as their dimensions
+        data = np.zeros(2, dtype=np.uint64)
+    elif mclass == 'char':
+        data = np.array([[ord(c)] for c in value], dtype=np.uint16)
+    else:
+        data = np.asarray(value, dtype=np.int64).reshape(-1, 1)
+    dset = group.create_dataset(name, data=data)
+    dset.attrs['MATLAB_class'] = np.bytes_(mclass)
+    if len(value) == 0:
+        dset.attrs['MATLAB_empty'] = np.uint8(1)
+    return dset
+
+
+def _update_hdf5_roi(corrected_names, corrected_seqindex, in_file, out_file):
+    ''' update_workspace_corrected() for Matlab v7.3 (HDF5) workspaces '''
+    import h5py
+
+    if os.path.abspath(in_file) != os.path.abspath(out_file):
+        with h5py.File(in_file, 'r') as src, h5py.File(out_file, 'r+') as dst:
+            if 'roi' in dst:
+                del dst['roi']
+            src.copy(src['roi'], dst, 'roi', expand_refs=True)
+
+    with h5py.File(out_file, 'r+') as f:
+        roi = f['roi']
+        refs = f.require_group('#refs#')
+        ref_names = ('qc{}'.format(i) for i in itertools.count() if 'qc{}'.format(i) not in refs)
+        fields = [b''.join(field).decode() for field in roi.attrs['MATLAB_fields']]
+        # Struct arrays store references to the values of each element
+        first = roi[fields[0]]
+        is_array = first.dtype == h5py.ref_dtype and 'MATLAB_class' not in first.attrs
+        size = first.size if is_array else 1
+
+        for field, values, mclass in [('CorrectedNames', corrected_names, 'char'),
+                                      ('CorrectedSeqIndex', corrected_seqindex, 'int64')]:
+            if len(values) != size:
+                raise ValueError("Expected {} values for field '{}', got {}.".format(size, field, len(values)))
+            if field in roi:
+                del roi[field]
+            else:
+                fields.append(field)
+            if is_array:
+                field_refs = np.empty(first.shape, dtype=h5py.ref_dtype)
+                for i, value in enumerate(values):
+                    field_refs.reshape(-1)[i] = _h5_write_value(refs, next(ref_names), value, mclass).ref
+                roi.create_dataset(field, data=field_refs)
+            else:
+                _h5_write_value(roi, field, values[0], mclass)
+
+        matlab_fields = np.empty(len(fields), dtype=object)
+        for i, field in enumerate(fields):
+            matlab_fields[i] = np.array(list(field), dtype='S1')
+        roi.attrs.create('MATLAB_fields', matlab_fields, dtype=h5py.vlen_dtype(np.dtype('S1')))